@@ -2,6 +2,8 @@
 Author: Riccardo Petrini
 """
 import os
+from typing import Optional
+
 import numpy as np
 import tensorflow as tf
 
@@ -12,16 +14,36 @@ _tf.disable_v2_behavior()
 __author__ = "Riccardo Petrini"
 
 
+def _session_config(intra_op_threads: Optional[int], inter_op_threads: Optional[int]):
+    # the generator is one chain of transposed convs: ops run one after another, so the cores go to
+    # intra-op (inside each conv) and inter-op stays small instead of TF's default of one pool per core
+    intra = intra_op_threads if intra_op_threads is not None else int(os.environ.get("TF_INTRA_OP_THREADS", os.cpu_count() or 1))
+    inter = inter_op_threads if inter_op_threads is not None else int(os.environ.get("TF_INTER_OP_THREADS", "1"))
+    return _tf.ConfigProto(intra_op_parallelism_threads=intra, inter_op_parallelism_threads=inter, allow_soft_placement=True)
+
+
 class Model:
-    """Loads the frozen WaveGAN-style graph and exposes a single generate call."""
+    """Loads the frozen WaveGAN-style graph and runs batched generate calls.
+
+    generate_batch feeds an (N, 100) latent array in one sess.run (in chunks of
+    max_batch rows) and peak-normalizes every row at once.
+    """
 
-    def __init__(self, checkpoint_root: str | None = None):
+    def __init__(
+        self,
+        checkpoint_root: Optional[str] = None,
+        intra_op_threads: Optional[int] = None,
+        inter_op_threads: Optional[int] = None,
+        max_batch: Optional[int] = None,
+    ):
         base = self._resolve_checkpoint_root(checkpoint_root)
         meta_path = os.path.join(base, "infer", "infer.meta")
         ckpt_prefix = os.path.join(base, "model.ckpt-8956")
+        self.max_batch = max_batch or int(os.environ.get("TF_MAX_BATCH", "64"))
 
         _tf.reset_default_graph()
-        self.sess = _tf.InteractiveSession()
+        self.config = _session_config(intra_op_threads, inter_op_threads)
+        self.sess = _tf.InteractiveSession(config=self.config)
 
         saver = _tf.train.import_meta_graph(meta_path, clear_devices=True)
         saver.restore(self.sess, ckpt_prefix)
@@ -30,7 +52,7 @@ class Model:
         self.input = graph.get_tensor_by_name("z:0")
         self.output = graph.get_tensor_by_name("G_z:0")[:, :, 0]
 
-    def _resolve_checkpoint_root(self, override: str | None) -> str:
+    def _resolve_checkpoint_root(self, override: Optional[str]) -> str:
         if override and os.path.isdir(override):
             return override
         cwd = os.getcwd()
@@ -46,12 +68,27 @@ class Model:
             "No checkpoints found. Set GAN_CHECKPOINT_DIR or place weights/checkpoints here."
         )
 
+    @property
+    def latent_dim(self) -> int:
+        return int(self.input.shape[1])
+
+    def generate_batch(self, z_array: np.ndarray) -> np.ndarray:
+        """(N, 100) latents -> (N, slice_len) float32, each row peak-normalized to [-1, 1]."""
+        z = np.ascontiguousarray(z_array, dtype=np.float32).reshape(-1, self.latent_dim)
+        chunks = [
+            self.sess.run(self.output, feed_dict={self.input: z[start : start + self.max_batch]})
+            for start in range(0, z.shape[0], self.max_batch)
+        ]
+        audio = np.concatenate(chunks, axis=0).astype(np.float32, copy=False)
+        peak = np.max(np.abs(audio), axis=1, keepdims=True)
+        peak[peak == 0] = 1.0
+        audio /= peak
+        return audio
+
     def generate_audio(self, z_array: np.ndarray) -> np.ndarray:
-        feed = {self.input: z_array}
-        output = self.sess.run(self.output, feed_dict=feed)
-        audio = output[0]
-        peak = np.max(np.abs(audio)) or 1.0
-        return (audio / peak).astype(np.float32)
+        """First row only, as before; use generate_batch for more than one latent."""
+        z = np.asarray(z_array, dtype=np.float32).reshape(-1, self.latent_dim)
+        return self.generate_batch(z[:1])[0]
 
 
 def load_model() -> Model:
@@ -1,11 +1,15 @@
 """Cog predictor for the concatenation GAN.
 Author: Riccardo Petrini
 """
+import os
 from typing import List
 from cog import BasePredictor, Input, Path
 
 __author__ = "Riccardo Petrini"
 _MODEL = None
+LATENT_DIM = 100
+# every latent is one more generated row and one more WAV in the zip, so N is bounded
+MAX_LATENTS = int(os.environ.get("PREDICT_MAX_LATENTS", "256"))
 
 
 class Predictor(BasePredictor):
@@ -16,28 +20,49 @@ class Predictor(BasePredictor):
     def predict(
         self,
         z: List[float] = Input(
-            description="100-D latent vector in [-1, 1]."
+            description=f"One or more 100-D latent vectors in [-1, 1], concatenated (N * 100 floats, N <= {MAX_LATENTS})."
         ),
         sample_rate: int = Input(
             default=16000,
             description="Output WAV sample rate (model trained at 16 kHz).",
         ),
     ) -> Path:
+        import io
+        import json
+        import zipfile
+
         import numpy as np
         import soundfile as sf
 
+        z_vec = np.asarray(z, dtype=np.float32)
+        if z_vec.ndim != 1 or z_vec.size == 0 or z_vec.size % LATENT_DIM:
+            raise ValueError(f"Expected a multiple of {LATENT_DIM} floats for z, got shape {z_vec.shape}.")
+        if z_vec.size // LATENT_DIM > MAX_LATENTS:
+            raise ValueError(f"At most {MAX_LATENTS} latents per request (PREDICT_MAX_LATENTS), got {z_vec.size // LATENT_DIM}.")
+        z_batch = z_vec.reshape(-1, LATENT_DIM)
+
         global _MODEL
         if _MODEL is None:
             from model import load_model
 
             _MODEL = load_model()
 
-        z_vec = np.asarray(z, dtype=np.float32)
-        if z_vec.shape != (100,):
-            raise ValueError(f"Expected 100 floats for z, got shape {z_vec.shape}.")
+        # all N latents go through one graph execution
+        audio = _MODEL.generate_batch(z_batch)
 
-        audio = _MODEL.generate_audio(z_vec.reshape(1, 100))
+        if audio.shape[0] == 1:
+            out_path = Path("out.wav")
+            sf.write(str(out_path), audio[0], samplerate=sample_rate, format="WAV")
+            return out_path
 
-        out_path = Path("out.wav")
-        sf.write(str(out_path), audio, samplerate=sample_rate, format="WAV")
+        out_path = Path("out.zip")
+        names = [f"sample_{i:03d}.wav" for i in range(audio.shape[0])]
+        # WAV float data barely compresses; storing keeps the archive step negligible next to the forward
+        with zipfile.ZipFile(str(out_path), "w", compression=zipfile.ZIP_STORED) as zf:
+            for name, row in zip(names, audio):
+                buf = io.BytesIO()
+                sf.write(buf, row, samplerate=sample_rate, format="WAV")
+                zf.writestr(name, buf.getvalue())
+            manifest = {"sample_rate": sample_rate, "files": names, "z": z_batch.tolist()}
+            zf.writestr("manifest.json", json.dumps(manifest))
         return out_path
@@ -0,0 +1,433 @@
+"""Benchmark harness for the generator inference paths.
+
+Every target runs in its own subprocess against a random-weight checkpoint
+built on the fly, so no real weights are needed and peak RSS is per target.
+Results are written as sorted JSON so two runs can be diffed or compared with
+--compare.
+Author: Riccardo Petrini
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "inference"), os.path.join(ROOT, "gan")]
+
+__author__ = "Riccardo Petrini"
+
+# target -> inference module
+VARIANTS = {
+    "base": "inference_base",
+    "short": "inference_short",
+    "cpusafe": "inference_cpusafe",
+    "fastgpu": "inference_fastgpu",
+    "deterministic": "inference_deterministic",
+    "layers": "inference_layers",
+}
+EXTRA = ("gan_cached", "numpy", "onnx", "api", "ckpt_torch", "ckpt_mmap", "ckpt_mmap_fp16")
+TARGETS = tuple(VARIANTS) + EXTRA
+DEFAULT_BATCHES = (1, 8, 32, 128)
+
+
+def _rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def _statm_mb() -> tuple:
+    """(current RSS, file-backed resident) in MB; shared pages are what other processes mapping the same file reuse."""
+    try:
+        with open("/proc/self/statm") as fh:
+            fields = fh.read().split()
+    except OSError:
+        return None, None
+    page = os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+    return int(fields[1]) * page, int(fields[2]) * page
+
+
+def _timed(fn, iters: int, warmup: int = 1) -> list:
+    for _ in range(warmup):
+        fn()
+    out = []
+    for _ in range(iters):
+        t0 = time.perf_counter()
+        fn()
+        out.append((time.perf_counter() - t0) * 1000.0)
+    return out
+
+
+def _summary(samples: list, batch: int = None) -> dict:
+    med = statistics.median(samples)
+    row = {"median_ms": med, "min_ms": min(samples), "max_ms": max(samples), "iters": len(samples)}
+    if batch is not None:
+        row["batch"] = batch
+        row["samples_per_s"] = batch * 1000.0 / med if med > 0 else None
+    return row
+
+
+def make_checkpoint(generator_cls, slice_len: int, path: str, seed: int = 0, **kwargs) -> str:
+    """Random-weight state dict for one generator class; batchnorm gets non-trivial running stats."""
+    import torch
+
+    if os.path.exists(path):
+        return path
+    torch.manual_seed(seed)
+    G = generator_cls(slice_len=slice_len, **kwargs).eval()
+    for m in G.modules():
+        if isinstance(m, torch.nn.BatchNorm1d):
+            m.running_mean.uniform_(-0.1, 0.1)
+            m.running_var.uniform_(0.5, 1.5)
+    torch.save(G.state_dict(), path)
+    return path
+
+
+def _stage_costs(final: np.ndarray, layers: dict, slice_len: int, write_wav, iters: int, tmp: str) -> dict:
+    """Cost of the post-forward stages: np.interp stretch per layer and WAV writing/encoding."""
+    from wavio import encode_wav
+
+    stretch = {}
+    for name, arr in layers.items():
+        if arr.shape[0] == slice_len:
+            continue
+        src = np.linspace(0, 1, arr.shape[0], endpoint=False)
+        dst = np.linspace(0, 1, slice_len, endpoint=False)
+        stretch[name] = _summary(_timed(lambda: np.interp(dst, src, arr), iters))
+    path = os.path.join(tmp, "stage", "out.wav")
+    return {
+        "stretch": stretch,
+        "wav_write": _summary(_timed(lambda: write_wav(final, path), iters)),
+        "wav_encode_in_memory": _summary(_timed(lambda: encode_wav(final, 16000), iters)),
+    }
+
+
+def _per_layer_ms(G, z, iters: int) -> dict:
+    """Mean wall time of each layer module over `iters` forwards, via pre/post hooks."""
+    import torch
+
+    modules = [("z_project", G.z_project)] + [(name, getattr(G, name)) for name in G.layer_names()[1:]]
+    totals = {name: 0.0 for name, _ in modules}
+    starts = {}
+    handles = []
+    for name, module in modules:
+        handles.append(module.register_forward_pre_hook(lambda m, a, n=name: starts.__setitem__(n, time.perf_counter())))
+        handles.append(
+            module.register_forward_hook(lambda m, a, o, n=name: totals.__setitem__(n, totals[n] + time.perf_counter() - starts[n]))
+        )
+    try:
+        with torch.no_grad():
+            G(z)
+            for name in totals:
+                totals[name] = 0.0
+            for _ in range(iters):
+                G(z)
+    finally:
+        for h in handles:
+            h.remove()
+    return {name: total / iters * 1000.0 for name, total in totals.items()}
+
+
+def bench_torch_variant(target: str, batches: tuple, iters: int, tmp: str) -> dict:
+    import torch
+
+    mod = importlib.import_module(VARIANTS[target])
+    # the class each inference module actually loads (inference_base uses the plain generator)
+    ckpt = make_checkpoint(mod.WaveGANGenerator, mod.SLICE_LEN, os.path.join(tmp, f"{target}_{mod.WaveGANGenerator.__module__}_{mod.SLICE_LEN}_G.pt"))
+
+    t0 = time.perf_counter()
+    G, device = mod._load_generator(ckpt)
+    load_s = time.perf_counter() - t0
+    rss_loaded = _rss_mb()
+
+    def sync():
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+
+    forward = {}
+    for batch in batches:
+        z = torch.from_numpy(np.random.uniform(-1, 1, (batch, 100)).astype(np.float32)).to(device)
+
+        def run():
+            with torch.no_grad():
+                G(z)
+            sync()
+
+        forward[str(batch)] = _summary(_timed(run, iters), batch)
+
+    z1 = torch.from_numpy(np.random.uniform(-1, 1, (1, 100)).astype(np.float32)).to(device)
+    with torch.no_grad():
+        captured = G.forward_layers(z1, G.layer_names())
+    layers = {name: out[0, 0].cpu().numpy().astype(np.float32) for name, out in captured.items()}
+    final = layers[G.layer_names()[-1]]
+    write_wav = getattr(mod, "_write_wav", None) or importlib.import_module("inference_base")._write_wav
+    return {
+        "slice_len": mod.SLICE_LEN,
+        "device": str(device),
+        "load_s": load_s,
+        "rss_after_load_mb": rss_loaded,
+        "forward": forward,
+        "per_layer_ms": _per_layer_ms(G, z1, iters),
+        "stages": _stage_costs(final, layers, mod.SLICE_LEN, write_wav, iters, tmp),
+    }
+
+
+def _bench_forward(load, generate, slice_len: int, batches: tuple, iters: int) -> dict:
+    t0 = time.perf_counter()
+    load()
+    load_s = time.perf_counter() - t0
+    rss_loaded = _rss_mb()
+    forward = {}
+    for batch in batches:
+        z = np.random.uniform(-1, 1, (batch, 100)).astype(np.float32)
+        forward[str(batch)] = _summary(_timed(lambda: generate(z), iters), batch)
+    return {"slice_len": slice_len, "load_s": load_s, "rss_after_load_mb": rss_loaded, "forward": forward}
+
+
+def bench_gan_cached(batches: tuple, iters: int, tmp: str) -> dict:
+    import torch
+    from infowavegan import WaveGANGenerator
+    from inference_cached import SLICE_LEN, WaveGANService, _write_wav
+
+    ckpt = make_checkpoint(WaveGANGenerator, SLICE_LEN, os.path.join(tmp, f"gan_cached_{SLICE_LEN}_G.pt"))
+    service = WaveGANService(ckpt)
+    out = _bench_forward(service._lazy_load, service.generate_batch, SLICE_LEN, batches, iters)
+    code = [1, 0] * 8
+    out["synthesize_wav"] = _summary(_timed(lambda: service.synthesize_wav(code), iters))
+    z = np.random.uniform(-1, 1, (1, 100)).astype(np.float32)
+    layers = {name: arr[0] for name, arr in service.generate_layer_batch(z, service.layer_names()).items()}
+    out["per_layer_ms"] = _per_layer_ms(service._G, torch.from_numpy(z).to(service.device), iters)
+    out["stages"] = _stage_costs(layers[service.layer_names()[-1]], layers, SLICE_LEN, _write_wav, iters, tmp)
+    return out
+
+
+def prepare_numpy(tmp: str, slice_len: int = 65536) -> str:
+    from infowavegan import WaveGANGenerator
+    from infowavegan_numpy import convert_checkpoint
+
+    ckpt = make_checkpoint(WaveGANGenerator, slice_len, os.path.join(tmp, f"numpy_{slice_len}_G.pt"))
+    return convert_checkpoint(ckpt, os.path.join(tmp, f"numpy_{slice_len}_G.npz"))
+
+
+def bench_numpy(batches: tuple, iters: int, tmp: str) -> dict:
+    import inference_numpy
+
+    slice_len = 65536
+    npz = os.path.join(tmp, f"numpy_{slice_len}_G.npz")
+    if not os.path.exists(npz):
+        # conversion needs torch; do it in a throwaway process so the RSS below is numpy-only
+        here = os.path.dirname(os.path.abspath(__file__))
+        code = f"import bench_inference; bench_inference.prepare_numpy({tmp!r}, {slice_len})"
+        subprocess.run([sys.executable, "-c", code], check=True, cwd=here)
+
+    holder = {}
+
+    def load():
+        holder["G"] = inference_numpy._load_generator(npz)
+
+    out = _bench_forward(load, lambda z: holder["G"](z), slice_len, batches, iters)
+    out["torch_imported"] = "torch" in sys.modules
+    return out
+
+
+def prepare_checkpoint(tmp: str, slice_len: int = 65536, fp16: bool = False) -> str:
+    from infowavegan import WaveGANGenerator
+    from checkpoint_io import convert_checkpoint
+
+    ckpt = make_checkpoint(WaveGANGenerator, slice_len, os.path.join(tmp, f"ckpt_{slice_len}_G.pt"))
+    return convert_checkpoint(ckpt, os.path.join(tmp, f"ckpt_{slice_len}_{'fp16' if fp16 else 'fp32'}.safetensors"), fp16=fp16)
+
+
+def bench_checkpoint(fmt: str, batches: tuple, iters: int, tmp: str) -> dict:
+    """torch.load vs mmap'd safetensors (checkpoint_io.load_into) for the same random 65536 checkpoint."""
+    slice_len = 65536
+    fp16 = fmt == "mmap_fp16"
+    path = os.path.join(tmp, f"ckpt_{slice_len}_G.pt")
+    if fmt != "torch":
+        path = os.path.join(tmp, f"ckpt_{slice_len}_{'fp16' if fp16 else 'fp32'}.safetensors")
+    if not os.path.exists(path):
+        # conversion unpickles the .pt; keep that out of this process's RSS
+        here = os.path.dirname(os.path.abspath(__file__))
+        code = f"import bench_inference; bench_inference.prepare_checkpoint({tmp!r}, {slice_len}, {fp16})"
+        subprocess.run([sys.executable, "-c", code], check=True, cwd=here)
+
+    import torch
+    from infowavegan import WaveGANGenerator
+    from checkpoint_io import load_generator
+
+    rss_before, _ = _statm_mb()
+    holder = {}
+
+    def load():
+        holder["G"], _ = load_generator(WaveGANGenerator, path, "cpu", slice_len=slice_len)
+        holder["statm"] = _statm_mb()
+
+    def generate(z):
+        with torch.no_grad():
+            holder["G"](torch.from_numpy(z))
+
+    out = _bench_forward(load, generate, slice_len, batches, iters)
+    rss, shared = _statm_mb()
+    out.update(
+        file_mb=os.path.getsize(path) / (1024.0 * 1024.0),
+        rss_before_load_mb=rss_before,
+        rss_loaded_mb=holder["statm"][0],
+        shared_loaded_mb=holder["statm"][1],
+        rss_mb=rss,
+        shared_mb=shared,
+    )
+    return out
+
+
+def bench_onnx(batches: tuple, iters: int, tmp: str) -> dict:
+    try:
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        return {"skipped": "onnxruntime not installed"}
+    from infowavegan import WaveGANGenerator
+    from onnx_backend import OnnxWaveGANService, export_onnx
+    import torch
+
+    slice_len = 65536
+    model = os.path.join(tmp, f"onnx_{slice_len}_G.onnx")
+    if not os.path.exists(model):
+        G = WaveGANGenerator(slice_len=slice_len).eval()
+        G.load_state_dict(torch.load(make_checkpoint(WaveGANGenerator, slice_len, os.path.join(tmp, f"onnx_{slice_len}_G.pt"))))
+        export_onnx(G, model)
+    service = OnnxWaveGANService(model, slice_len=slice_len)
+    return _bench_forward(service._lazy_load, service.generate_batch, slice_len, batches, iters)
+
+
+def bench_api(batches: tuple, iters: int, tmp: str) -> dict:
+    # the TF graph comes from a real meta/ckpt pair; it can't be rebuilt from random weights here
+    if not os.environ.get("GAN_CHECKPOINT_DIR"):
+        return {"skipped": "set GAN_CHECKPOINT_DIR to a TF checkpoint root to benchmark api/model.py"}
+    try:
+        import tensorflow  # noqa: F401
+    except ImportError:
+        return {"skipped": "tensorflow not installed"}
+    sys.path.insert(0, os.path.join(ROOT, "api"))
+    from model import Model
+
+    t0 = time.perf_counter()
+    model = Model(os.environ["GAN_CHECKPOINT_DIR"])
+    load_s = time.perf_counter() - t0
+    rss_loaded = _rss_mb()
+    forward = {}
+    for batch in batches:
+        z = np.random.uniform(-1, 1, (batch, model.latent_dim)).astype(np.float32)
+        forward[str(batch)] = _summary(_timed(lambda: model.generate_batch(z), iters), batch)
+    return {"load_s": load_s, "rss_after_load_mb": rss_loaded, "forward": forward}
+
+
+def run_target(target: str, batches: tuple, iters: int, tmp: str) -> dict:
+    t0 = time.perf_counter()
+    if target in VARIANTS:
+        out = bench_torch_variant(target, batches, iters, tmp)
+    elif target.startswith("ckpt_"):
+        out = bench_checkpoint(target[len("ckpt_"):], batches, iters, tmp)
+    else:
+        out = {"gan_cached": bench_gan_cached, "numpy": bench_numpy, "onnx": bench_onnx, "api": bench_api}[target](batches, iters, tmp)
+    out["peak_rss_mb"] = _rss_mb()
+    out["wall_s"] = time.perf_counter() - t0
+    return out
+
+
+def _environment() -> dict:
+    env = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    try:
+        env["commit"] = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        env["commit"] = None
+    try:
+        import torch
+
+        env["torch"] = torch.__version__
+        env["torch_threads"] = torch.get_num_threads()
+        env["cuda"] = torch.cuda.is_available()
+    except ImportError:
+        env["torch"] = None
+    return env
+
+
+def compare(old_path: str, new_path: str):
+    """Print forward median latency, load time and peak RSS side by side for two result files."""
+    with open(old_path, "r", encoding="utf-8") as fh:
+        old = json.load(fh)["results"]
+    with open(new_path, "r", encoding="utf-8") as fh:
+        new = json.load(fh)["results"]
+    print(f"{'target':<14} {'metric':<18} {'old':>10} {'new':>10} {'new/old':>8}")
+    for target in sorted(set(old) & set(new)):
+        a, b = old[target], new[target]
+        rows = [("load_s", a.get("load_s"), b.get("load_s")), ("peak_rss_mb", a.get("peak_rss_mb"), b.get("peak_rss_mb"))]
+        for batch in sorted(set(a.get("forward", {})) & set(b.get("forward", {})), key=int):
+            rows.append((f"forward b{batch} ms", a["forward"][batch]["median_ms"], b["forward"][batch]["median_ms"]))
+        for metric, x, y in rows:
+            if x is None or y is None:
+                continue
+            ratio = y / x if x else float("nan")
+            print(f"{target:<14} {metric:<18} {x:>10.2f} {y:>10.2f} {ratio:>8.2f}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("--targets", nargs="+", choices=TARGETS, default=list(TARGETS))
+    ap.add_argument("--batches", nargs="+", type=int, default=list(DEFAULT_BATCHES))
+    ap.add_argument("--iters", type=int, default=5)
+    ap.add_argument("--ckpt-dir", default=None, help="where random checkpoints are kept (default: a temp dir)")
+    ap.add_argument("--out", default=None, help="default: benchmarks/results/<commit>.json")
+    ap.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    ap.add_argument("--worker", choices=TARGETS, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    if args.worker:
+        out = run_target(args.worker, tuple(args.batches), args.iters, args.ckpt_dir)
+        print(json.dumps(out))
+        return
+
+    ckpt_dir = args.ckpt_dir or tempfile.mkdtemp(prefix="wavegan-bench-")
+    os.makedirs(ckpt_dir, exist_ok=True)
+    results = {}
+    for target in args.targets:
+        cmd = [sys.executable, os.path.abspath(__file__), "--worker", target, "--iters", str(args.iters), "--ckpt-dir", ckpt_dir, "--batches"]
+        cmd += [str(b) for b in args.batches]
+        print(f"[bench] {target} ...", file=sys.stderr, flush=True)
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        lines = proc.stdout.strip().splitlines()
+        if proc.returncode != 0 or not lines:
+            results[target] = {"error": (proc.stderr or "no output").strip().splitlines()[-1:]}
+            continue
+        results[target] = json.loads(lines[-1])
+
+    # collected last: importing torch here would inflate the peak RSS the children inherit across fork/exec
+    env = _environment()
+    out = args.out or os.path.join(ROOT, "benchmarks", "results", f"{env['commit'] or 'local'}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as fh:
+        json.dump({"environment": env, "batches": args.batches, "iters": args.iters, "results": results}, fh, indent=2, sort_keys=True)
+    print(out)
+
+
+if __name__ == "__main__":
+    main()
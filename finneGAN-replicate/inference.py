@@ -36,17 +36,14 @@ def load_generator(ckpt_path: str, slice_len: int = SLICE_LEN) -> Tuple[WaveGANG
     return G, device
 
 
-def generate_layers(
+def capture_layers(
     z: np.ndarray,
     generator: WaveGANGenerator,
     device: torch.device,
-    output_dir: str,
-) -> Tuple[List[Dict[str, object]], int]:
+) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
     """
-    Run one forward pass, capture upconv layers, and write raw and stretched WAVs.
-    Returns (layers, final_len) where layers is a list of dicts with name/raw_path/stretched_path/raw_len/stretched_len.
+    Run one forward pass and return channel 0 of every upconv layer plus the final waveform, as float32 arrays.
     """
-    os.makedirs(output_dir, exist_ok=True)
     z_t = torch.from_numpy(z).to(torch.float32).to(device)
 
     captured: Dict[str, torch.Tensor] = {}
@@ -72,9 +69,19 @@ def generate_layers(
         for h in hooks:
             h.remove()
 
-    final = final_t.numpy()[0, 0, :].astype(np.float32)
-    final_len = final.shape[0]
+    layers = {name: t[0, 0, :].cpu().numpy().astype(np.float32) for name, t in captured.items()}
+    return layers, final_t.numpy()[0, 0, :].astype(np.float32)
+
+
+def stretched_audio(layer: np.ndarray, final_len: int) -> np.ndarray:
+    """The samples written to <name>_stretched.wav: resampled to the final length and peak-normalized."""
+    x = _resample_to_len(layer, final_len)
+    m = np.max(np.abs(x))
+    return x / m if m > 0 else x
 
+
+def write_layers(captured: Dict[str, np.ndarray], final_len: int, output_dir: str) -> List[Dict[str, object]]:
+    os.makedirs(output_dir, exist_ok=True)
     order = ["upconv1", "upconv2", "upconv3", "upconv4"]
     if "upconv5" in captured:
         order.append("upconv5")
@@ -83,7 +90,7 @@ def generate_layers(
     for name in order:
         if name not in captured:
             continue
-        t = captured[name][0, 0, :].cpu().numpy().astype(np.float32)
+        t = captured[name]
         raw_path = os.path.join(output_dir, f"{name}_raw.wav")
         stretched_path = os.path.join(output_dir, f"{name}_stretched.wav")
 
@@ -98,4 +105,19 @@ def generate_layers(
             "stretched_len": int(final_len),
         })
 
-    return results, final_len
+    return results
+
+
+def generate_layers(
+    z: np.ndarray,
+    generator: WaveGANGenerator,
+    device: torch.device,
+    output_dir: str,
+) -> Tuple[List[Dict[str, object]], int]:
+    """
+    Run one forward pass, capture upconv layers, and write raw and stretched WAVs.
+    Returns (layers, final_len) where layers is a list of dicts with name/raw_path/stretched_path/raw_len/stretched_len.
+    """
+    captured, final = capture_layers(z, generator, device)
+    final_len = final.shape[0]
+    return write_layers(captured, final_len, output_dir), final_len
@@ -4,9 +4,9 @@ import tempfile
 import numpy as np
 import torch
 from cog import BasePredictor, Path, Input
-import whisper
 
-from inference import load_generator, generate_layers, SAMPLE_RATE, SLICE_LEN
+from inference import load_generator, capture_layers, stretched_audio, write_layers, SAMPLE_RATE, SLICE_LEN
+from transcription import OpenAIWhisperBackend, TranscriptionEngine
 
 
 class Predictor(BasePredictor):
@@ -18,7 +18,9 @@ class Predictor(BasePredictor):
         
         whisper_name = os.environ.get("WHISPER_MODEL", "small")
         whisper_device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.whisper = whisper.load_model(whisper_name, device=whisper_device)
+        backend = OpenAIWhisperBackend(whisper_name, device=whisper_device)
+        # queued + batched + cached by PCM hash; concurrent predictions share one decode batch
+        self.asr = TranscriptionEngine(lambda: backend, f"openai-whisper/{whisper_name}")
 
     def predict(
         self,
@@ -26,6 +28,10 @@ class Predictor(BasePredictor):
             default=None,
             description="Optional RNG seed for reproducibility of latent and categorical code.",
         ),
+        transcribe_layers: str = Input(
+            default="upconv5",
+            description="Comma-separated layers (or final) whose stretched audio is transcribed (one Whisper batch).",
+        ),
     ) -> Any:
         rng = np.random.default_rng(seed)
 
@@ -34,8 +40,16 @@ class Predictor(BasePredictor):
         z = rng.uniform(-1.0, 1.0, size=(1, 100)).astype(np.float32)
         z[0, :16] = categorical.astype(np.float32)
 
+        captured, final = capture_layers(z, self.generator, self.device)
+        final_len = final.shape[0]
+
+        # hand Whisper the 16 kHz float32 arrays right away; it transcribes while the WAVs are written
+        sources = dict(captured, final=final)
+        names = [n.strip() for n in transcribe_layers.split(",") if n.strip() in sources]
+        pending = {name: self.asr.submit(stretched_audio(sources[name], final_len)) for name in names}
+
         out_dir = tempfile.mkdtemp(prefix="finnegan_layers_")
-        layers, final_len = generate_layers(z, self.generator, self.device, out_dir)
+        layers = write_layers(captured, final_len, out_dir)
 
         layer_paths: Dict[str, Dict[str, Path]] = {}
         for layer in layers:
@@ -45,7 +59,7 @@ class Predictor(BasePredictor):
                 "stretched": Path(layer["stretched_path"]),
             }
 
-        transcription = self._transcribe(layer_paths.get("upconv5", {}).get("stretched"))
+        transcriptions = {name: fut.result()[0] for name, fut in pending.items()}
 
         return {
             "latent": z[0].tolist(),
@@ -53,43 +67,6 @@ class Predictor(BasePredictor):
             "sample_rate": SAMPLE_RATE,
             "final_len": final_len,
             "layers": layer_paths,
-            "transcription": transcription,
-        }
-
-    def _transcribe(self, stretched_path: Optional[Path]) -> Dict[str, Any]:
-        if stretched_path is None:
-            return {}
-
-        result = self.whisper.transcribe(
-            str(stretched_path),
-            language=None,
-            word_timestamps=True,
-            verbose=False,
-        )
-
-        out: Dict[str, Any] = {
-            "language": result.get("language"),
-            "duration": float(result.get("duration", 0.0)),
-            "text": result.get("text", "").strip(),
-            "segments": [],
-            "words": [],
+            "transcription": transcriptions[names[0]] if names else {},
+            "transcriptions": transcriptions,
         }
-
-        for seg in result.get("segments", []) or []:
-            s = float(seg.get("start", 0.0))
-            e = float(seg.get("end", s))
-            txt = (seg.get("text") or "").strip()
-            seg_entry: Dict[str, Any] = {"start": s, "end": e, "text": txt}
-            wlist = []
-            for w in seg.get("words", []) or []:
-                w_item = {
-                    "start": float(w.get("start", 0.0)),
-                    "end": float(w.get("end", 0.0)),
-                    "text": (w.get("word") or w.get("text") or "").strip(),
-                }
-                wlist.append(w_item)
-                out["words"].append(w_item)
-            if wlist:
-                seg_entry["words"] = wlist
-            out["segments"].append(seg_entry)
-        return out
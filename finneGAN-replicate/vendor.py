@@ -0,0 +1,53 @@
+"""Copy shared modules from gan/ into this Cog build context.
+
+cog builds from this directory only, so modules shared with the servers are
+vendored here instead of imported from ../gan. Edit the source, then:
+
+    python vendor.py          rewrite the copies
+    python vendor.py --check  exit 1 if a copy differs from its source (run before `cog push`)
+"""
+import argparse
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# copy in this directory -> source, relative to the repository root
+VENDORED = {
+    "transcription.py": "gan/transcription.py",
+}
+
+
+def render(source: str) -> str:
+    with open(os.path.join(HERE, "..", source), "r", encoding="utf-8") as fh:
+        body = fh.read()
+    return f"# Vendored from {source} by vendor.py; edit the source and re-run it.\n" + body
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--check", action="store_true", help="only report copies that are out of date")
+    args = ap.parse_args()
+
+    stale = []
+    for name, source in VENDORED.items():
+        path = os.path.join(HERE, name)
+        expected = render(source)
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                current = fh.read()
+        except FileNotFoundError:
+            current = None
+        if current == expected:
+            continue
+        stale.append(name)
+        if not args.check:
+            with open(path, "w", encoding="utf-8") as fh:
+                fh.write(expected)
+            print(f"{name} <- {source}")
+    if args.check and stale:
+        print(f"out of date: {', '.join(stale)} (run python vendor.py)", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
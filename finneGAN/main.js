@@ -79,6 +79,50 @@ async function generateLayer(layerName, categoricalCode, serverUrl = SERVER_URL)
   return { url: fullAudioUrl, transcription: data.transcription || null };
 }
 
+// Generate every traversal layer from ONE forward (same latent) in a single packed response
+async function generateLayerBundle(layerNames, categoricalCode, serverUrl = SERVER_URL) {
+  const response = await fetch(`${serverUrl}/generate_layer_bundle`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({
+      categorical_code: categoricalCode,
+      layers: layerNames,
+      stretched: true,
+      dtype: 'float32'
+    })
+  });
+
+  if (!response.ok) {
+    const err = await response.json().catch(() => ({}));
+    throw new Error(err.detail || err.error || 'Generation failed');
+  }
+
+  return parseLayerBundle(await response.arrayBuffer());
+}
+
+// Bundle layout: "LSB1" | uint32 manifest length | manifest JSON | pad to 4 | PCM payloads
+// (item offsets are relative to the payload section, every payload 4-byte aligned)
+function parseLayerBundle(arrayBuffer) {
+  const view = new DataView(arrayBuffer);
+  const magic = String.fromCharCode(...new Uint8Array(arrayBuffer, 0, 4));
+  if (magic !== 'LSB1') throw new Error('Unexpected layer bundle format');
+
+  const manifestLen = view.getUint32(4, true);
+  const manifest = JSON.parse(new TextDecoder().decode(new Uint8Array(arrayBuffer, 8, manifestLen)));
+  const headLen = 8 + manifestLen;
+  const base = headLen + ((4 - (headLen % 4)) % 4);
+
+  const layers = {};
+  manifest.items.forEach((item) => {
+    const offset = base + item.offset;
+    layers[item.name] = manifest.dtype === 'int16'
+      ? Float32Array.from(new Int16Array(arrayBuffer, offset, item.length), (v) => v / 32767)
+      : new Float32Array(arrayBuffer, offset, item.length);
+  });
+  console.log('[Transcription] layer bundle', manifest.items.map((item) => item.name));
+  return { sampleRate: manifest.sample_rate, layers };
+}
+
 const AUDIO_LAYER_NAMES = ['upconv1', 'upconv2', 'upconv3', 'upconv4', 'upconv5'];
 
 const transcriptionPanel = document.getElementById('transcription-inner')
@@ -370,6 +414,7 @@ const audioManager = (() => {
   let traversalCode = null;
   let traversalId = 0;
   let traversalRender = null;
+  let traversalBundle = null;
   let firstAscentPending = true;
 
   const layerState = AUDIO_LAYER_NAMES.map(() => ({
@@ -401,6 +446,7 @@ const audioManager = (() => {
     traversalId += 1;
     traversalCode = generateRandomCode();
     traversalRender = { latentRendered: false };
+    traversalBundle = null;
     console.log('[Transcription] traversal start', traversalId, currentDirectionLabel(newDirection), 'code', JSON.stringify(traversalCode));
 
     layerState.forEach((state) => {
@@ -457,6 +503,18 @@ const audioManager = (() => {
     }
   }
 
+  // All layers of a traversal come from one bundle request, shared by every requestLayer call
+  function loadTraversalBundle() {
+    if (!traversalBundle || traversalBundle.traversalId !== traversalId) {
+      const promise = generateLayerBundle(AUDIO_LAYER_NAMES, traversalCode);
+      traversalBundle = { traversalId, promise };
+      promise.catch(() => {
+        if (traversalBundle && traversalBundle.promise === promise) traversalBundle = null;
+      });
+    }
+    return traversalBundle.promise;
+  }
+
   async function requestLayer(index) {
     const ctx = ensureContext();
     ensureTraversal(traversalDirection || 1);
@@ -478,16 +536,14 @@ const audioManager = (() => {
 
     const promise = (async () => {
       try {
-        const { url, transcription } = await generateLayer(layerName, state.code);
+        const bundle = await loadTraversalBundle();
         if (requestTraversalId !== traversalId) return;
 
-        state.transcription = transcription || null;
-        const res = await fetch(url);
-        const arrayBuffer = await res.arrayBuffer();
-        if (requestTraversalId !== traversalId) return;
-
-        const audioBuffer = await ctx.decodeAudioData(arrayBuffer);
-        if (requestTraversalId !== traversalId) return;
+        const samples = bundle.layers[layerName];
+        if (!samples) throw new Error(`Layer ${layerName} missing from bundle`);
+        state.transcription = null;
+        const audioBuffer = ctx.createBuffer(1, samples.length, bundle.sampleRate);
+        audioBuffer.copyToChannel(samples, 0);
 
         state.buffer = audioBuffer;
         startLayerPlayback(index);
@@ -731,6 +787,7 @@ const audioManager = (() => {
     traversalCode = null;
     traversalDirection = 0;
     traversalRender = null;
+    traversalBundle = null;
     firstAscentPending = true;
     activeLayerIndex = -1;
   }
@@ -0,0 +1,211 @@
+"""Bounded disk store behind every URL the servers hand out.
+
+Each request writes into its own namespace (static/batch/req_<ms>_<id>/ or
+static/evolution/req_<ms>_<id>/), so concurrent requests never overwrite each
+other. Files are written to a temp file and renamed into place, and every
+committed namespace gets a manifest.json listing its files, sizes, code and
+seed.
+
+A janitor thread drops namespaces older than GAN_ARTIFACT_TTL_S, then the
+oldest ones until the total is under GAN_ARTIFACT_MAX_MB. It runs every
+GAN_ARTIFACT_SWEEP_S and right after a commit that goes over budget.
+Namespaces already on disk are picked up at startup.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+from metrics import stage
+from wavio import write_bytes
+
+__author__ = "Riccardo Petrini"
+
+MANIFEST_NAME = "manifest.json"
+
+
+def _dir_bytes(path: str) -> int:
+    total = 0
+    for entry in os.scandir(path):
+        if entry.is_file(follow_symlinks=False):
+            total += entry.stat(follow_symlinks=False).st_size
+    return total
+
+
+class Namespace:
+    """One request's directory inside the store; nothing in it is shared with other requests.
+
+    Used as a context manager around the job that fills it: a job that raises
+    has its directory removed, and one that returns without commit() is
+    committed on exit, so no directory escapes the janitor.
+    """
+
+    def __init__(self, store: "ArtifactStore", kind: str, name: str):
+        self.store = store
+        self.kind = kind
+        self.name = name
+        self.path = os.path.join(store.root, kind, name)
+        self.created = time.time()
+        self.committed = False
+        # created on first write, so requests that fail before producing anything leave nothing behind
+
+    def __enter__(self) -> "Namespace":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.discard()
+        elif not self.committed:
+            self.commit()
+        return False
+
+    def discard(self):
+        """Remove whatever a failed request wrote; it was never registered with the store."""
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def file(self, filename: str) -> str:
+        return os.path.join(self.path, filename)
+
+    def write(self, filename: str, data) -> str:
+        os.makedirs(self.path, exist_ok=True)
+        with stage("write"):
+            return write_bytes(data, self.file(filename))
+
+    def commit(self, meta: Optional[dict] = None) -> dict:
+        """Write the manifest (file list + sizes) and hand the namespace to the janitor."""
+        os.makedirs(self.path, exist_ok=True)
+        files = []
+        for entry in sorted(os.scandir(self.path), key=lambda e: e.name):
+            if entry.is_file() and entry.name != MANIFEST_NAME and not entry.name.endswith(".tmp"):
+                files.append({"name": entry.name, "bytes": entry.stat().st_size})
+        manifest = {"kind": self.kind, "id": self.name, "created": self.created, "files": files}
+        if meta:
+            manifest["meta"] = meta
+        write_bytes(json.dumps(manifest).encode("utf-8"), self.file(MANIFEST_NAME))
+        self.store._register(self, _dir_bytes(self.path))
+        self.committed = True
+        return manifest
+
+
+class ArtifactStore:
+    """Disk store for files handed out by URL, bounded by age and total size.
+
+    Every request gets its own namespace directory (root/<kind>/req_<ms>_<id>).
+    Files are written temp-then-rename, and each namespace ends with a
+    manifest.json. A janitor thread removes namespaces older than ttl_s and
+    then the oldest ones until the total is under max_bytes. The same check
+    also runs inline on commit, so the budget holds between sweeps. Existing
+    namespaces are picked up from disk at startup.
+    """
+
+    def __init__(self, root: str, kinds=("batch", "evolution"), ttl_s: float = 3600.0, max_bytes: int = 1 << 30, sweep_s: float = 60.0):
+        self.root = root
+        self.kinds = tuple(kinds)
+        self.ttl_s = ttl_s
+        self.max_bytes = max_bytes
+        self.sweep_s = sweep_s
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self.evicted_ttl = 0
+        self.evicted_budget = 0
+        self.last_sweep = None
+        for kind in self.kinds:
+            os.makedirs(os.path.join(root, kind), exist_ok=True)
+        self._scan()
+        self._stop = threading.Event()
+        self._janitor = None
+
+    def _scan(self):
+        found = []
+        for kind in self.kinds:
+            for ns in os.scandir(os.path.join(self.root, kind)):
+                if ns.is_dir() and ns.name.startswith("req_"):
+                    # namespaces without a manifest are leftovers of interrupted requests; the TTL still applies
+                    found.append((ns.stat().st_mtime, ns.path, _dir_bytes(ns.path)))
+        for created, path, size in sorted(found):
+            self._entries[path] = (created, size)
+            self._bytes += size
+
+    def namespace(self, kind: str) -> Namespace:
+        if kind not in self.kinds:
+            raise ValueError(f"unknown artifact kind '{kind}'")
+        return Namespace(self, kind, f"req_{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}")
+
+    def _register(self, ns: Namespace, size: int):
+        with self._lock:
+            old = self._entries.pop(ns.path, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[ns.path] = (ns.created, size)
+            self._bytes += size
+            over = self._bytes > self.max_bytes
+        if over:
+            self.sweep()
+
+    def sweep(self) -> int:
+        """Drop expired namespaces, then the oldest until under budget; returns how many were removed."""
+        now = time.time()
+        doomed = []
+        with self._lock:
+            for path, (created, size) in list(self._entries.items()):
+                if now - created <= self.ttl_s:
+                    break
+                doomed.append(path)
+                self._entries.pop(path)
+                self._bytes -= size
+                self.evicted_ttl += 1
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                path, (_, size) = self._entries.popitem(last=False)
+                doomed.append(path)
+                self._bytes -= size
+                self.evicted_budget += 1
+            self.last_sweep = now
+        for path in doomed:
+            shutil.rmtree(path, ignore_errors=True)
+        return len(doomed)
+
+    def _run(self):
+        while not self._stop.wait(self.sweep_s):
+            try:
+                self.sweep()
+            except OSError:
+                pass
+
+    def start(self) -> "ArtifactStore":
+        if self._janitor is None:
+            self._janitor = threading.Thread(target=self._run, name="artifact-janitor", daemon=True)
+            self._janitor.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def url_for(self, path: str) -> str:
+        return "/" + os.path.relpath(path, start=self.root).replace("\\", "/")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "root": self.root,
+                "namespaces": len(self._entries),
+                "bytes": self._bytes,
+                "budget": self.max_bytes,
+                "ttl_s": self.ttl_s,
+                "evicted_ttl": self.evicted_ttl,
+                "evicted_budget": self.evicted_budget,
+                "last_sweep": self.last_sweep,
+            }
+
+    @classmethod
+    def from_env(cls, root: str = "static") -> "ArtifactStore":
+        return cls(
+            root,
+            ttl_s=float(os.environ.get("GAN_ARTIFACT_TTL_S", "3600")),
+            max_bytes=int(os.environ.get("GAN_ARTIFACT_MAX_MB", "1024")) << 20,
+            sweep_s=float(os.environ.get("GAN_ARTIFACT_SWEEP_S", "60")),
+        ).start()
@@ -0,0 +1,95 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+import numpy as np
+
+__author__ = "Riccardo Petrini"
+
+
+class MicroBatcher:
+    """Collects concurrent single-latent requests and runs them as one batched forward.
+
+    Callers block in submit(); a single worker thread drains the queue, waiting at
+    most max_wait_ms for up to max_batch rows, then calls forward_fn on the stacked
+    (N, latent_dim) array and hands each caller its own row of the result.
+    """
+
+    def __init__(self, forward_fn: Callable[[np.ndarray], np.ndarray], max_batch: int = 16, max_wait_ms: float = 5.0):
+        self.forward_fn = forward_fn
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait_s = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue: "queue.Queue[tuple[np.ndarray, Future, float]]" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_hist: dict[int, int] = {}
+        self._requests = 0
+        self._wait_total_s = 0.0
+        self._wait_max_s = 0.0
+        self._last_wait_s = 0.0
+        self._worker = threading.Thread(target=self._run, name="wavegan-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, z: np.ndarray) -> Future:
+        """Queue one (1, latent_dim) or (latent_dim,) latent; the future resolves to its output row."""
+        fut: Future = Future()
+        self._queue.put((np.asarray(z, dtype=np.float32).reshape(-1), fut, time.perf_counter()))
+        return fut
+
+    def generate(self, z: np.ndarray, timeout: Optional[float] = None) -> np.ndarray:
+        return self.submit(z).result(timeout=timeout)
+
+    def _collect(self):
+        first = self._queue.get()
+        items = [first]
+        deadline = time.perf_counter() + self.max_wait_s
+        while len(items) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            started = time.perf_counter()
+            waits = [started - t for _, _, t in items]
+            with self._stats_lock:
+                n = len(items)
+                self._batch_hist[n] = self._batch_hist.get(n, 0) + 1
+                self._requests += n
+                self._wait_total_s += sum(waits)
+                self._wait_max_s = max(self._wait_max_s, max(waits))
+                self._last_wait_s = waits[-1]
+
+            try:
+                out = self.forward_fn(np.stack([z for z, _, _ in items], axis=0))
+            except BaseException as exc:  # propagate to every waiting caller
+                for _, fut, _ in items:
+                    fut.set_exception(exc)
+                continue
+            for i, (_, fut, _) in enumerate(items):
+                fut.set_result(out[i])
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            batches = sum(self._batch_hist.values())
+            return {
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait_s * 1000.0,
+                "queue_depth": self._queue.qsize(),
+                "requests": self._requests,
+                "batches": batches,
+                "mean_batch_size": (self._requests / batches) if batches else 0.0,
+                "batch_size_histogram": {str(k): v for k, v in sorted(self._batch_hist.items())},
+                "wait_ms": {
+                    "mean": (self._wait_total_s / self._requests * 1000.0) if self._requests else 0.0,
+                    "max": self._wait_max_s * 1000.0,
+                    "last": self._last_wait_s * 1000.0,
+                },
+            }
@@ -0,0 +1,77 @@
+import json
+import struct
+from typing import Optional
+
+import numpy as np
+
+__author__ = "Riccardo Petrini"
+
+MAGIC = b"LSB1"
+_ALIGN = 4
+
+
+def _pad(n: int) -> int:
+    return (-n) % _ALIGN
+
+
+def to_pcm(arr: np.ndarray, dtype: str = "float32", normalize: bool = True) -> np.ndarray:
+    """Peak-normalize a mono waveform and cast it to the bundle sample type."""
+    x = np.asarray(arr, dtype=np.float32).reshape(-1)
+    if normalize:
+        peak = float(np.max(np.abs(x))) if x.size else 0.0
+        if peak > 0:
+            x = x / np.float32(peak)
+    if dtype == "int16":
+        return np.round(np.clip(x, -1.0, 1.0) * 32767.0).astype("<i2")
+    if dtype == "float32":
+        return x.astype("<f4", copy=False)
+    raise ValueError(f"Unsupported dtype '{dtype}'")
+
+
+def pack_bundle(entries: list[tuple[str, np.ndarray]], sample_rate: int, dtype: str = "float32", meta: Optional[dict] = None) -> bytearray:
+    """Pack PCM payloads into one buffer.
+
+    Layout: MAGIC | uint32 manifest length | manifest JSON | pad | payloads.
+    The payload section starts on a 4-byte boundary and item offsets are relative
+    to it, each one also 4-byte aligned, so the client can view every payload as a
+    Float32Array/Int16Array without copying.
+    """
+    pcm = [(name, to_pcm(arr, dtype)) for name, arr in entries]
+
+    items = []
+    offset = 0
+    for name, x in pcm:
+        items.append({"name": name, "offset": offset, "length": int(x.shape[0]), "bytes": int(x.nbytes)})
+        offset += x.nbytes + _pad(x.nbytes)
+    manifest = {"sample_rate": sample_rate, "dtype": dtype, "items": items}
+    if meta:
+        manifest.update(meta)
+    body = json.dumps(manifest, separators=(",", ":")).encode("utf-8")
+
+    head_len = len(MAGIC) + 4 + len(body)
+    base = head_len + _pad(head_len)
+    buf = bytearray(base + offset)
+    buf[: len(MAGIC)] = MAGIC
+    struct.pack_into("<I", buf, len(MAGIC), len(body))
+    buf[len(MAGIC) + 4 : head_len] = body
+    for item, (_, x) in zip(items, pcm):
+        start = base + item["offset"]
+        np.frombuffer(buf, dtype=x.dtype, count=x.shape[0], offset=start)[:] = x
+    return buf
+
+
+def unpack_bundle(data) -> tuple[dict, dict[str, np.ndarray]]:
+    """Inverse of pack_bundle; returns (manifest, {name: zero-copy array view})."""
+    view = memoryview(data)
+    if bytes(view[: len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a layer bundle")
+    (size,) = struct.unpack_from("<I", view, len(MAGIC))
+    manifest = json.loads(bytes(view[len(MAGIC) + 4 : len(MAGIC) + 4 + size]).decode("utf-8"))
+    head_len = len(MAGIC) + 4 + size
+    base = head_len + _pad(head_len)
+    dtype = "<i2" if manifest["dtype"] == "int16" else "<f4"
+    arrays = {
+        it["name"]: np.frombuffer(view, dtype=dtype, count=it["length"], offset=base + it["offset"])
+        for it in manifest["items"]
+    }
+    return manifest, arrays
@@ -0,0 +1,220 @@
+"""Optional compiled forward for WaveGANService.generate_batch (GAN_BACKEND).
+
+torchscript traces, freezes and runs optimize_for_inference once per batch
+bucket (BATCH_BUCKETS; batches are zero-padded up to the bucket) and saves each
+graph under GAN_COMPILE_DIR, keyed by variant, slice_len, bucket, device, torch
+version and checkpoint fingerprint, so a restart only loads them. compile uses
+torch.compile with inductor's kernel cache in the same directory.
+
+Every graph is checked against the eager module (PARITY_ATOL) before use. A
+cached graph that fails is deleted and rebuilt once; if that still fails the
+error is logged once, reported as "fallback" in stats() and the service runs
+eager from then on. Layer routes always run eager.
+
+    python compiled_generator.py --ckpt <G.pt>   pre-build all buckets, print eager vs compiled timings
+"""
+import hashlib
+import os
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+import torch
+
+__author__ = "Riccardo Petrini"
+
+BACKENDS = ("eager", "torchscript", "compile")
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32)
+PARITY_ATOL = 1e-4
+
+
+def bucket_for(n: int, buckets: tuple = BATCH_BUCKETS) -> int:
+    """Smallest bucket that fits n rows; batches above the largest bucket are split by the caller."""
+    for b in buckets:
+        if n <= b:
+            return b
+    return buckets[-1]
+
+
+def artifact_name(G: torch.nn.Module, fingerprint: str, batch: int, device: torch.device) -> str:
+    variant = type(G).__module__
+    ident = f"{variant}:{G.slice_len}:{batch}:{device}:{torch.__version__}:{fingerprint}"
+    digest = hashlib.sha256(ident.encode("utf-8")).hexdigest()[:16]
+    return f"{variant}_{G.slice_len}_b{batch}_{device.type}_{digest}.pt"
+
+
+def freeze(G: torch.nn.Module, batch: int, device: torch.device) -> torch.jit.ScriptModule:
+    """Trace one forward at a fixed batch size, freeze weights into the graph and run the inference passes."""
+    z = torch.zeros((batch, G.z_project.in_features), dtype=torch.float32, device=device)
+    with torch.no_grad():
+        traced = torch.jit.trace(G.eval(), z, check_trace=False)
+    return torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+
+def parity_check(eager: torch.nn.Module, compiled, batch: int, device: torch.device, atol: float = PARITY_ATOL, seed: int = 0) -> float:
+    """Max abs difference between eager and compiled outputs on a random batch; raises if above atol."""
+    gen = torch.Generator().manual_seed(seed)
+    z = (torch.rand((batch, eager.z_project.in_features), generator=gen) * 2 - 1).to(device)
+    with torch.no_grad():
+        diff = float((eager(z) - compiled(z)).abs().max())
+    if not diff <= atol:
+        raise RuntimeError(f"compiled generator diverges from eager (max abs diff {diff:.3g} > {atol:.3g})")
+    return diff
+
+
+class CompiledGenerator:
+    """Frozen per-batch-bucket graphs of one WaveGANGenerator, cached on disk.
+
+    backend="torchscript" traces + freezes the module for each bucket the first
+    time it is needed and saves it to cache_dir, so a restart only pays for
+    torch.jit.load. backend="compile" wraps the module with torch.compile and
+    points inductor's own kernel cache at cache_dir. Every new graph is checked
+    against the eager module before it is used. If a build or parity check
+    fails, the error is logged once and kept, and every later call runs the
+    eager module instead of retrying.
+    """
+
+    def __init__(
+        self,
+        G: torch.nn.Module,
+        fingerprint: str,
+        device: torch.device,
+        backend: str = "torchscript",
+        cache_dir: Optional[str] = None,
+        atol: float = PARITY_ATOL,
+    ):
+        if backend not in BACKENDS or backend == "eager":
+            raise ValueError(f"backend must be one of {BACKENDS[1:]}")
+        self.G = G
+        self.fingerprint = fingerprint
+        self.device = device
+        self.backend = backend
+        self.cache_dir = cache_dir
+        self.atol = atol
+        self._graphs = {}
+        self._info = {}
+        self._lock = threading.Lock()
+        self.failure: Optional[str] = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            if backend == "compile":
+                os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.join(cache_dir, "inductor"))
+
+    def _build(self, batch: int):
+        t0 = time.perf_counter()
+        source = "built"
+        if self.backend == "compile":
+            # inductor graphs are dynamic=False per bucket; the kernel cache handles persistence
+            graph = torch.compile(self.G, dynamic=False)
+        else:
+            path = os.path.join(self.cache_dir, artifact_name(self.G, self.fingerprint, batch, self.device)) if self.cache_dir else None
+            graph = None
+            if path and os.path.exists(path):
+                try:
+                    graph = torch.jit.load(path, map_location=self.device)
+                    source = "disk"
+                except (RuntimeError, OSError):
+                    graph = None
+            if graph is None:
+                graph = freeze(self.G, batch, self.device)
+                if path:
+                    tmp = f"{path}.{os.getpid()}.tmp"
+                    torch.jit.save(graph, tmp)
+                    os.replace(tmp, path)
+        try:
+            diff = parity_check(self.G, graph, batch, self.device, self.atol)
+        except RuntimeError:
+            if source != "disk":
+                raise
+            # a stale or corrupt artifact; drop it and check a fresh build once
+            os.remove(path)
+            return self._build(batch)
+        self._info[batch] = {"source": source, "build_s": time.perf_counter() - t0, "max_abs_diff": diff}
+        return graph
+
+    def graph(self, batch: int):
+        b = bucket_for(batch)
+        graph = self._graphs.get(b)
+        if graph is None:
+            with self._lock:
+                graph = self._graphs.get(b)
+                if graph is None:
+                    if self.failure is not None:
+                        return self.G
+                    try:
+                        graph = self._build(b)
+                    except Exception as exc:
+                        self.failure = f"bucket {b}: {type(exc).__name__}: {exc}"
+                        print(f"[compiled] {self.backend} disabled, falling back to eager: {self.failure}", flush=True)
+                        return self.G
+                    self._graphs[b] = graph
+        return graph
+
+    def warm(self, buckets: tuple = BATCH_BUCKETS):
+        for b in buckets:
+            self.graph(b)
+
+    def __call__(self, z: torch.Tensor) -> torch.Tensor:
+        """Forward an (N, latent) batch through the bucketed graphs, padding the last chunk with zeros."""
+        if self.failure is not None:
+            return self.G(z)
+        n = z.shape[0]
+        top = BATCH_BUCKETS[-1]
+        outs = []
+        for start in range(0, n, top):
+            chunk = z[start : start + top]
+            rows = chunk.shape[0]
+            b = bucket_for(rows)
+            if rows < b:
+                chunk = torch.cat([chunk, chunk.new_zeros((b - rows, chunk.shape[1]))])
+            outs.append(self.graph(b)(chunk)[:rows])
+        return outs[0] if len(outs) == 1 else torch.cat(outs)
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "cache_dir": self.cache_dir,
+            "fallback": self.failure,
+            "buckets": {str(b): dict(info) for b, info in sorted(self._info.items())},
+        }
+
+
+def main():
+    import argparse
+    import json
+
+    from checkpoint_io import load_generator
+    from infowavegan import WaveGANGenerator
+    from service_base import checkpoint_fingerprint
+
+    ap = argparse.ArgumentParser(description="Build and parity-check frozen generator graphs for every batch bucket.")
+    ap.add_argument("--ckpt", default=os.environ.get("GAN_CHECKPOINT", "checkpoint/epoch450_step166500_G.pt"))
+    ap.add_argument("--slice-len", type=int, default=65536)
+    ap.add_argument("--backend", choices=BACKENDS[1:], default="torchscript")
+    ap.add_argument("--out", default=os.environ.get("GAN_COMPILE_DIR", "compiled"))
+    ap.add_argument("--buckets", type=int, nargs="+", default=list(BATCH_BUCKETS))
+    args = ap.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    # same file and fingerprint the service will load, so the artifacts are found at serve time
+    G, path = load_generator(WaveGANGenerator, args.ckpt, device, slice_len=args.slice_len)
+    compiled = CompiledGenerator(G, checkpoint_fingerprint(path), device, args.backend, args.out)
+    compiled.warm(tuple(bucket_for(b) for b in args.buckets))
+    if compiled.failure is not None:
+        raise SystemExit(f"no usable {args.backend} graphs: {compiled.failure}")
+
+    z = np.random.uniform(-1, 1, (4, G.z_project.in_features)).astype(np.float32)
+    z_t = torch.from_numpy(z).to(device)
+    with torch.no_grad():
+        for label, fn in (("eager", G), (args.backend, compiled)):
+            fn(z_t)
+            t0 = time.perf_counter()
+            for _ in range(5):
+                fn(z_t)
+            print(f"{label}: {(time.perf_counter() - t0) / 5 * 1000.0:.1f} ms / batch of 4")
+    print(json.dumps(compiled.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
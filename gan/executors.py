@@ -0,0 +1,123 @@
+"""Bounded thread pools for the async FastAPI handlers.
+
+Handlers hand generator work to a BoundedExecutor (GAN_WORKERS threads plus
+GAN_QUEUE slots). With micro-batching these threads mostly wait on the batcher,
+so the pool size bounds requests in the generator rather than compute. Whisper
+work goes to transcription.py's engine, which has its own queue and worker.
+A full pool answers 429 with a Retry-After estimated from the backlog and the
+mean compute time; responses carry X-Queue-Time-Ms and X-Compute-Time-Ms.
+"""
+import asyncio
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+__author__ = "Riccardo Petrini"
+
+
+class QueueFull(Exception):
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(f"{name} queue is full")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class BoundedExecutor:
+    """Thread pool with a hard cap on in-flight + queued jobs.
+
+    run() raises QueueFull instead of queueing past `workers + max_queue`, so the
+    server can shed load with a 429 rather than letting latency grow unbounded.
+    Each call also reports how long the job waited and how long it ran.
+    """
+
+    def __init__(self, name: str, workers: int = 1, max_queue: int = 16):
+        self.name = name
+        self.workers = max(1, int(workers))
+        self.capacity = self.workers + max(0, int(max_queue))
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._capacity_freed = threading.Condition(self._lock)
+        self._pending = 0
+        self._rejected = 0
+        self._completed = 0
+        self._compute_ewma_s = 0.0
+
+    def _acquire(self, wait_s: float = 0.0) -> bool:
+        deadline = time.monotonic() + wait_s
+        with self._lock:
+            while self._pending >= self.capacity:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._rejected += 1
+                    return False
+                self._capacity_freed.wait(remaining)
+            self._pending += 1
+            return True
+
+    def _release(self, compute_s: Optional[float] = None):
+        with self._lock:
+            self._pending -= 1
+            self._capacity_freed.notify()
+            if compute_s is not None:
+                self._completed += 1
+                a = 0.2
+                self._compute_ewma_s = compute_s if self._completed == 1 else (1 - a) * self._compute_ewma_s + a * compute_s
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog should have drained, at least 1."""
+        with self._lock:
+            backlog = self._pending / self.workers
+            return max(1, int(math.ceil(backlog * self._compute_ewma_s)))
+
+    def _submit(self, fn, args, kwargs):
+        submitted = time.perf_counter()
+        stamps = {}
+
+        def job():
+            stamps["start"] = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                stamps["end"] = time.perf_counter()
+
+        fut = self._pool.submit(job)
+        # release from the pool side so a cancelled request can't free a slot its job still occupies
+        fut.add_done_callback(lambda _: self._release(stamps["end"] - stamps["start"] if "end" in stamps else None))
+        return fut, submitted, stamps
+
+    @staticmethod
+    def _timing(submitted: float, stamps: dict) -> dict:
+        return {
+            "queue_ms": (stamps["start"] - submitted) * 1000.0,
+            "compute_ms": (stamps["end"] - stamps["start"]) * 1000.0,
+        }
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn in the pool; returns (result, {"queue_ms", "compute_ms"})."""
+        if not self._acquire():
+            raise QueueFull(self.name, self.retry_after())
+        fut, submitted, stamps = self._submit(fn, args, kwargs)
+        result = await asyncio.wrap_future(fut)
+        return result, self._timing(submitted, stamps)
+
+    def call(self, fn, *args, wait_s: float = 0.0, **kwargs):
+        """Blocking run() for plain threads (a stream's producer); waits up to wait_s for capacity before QueueFull."""
+        if not self._acquire(wait_s):
+            raise QueueFull(self.name, self.retry_after())
+        fut, submitted, stamps = self._submit(fn, args, kwargs)
+        result = fut.result()
+        return result, self._timing(submitted, stamps)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "capacity": self.capacity,
+                "in_flight": min(self._pending, self.workers),
+                "queued": max(0, self._pending - self.workers),
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "mean_compute_ms": self._compute_ewma_s * 1000.0,
+            }
@@ -1,50 +1,110 @@
-import os
-import uuid
+import threading
+from typing import Optional
 import numpy as np
 import torch
-import scipy.io.wavfile
+from checkpoint_io import load_generator
 from infowavegan import WaveGANGenerator
+from metrics import LAYER_REQUESTS, stage
+# the torch-free parts, re-exported for worker_pool / waveform_store / benchmarks
+from latents import make_latent
+from service_base import (
+    SAMPLE_RATE,
+    SLICE_LEN,
+    AudioCache,
+    WaveGANServiceBase,
+    _stretch,
+    _write_wav,
+    checkpoint_fingerprint,
+    load_service_from_env,
+)
 
 __author__ = "Riccardo Petrini"
 
-SAMPLE_RATE = 16000
-SLICE_LEN = 65536
 
+class WaveGANService(WaveGANServiceBase):
+    """The torch generator (eager, or a CompiledGenerator for batched forwards) behind WaveGANServiceBase."""
 
-def _write_wav(arr: np.ndarray, path: str, normalize: bool = True) -> str:
-    x = arr.astype(np.float32)
-    if normalize:
-        peak = np.max(np.abs(x))
-        if peak > 0:
-            x = x / peak
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    scipy.io.wavfile.write(path, SAMPLE_RATE, x)
-    return path
-
-
-class WaveGANService:
-    def __init__(self, ckpt_path: str, slice_len: int = SLICE_LEN, sample_rate: int = SAMPLE_RATE):
-        self.ckpt_path = ckpt_path
-        self.slice_len = slice_len
-        self.sample_rate = sample_rate
+    def __init__(
+        self,
+        ckpt_path: str,
+        slice_len: int = SLICE_LEN,
+        sample_rate: int = SAMPLE_RATE,
+        backend: str = "eager",
+        compile_dir: Optional[str] = None,
+    ):
+        super().__init__(ckpt_path, slice_len=slice_len, sample_rate=sample_rate, backend=backend, compile_dir=compile_dir)
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self._G = None
+        self._compiled = None
+        # hooks fire on every forward of the shared module, so hooked and plain passes must not overlap
+        self._forward_lock = threading.RLock()
 
     def _lazy_load(self):
         if self._G is None:
-            G = WaveGANGenerator(slice_len=self.slice_len).to(self.device).eval()
-            G.load_state_dict(torch.load(self.ckpt_path, map_location=self.device))
+            with stage("load"):
+                G, _ = load_generator(WaveGANGenerator, self.ckpt_path, self.device, slice_len=self.slice_len)
+                if self.backend != "eager":
+                    from compiled_generator import CompiledGenerator
+
+                    self._compiled = CompiledGenerator(G, self._fingerprint, self.device, self.backend, self.compile_dir)
             self._G = G
         return self._G
 
-    def generate(self, z: np.ndarray) -> np.ndarray:
+    def backend_stats(self) -> dict:
+        return self._compiled.stats() if self._compiled is not None else {"backend": self.backend}
+
+    def profile_layers(self, batch: int = 1, iters: int = 10) -> dict:
+        """Per-layer time / FLOPs / activation bytes of the eager generator at this batch size (see profiling.py)."""
+        from profiling import profile_layers
+
+        G = self._lazy_load()
+        with self._forward_lock:
+            return profile_layers(G, batch=batch, iters=iters, device=self.device)
+
+    def generate_batch(self, z: np.ndarray) -> np.ndarray:
+        """One forward over an (N, 100) latent batch; returns (N, slice_len) float32."""
         G = self._lazy_load()
-        z_t = torch.from_numpy(z).to(torch.float32).to(self.device)
-        y = G(z_t).detach().cpu().numpy()[0, 0, :]
-        return y.astype(np.float32)
+        forward = self._compiled if self._compiled is not None else G
+        z_t = torch.from_numpy(np.ascontiguousarray(z, dtype=np.float32)).to(self.device)
+        with torch.no_grad(), self._forward_lock, stage("forward"), self._trace("forward", z_t.shape[0]):
+            y = forward(z_t)[:, 0, :].cpu().numpy()
+        return y.astype(np.float32, copy=False)
+
+    def layer_names(self) -> list[str]:
+        return self._lazy_load().layer_names()
+
+    def generate_layer(self, z: np.ndarray, layer: str, stretched: bool = True) -> np.ndarray:
+        """Forward only up to `layer` and return channel 0 of its output (row 0).
 
-    def generate_layers(self, z: np.ndarray, output_dir: str):
-        os.makedirs(output_dir, exist_ok=True)
+        "final" is accepted as an alias for the last upconv. With stretched=True the
+        activation is resampled to slice_len like the *_stretched.wav files.
+        """
+        G = self._lazy_load()
+        name = G.layer_names()[-1] if layer == "final" else layer
+        z_t = torch.from_numpy(np.ascontiguousarray(z, dtype=np.float32)).to(self.device)
+        with torch.no_grad(), self._forward_lock, stage("forward"):
+            out = G.forward_to(z_t, name)
+        LAYER_REQUESTS.inc(layer)
+        arr = out[0, 0, :].cpu().numpy().astype(np.float32)
+        if not stretched:
+            return arr
+        with stage("stretch"):
+            return _stretch(arr, self.slice_len)
+
+    def generate_layer_batch(self, z: np.ndarray, layers: list[str]) -> dict[str, np.ndarray]:
+        """One truncated forward over an (N, 100) batch; returns {layer: (N, len) float32} from channel 0."""
+        G = self._lazy_load()
+        last = G.layer_names()[-1]
+        names = [last if name == "final" else name for name in layers]
+        z_t = torch.from_numpy(np.ascontiguousarray(z, dtype=np.float32)).to(self.device)
+        with torch.no_grad(), self._forward_lock, stage("forward"), self._trace("layers", z_t.shape[0]):
+            captured = G.forward_layers(z_t, names)
+        for layer in layers:
+            LAYER_REQUESTS.inc(layer)
+        return {layer: captured[name][:, 0, :].cpu().numpy().astype(np.float32, copy=False) for layer, name in zip(layers, names)}
+
+    def _capture_layers(self, z: np.ndarray):
+        """One hooked forward; returns ({layer: channel 0 of row 0, left on the device}, final waveform of row 0)."""
         G = self._lazy_load()
         captured = {}
 
@@ -54,73 +114,23 @@ class WaveGANService:
             return _fn
 
         handles = []
-        try:
-            handles.append(G.z_batchnorm.register_forward_hook(hook("z_project")))
-            handles.append(G.upconv0.register_forward_hook(hook("upconv0")))
-            handles.append(G.upconv1.register_forward_hook(hook("upconv1")))
-            handles.append(G.upconv2.register_forward_hook(hook("upconv2")))
-            handles.append(G.upconv3.register_forward_hook(hook("upconv3")))
-            handles.append(G.upconv4.register_forward_hook(hook("upconv4")))
-            if hasattr(G, "upconv5"):
-                handles.append(G.upconv5.register_forward_hook(hook("upconv5")))
-
-            final = G(torch.from_numpy(z).to(torch.float32).to(self.device)).detach().cpu()
-        finally:
-            for h in handles:
-                h.remove()
-
+        with self._forward_lock, stage("capture"), self._trace("capture", z.shape[0]):
+            try:
+                handles.append(G.z_batchnorm.register_forward_hook(hook("z_project")))
+                handles.append(G.upconv0.register_forward_hook(hook("upconv0")))
+                handles.append(G.upconv1.register_forward_hook(hook("upconv1")))
+                handles.append(G.upconv2.register_forward_hook(hook("upconv2")))
+                handles.append(G.upconv3.register_forward_hook(hook("upconv3")))
+                handles.append(G.upconv4.register_forward_hook(hook("upconv4")))
+                if hasattr(G, "upconv5"):
+                    handles.append(G.upconv5.register_forward_hook(hook("upconv5")))
+
+                final = G(torch.from_numpy(z).to(torch.float32).to(self.device)).detach().cpu()
+            finally:
+                for h in handles:
+                    h.remove()
+
+        for name in captured:
+            LAYER_REQUESTS.inc(name)
         final_np = final.numpy()[0, 0, :].astype(np.float32)
-        final_len = final_np.shape[0]
-
-        order = ["z_project", "upconv0", "upconv1", "upconv2", "upconv3", "upconv4"]
-        if "upconv5" in captured:
-            order.append("upconv5")
-
-        layers = []
-        for name in order:
-            arr = captured[name][0, 0, :].cpu().numpy().astype(np.float32)
-            raw_path = os.path.join(output_dir, f"{name}_raw.wav")
-            stretched_path = os.path.join(output_dir, f"{name}_stretched.wav")
-            _write_wav(arr, raw_path)
-            stretched = np.interp(
-                np.linspace(0.0, 1.0, num=final_len, endpoint=False),
-                np.linspace(0.0, 1.0, num=arr.shape[0], endpoint=False),
-                arr,
-            ).astype(np.float32)
-            _write_wav(stretched, stretched_path)
-            layers.append(
-                {
-                    "name": name,
-                    "raw_path": raw_path,
-                    "stretched_path": stretched_path,
-                    "raw_len": int(arr.shape[0]),
-                    "stretched_len": int(final_len),
-                }
-            )
-
-        final_raw = os.path.join(output_dir, "final_raw.wav")
-        _write_wav(final_np, final_raw)
-        layers.append(
-            {
-                "name": "final",
-                "raw_path": final_raw,
-                "stretched_path": final_raw,
-                "raw_len": int(final_len),
-                "stretched_len": int(final_len),
-            }
-        )
-        return layers, final_len
-
-    def synthesize_and_store(self, code: list[int], batch_dir: str):
-        z = np.random.uniform(-1, 1, (1, 100)).astype(np.float32)
-        z[0, : len(code)] = np.array(code, dtype=np.float32)
-        audio = self.generate(z)
-        fname = f"gen_{uuid.uuid4().hex}.wav"
-        path = os.path.join(batch_dir, fname)
-        _write_wav(audio, path)
-        return path, z[0]
-
-
-def load_service_from_env() -> WaveGANService:
-    ckpt = os.environ.get("GAN_CHECKPOINT", "checkpoint/epoch450_step166500_G.pt")
-    return WaveGANService(ckpt)
+        return {name: out[0, 0, :] for name, out in captured.items()}, final_np
@@ -0,0 +1,19 @@
+from typing import Optional
+
+import numpy as np
+
+__author__ = "Riccardo Petrini"
+
+
+def make_latent(code: list[int], seed: Optional[int] = None) -> np.ndarray:
+    """(1, 100) latent with the categorical code in the first slots.
+
+    With a seed the noise part is drawn from its own generator, so the same
+    (code, seed) always gives the same z; without one the global RNG is used.
+    """
+    if seed is None:
+        z = np.random.uniform(-1, 1, (1, 100)).astype(np.float32)
+    else:
+        z = np.random.default_rng(seed).uniform(-1, 1, (1, 100)).astype(np.float32)
+    z[0, : len(code)] = np.array(code, dtype=np.float32)
+    return z
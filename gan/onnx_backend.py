@@ -0,0 +1,209 @@
+"""ONNX export and an onnxruntime-backed service.
+
+export_onnx turns any WaveGANGenerator variant (16384/65536, dim 48/64/96,
+with or without batchnorm) into ONNX with a dynamic batch axis. Output "audio"
+is the final waveform; unless exported with --no-layers, z_project, upconv0..
+are extra outputs. OnnxWaveGANService runs that model in an onnxruntime CPU
+session without torch, with the same generate*/synthesize_* interface,
+caching, batching, store and pool support. GAN_ONNX_MODEL defaults to the
+checkpoint path with .onnx.
+
+The command line exports and prints parity, latency and throughput against
+torch per batch size as JSON:
+
+    python onnx_backend.py --ckpt <G.pt> --variant infowavegan_fastgpu --slice-len 16384
+"""
+import json
+import os
+import threading
+from typing import Optional
+
+import numpy as np
+
+from metrics import LAYER_REQUESTS, stage
+from service_base import SAMPLE_RATE, SLICE_LEN, WaveGANServiceBase
+
+__author__ = "Riccardo Petrini"
+
+AUDIO_OUTPUT = "audio"
+OPSET = 17
+
+
+def export_onnx(G, path: str, with_layers: bool = True, opset: int = OPSET) -> str:
+    """Export any WaveGANGenerator variant to ONNX with a dynamic batch axis.
+
+    The graph input is "z" (N, latent_dim). The output "audio" is the final
+    waveform; with_layers=True also exposes every earlier layer (z_project,
+    upconv0..) as an extra output, so intermediate activations can be fetched
+    from the same session. slice_len and the layer order are written to the
+    model metadata.
+    """
+    import onnx
+    import torch
+
+    names = G.layer_names()
+    hidden = names[:-1] if with_layers else []
+
+    class _Outputs(torch.nn.Module):
+        def __init__(self, generator):
+            super().__init__()
+            self.G = generator
+
+        def forward(self, z):
+            captured = self.G.forward_layers(z, names if hidden else names[-1:])
+            return tuple([captured[names[-1]]] + [captured[name] for name in hidden])
+
+    outputs = [AUDIO_OUTPUT] + hidden
+    z = torch.zeros((2, G.z_project.in_features), dtype=torch.float32)
+    was_training = G.training
+    G.eval()
+    try:
+        with torch.no_grad():
+            torch.onnx.export(
+                _Outputs(G).cpu(),
+                (z,),
+                path,
+                input_names=["z"],
+                output_names=outputs,
+                dynamic_axes={name: {0: "batch"} for name in ["z"] + outputs},
+                opset_version=opset,
+                dynamo=False,
+            )
+    finally:
+        G.train(was_training)
+
+    model = onnx.load(path)
+    meta = {"slice_len": str(G.slice_len), "layers": json.dumps(names), "variant": type(G).__module__}
+    for key, value in meta.items():
+        prop = model.metadata_props.add()
+        prop.key, prop.value = key, value
+    onnx.save(model, path)
+    return path
+
+
+class OnnxWaveGANService(WaveGANServiceBase):
+    """WaveGANServiceBase backed by an onnxruntime CPU session instead of a torch module.
+
+    Same public interface as WaveGANService (generate*, synthesize_*, caching,
+    batching, store) without importing torch; layer requests read the extra
+    graph outputs written by export_onnx and fail with ValueError if the model
+    was exported without them.
+    """
+
+    def __init__(self, model_path: str, slice_len: Optional[int] = None, sample_rate: int = SAMPLE_RATE, threads: int = 0):
+        super().__init__(model_path, slice_len=slice_len or SLICE_LEN, sample_rate=sample_rate, backend="onnxruntime")
+        self.threads = threads
+        self._session = None
+        self._layers = None
+        self._outputs = None
+        self._load_lock = threading.Lock()
+        if slice_len is None:
+            self._lazy_load()
+
+    def _lazy_load(self):
+        if self._session is None:
+            with self._load_lock:
+                if self._session is None:
+                    with stage("load"):
+                        import onnxruntime as ort
+
+                        opts = ort.SessionOptions()
+                        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                        if self.threads:
+                            opts.intra_op_num_threads = self.threads
+                        session = ort.InferenceSession(self.ckpt_path, sess_options=opts, providers=["CPUExecutionProvider"])
+                        meta = session.get_modelmeta().custom_metadata_map
+                        self.slice_len = int(meta.get("slice_len", self.slice_len))
+                        self._layers = json.loads(meta["layers"]) if "layers" in meta else []
+                        self._outputs = {o.name for o in session.get_outputs()}
+                        self._session = session
+        return self._session
+
+    def backend_stats(self) -> dict:
+        return {"backend": self.backend, "model": self.ckpt_path, "outputs": sorted(self._outputs or ())}
+
+    def layer_names(self) -> list[str]:
+        self._lazy_load()
+        return list(self._layers)
+
+    def _output_for(self, layer: str) -> str:
+        names = self.layer_names()
+        if layer == "final" or (names and layer == names[-1]):
+            return AUDIO_OUTPUT
+        if layer not in names:
+            raise ValueError(f"Unknown layer(s): {[layer]}")
+        if layer not in self._outputs:
+            raise ValueError(f"layer '{layer}' was not exported; re-export with with_layers=True")
+        return layer
+
+    def _run(self, z: np.ndarray, outputs: list[str]) -> list[np.ndarray]:
+        session = self._lazy_load()
+        with stage("forward"):
+            return session.run(outputs, {"z": np.ascontiguousarray(z, dtype=np.float32)})
+
+    def generate_batch(self, z: np.ndarray) -> np.ndarray:
+        (y,) = self._run(z, [AUDIO_OUTPUT])
+        return y[:, 0, :].astype(np.float32, copy=False)
+
+    def generate_layer_batch(self, z: np.ndarray, layers: list[str]) -> dict[str, np.ndarray]:
+        wanted = [self._output_for(layer) for layer in layers]
+        unique = list(dict.fromkeys(wanted))
+        got = dict(zip(unique, self._run(z, unique)))
+        for layer in layers:
+            LAYER_REQUESTS.inc(layer)
+        return {layer: got[name][:, 0, :].astype(np.float32, copy=False) for layer, name in zip(layers, wanted)}
+
+    def profile_layers(self, batch: int = 1, iters: int = 10) -> dict:
+        raise ValueError("per-layer profiling needs the torch generator; run profiling.py on the checkpoint instead")
+
+    def _capture_layers(self, z: np.ndarray):
+        names = self.layer_names()
+        out = self.generate_layer_batch(z[:1], names)
+        final = out[names[-1]][0]
+        return {name: out[name][0] for name in names}, final
+
+
+def main():
+    import argparse
+    import importlib
+    import time
+
+    import torch
+
+    ap = argparse.ArgumentParser(description="Export a WaveGANGenerator checkpoint to ONNX and benchmark onnxruntime against torch.")
+    ap.add_argument("--ckpt", default=os.environ.get("GAN_CHECKPOINT", "checkpoint/epoch450_step166500_G.pt"))
+    ap.add_argument("--variant", default="infowavegan", help="inference/ module holding the WaveGANGenerator class")
+    ap.add_argument("--slice-len", type=int, default=65536)
+    ap.add_argument("--out", default=None, help="defaults to <ckpt>.onnx")
+    ap.add_argument("--no-layers", action="store_true", help="export only the final audio output")
+    ap.add_argument("--batch", type=int, nargs="+", default=[1, 8, 32])
+    ap.add_argument("--iters", type=int, default=10)
+    args = ap.parse_args()
+
+    cls = importlib.import_module(args.variant).WaveGANGenerator
+    G = cls(slice_len=args.slice_len).eval()
+    G.load_state_dict(torch.load(args.ckpt, map_location="cpu"))
+    out = args.out or os.path.splitext(args.ckpt)[0] + ".onnx"
+    export_onnx(G, out, with_layers=not args.no_layers)
+
+    service = OnnxWaveGANService(out)
+    report = {"model": out, "variant": args.variant, "slice_len": service.slice_len, "results": []}
+    for batch in args.batch:
+        z = np.random.uniform(-1, 1, (batch, G.z_project.in_features)).astype(np.float32)
+        with torch.no_grad():
+            ref = G(torch.from_numpy(z))[:, 0, :].numpy()
+        row = {"batch": batch, "max_abs_diff": float(np.abs(service.generate_batch(z) - ref).max())}
+        for label, fn in (("torch", lambda: G(torch.from_numpy(z))), ("onnxruntime", lambda: service.generate_batch(z))):
+            with torch.no_grad():
+                fn()
+                t0 = time.perf_counter()
+                for _ in range(args.iters):
+                    fn()
+            ms = (time.perf_counter() - t0) / args.iters * 1000.0
+            row[label] = {"latency_ms": ms, "samples_per_s": batch * 1000.0 / ms}
+        report["results"].append(row)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
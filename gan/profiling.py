@@ -0,0 +1,307 @@
+"""Where generator time goes.
+
+profile_layers(G, batch) times z_project (with its batchnorm) and every UpConv
+with pre/post forward hooks, synchronizing CUDA at each timestamp. It reports
+each layer's median ms and share of the summed layer time, an analytic FLOP
+count (2*N*in*out for the Linear, 2*N*Cin*Lin*Cout*K for a transposed conv),
+the output activation bytes, and the dominant layer. Weights are optional on
+the command line; timing does not depend on them.
+
+TraceSampler records a torch.profiler Chrome trace for a GAN_PROFILE_RATE share
+of production forwards, one trace at a time. The directory (GAN_PROFILE_DIR) is
+created with the first trace and capped at GAN_PROFILE_MAX_TRACES files and
+GAN_PROFILE_MAX_MB by deleting the oldest. Forwards in pool workers or on
+onnxruntime are not traced.
+
+    python profiling.py --variant infowavegan infowavegan_fastgpu --batch 1 8
+"""
+import contextlib
+import json
+import os
+import random
+import statistics
+import threading
+import time
+import uuid
+from typing import Optional
+
+import numpy as np
+import torch
+
+__author__ = "Riccardo Petrini"
+
+_NULL = contextlib.nullcontext()
+
+
+def _sync(device: torch.device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def _layer_modules(G: torch.nn.Module) -> dict:
+    """{layer: (first module, last module)}; z_project spans the Linear and its batchnorm like the captured layer."""
+    names = G.layer_names()
+    spans = {}
+    for name in names:
+        if name == "z_project":
+            spans[name] = (G.z_project, getattr(G, "z_batchnorm", G.z_project))
+        else:
+            module = getattr(G, name)
+            spans[name] = (module, module)
+    return spans
+
+
+def _flops(name: str, first: torch.nn.Module, in_shape: tuple, out_shape: tuple) -> int:
+    """Multiply-adds x2 for the layer's matmul/conv; bias, batchnorm and activation are ignored (<1%)."""
+    n = in_shape[0]
+    if name == "z_project":
+        return 2 * n * in_shape[-1] * int(np.prod(out_shape[1:]))
+    conv = getattr(first, "conv", None)
+    kernel = getattr(conv, "kernel_size", (25,))
+    kernel = kernel[0] if isinstance(kernel, tuple) else int(kernel)
+    # transposed conv: every input sample scatters Cout * K products
+    return 2 * n * in_shape[1] * in_shape[2] * out_shape[1] * kernel
+
+
+def profile_layers(
+    G: torch.nn.Module,
+    batch: int = 1,
+    iters: int = 10,
+    warmup: int = 2,
+    device: Optional[torch.device] = None,
+    latent_dim: int = 100,
+    seed: int = 0,
+) -> dict:
+    """Per-layer wall time, FLOP estimate and activation size for one batch size.
+
+    Pre/post forward hooks timestamp z_project and every UpConv on each of
+    `iters` forwards (after `warmup` untimed ones); CUDA is synchronized at
+    each timestamp so times are per layer, not per launch. Reports the median,
+    each layer's share of the summed layer time and which layer dominates.
+    """
+    device = device or next(G.parameters(), torch.zeros(())).device
+    spans = _layer_modules(G)
+    stamps: dict = {}
+    shapes: dict = {}
+
+    def pre(name):
+        def _fn(_, inputs):
+            _sync(device)
+            stamps[name] = time.perf_counter()
+            shapes.setdefault(name, [tuple(inputs[0].shape), None, 0])
+        return _fn
+
+    def post(name):
+        def _fn(_, __, out):
+            _sync(device)
+            times[name].append(time.perf_counter() - stamps[name])
+            if shapes[name][1] is None:
+                shapes[name][1] = tuple(out.shape)
+                shapes[name][2] = out.numel() * out.element_size()
+        return _fn
+
+    z = torch.from_numpy(np.random.default_rng(seed).uniform(-1, 1, (batch, latent_dim)).astype(np.float32)).to(device)
+    with torch.no_grad():
+        for _ in range(warmup):
+            G(z)
+        times = {name: [] for name in spans}
+        handles = []
+        try:
+            for name, (first, last) in spans.items():
+                handles.append(first.register_forward_pre_hook(pre(name)))
+                handles.append(last.register_forward_hook(post(name)))
+            totals = []
+            for _ in range(iters):
+                _sync(device)
+                start = time.perf_counter()
+                G(z)
+                _sync(device)
+                totals.append(time.perf_counter() - start)
+        finally:
+            for h in handles:
+                h.remove()
+
+    layers = {}
+    for name, (first, _) in spans.items():
+        in_shape, out_shape, act_bytes = shapes[name]
+        ms = statistics.median(times[name]) * 1000.0
+        flops = _flops(name, first, in_shape, out_shape)
+        layers[name] = {
+            "ms": ms,
+            "ms_min": min(times[name]) * 1000.0,
+            "gflop": flops / 1e9,
+            "gflops_per_s": flops / 1e9 / (ms / 1000.0) if ms > 0 else 0.0,
+            "activation_bytes": int(act_bytes),
+            "output_shape": list(out_shape),
+        }
+    layer_ms = sum(v["ms"] for v in layers.values())
+    for v in layers.values():
+        v["share"] = v["ms"] / layer_ms if layer_ms else 0.0
+    return {
+        "batch": batch,
+        "iters": iters,
+        "device": str(device),
+        "forward_ms": statistics.median(totals) * 1000.0,
+        "layers": layers,
+        "dominant": max(layers, key=lambda k: layers[k]["ms"]),
+    }
+
+
+class TraceSampler:
+    """torch.profiler traces for a random sample of production forwards.
+
+    trace() returns a no-op context unless the call is sampled: with
+    probability `rate`, or because force_next() queued it (admin endpoint).
+    Only one trace runs at a time; calls that overlap one simply aren't sampled.
+    Each trace is a Chrome trace JSON (chrome://tracing, Perfetto) written
+    temp-then-rename into trace_dir. After each write the oldest traces are
+    deleted until at most max_traces files and max_bytes remain.
+    """
+
+    def __init__(self, rate: float = 0.0, trace_dir: str = "profiles", max_traces: int = 20, max_bytes: int = 256 << 20):
+        self.rate = min(max(float(rate), 0.0), 1.0)
+        self.trace_dir = trace_dir
+        self.max_traces = max(1, int(max_traces))
+        self.max_bytes = int(max_bytes)
+        self._forced = 0
+        self._active = threading.Lock()
+        self._lock = threading.Lock()
+        self.sampled = 0
+        self.skipped_busy = 0
+        self.evicted = 0
+        self.last_trace: Optional[str] = None
+        # trace_dir is created with the first trace, so a sampler that never fires leaves nothing on disk
+
+    def set_rate(self, rate: float):
+        self.rate = min(max(float(rate), 0.0), 1.0)
+
+    def force_next(self, n: int = 1):
+        with self._lock:
+            self._forced += max(0, int(n))
+
+    def _take(self) -> bool:
+        if self._forced:
+            with self._lock:
+                if self._forced:
+                    self._forced -= 1
+                    return True
+        return self.rate > 0.0 and random.random() < self.rate
+
+    def trace(self, tag: str, **meta):
+        # hot path: two attribute reads when sampling is off
+        if not self._forced and self.rate <= 0.0:
+            return _NULL
+        if not self._take():
+            return _NULL
+        if not self._active.acquire(blocking=False):
+            self.skipped_busy += 1
+            return _NULL
+        return self._profile(tag, meta)
+
+    @contextlib.contextmanager
+    def _profile(self, tag: str, meta: dict):
+        from torch.profiler import ProfilerActivity, profile
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        try:
+            with profile(activities=activities, record_shapes=True, profile_memory=True, with_flops=True) as prof:
+                yield
+            name = f"{int(time.time() * 1000)}_{tag}_{uuid.uuid4().hex[:6]}.json"
+            os.makedirs(self.trace_dir, exist_ok=True)
+            path = os.path.join(self.trace_dir, name)
+            tmp = path + ".tmp"
+            prof.export_chrome_trace(tmp)
+            os.replace(tmp, path)
+            if meta:
+                with open(path + ".meta", "w") as fh:
+                    json.dump(meta, fh)
+            with self._lock:
+                self.sampled += 1
+                self.last_trace = name
+            self._enforce()
+        finally:
+            self._active.release()
+
+    def traces(self) -> list[dict]:
+        out = []
+        if not os.path.isdir(self.trace_dir):
+            return out
+        for entry in os.scandir(self.trace_dir):
+            if entry.is_file() and entry.name.endswith(".json"):
+                st = entry.stat()
+                out.append({"name": entry.name, "bytes": st.st_size, "mtime": st.st_mtime})
+        return sorted(out, key=lambda t: t["mtime"])
+
+    def _enforce(self):
+        traces = self.traces()
+        total = sum(t["bytes"] for t in traces)
+        while traces and (len(traces) > self.max_traces or total > self.max_bytes):
+            old = traces.pop(0)
+            total -= old["bytes"]
+            for suffix in ("", ".meta"):
+                try:
+                    os.remove(os.path.join(self.trace_dir, old["name"] + suffix))
+                except FileNotFoundError:
+                    pass
+            self.evicted += 1
+
+    def stats(self) -> dict:
+        traces = self.traces()
+        return {
+            "rate": self.rate,
+            "forced_pending": self._forced,
+            "dir": self.trace_dir,
+            "traces": len(traces),
+            "bytes": sum(t["bytes"] for t in traces),
+            "max_traces": self.max_traces,
+            "max_bytes": self.max_bytes,
+            "sampled": self.sampled,
+            "skipped_busy": self.skipped_busy,
+            "evicted": self.evicted,
+            "last_trace": self.last_trace,
+        }
+
+    @classmethod
+    def from_env(cls) -> "TraceSampler":
+        return cls(
+            rate=float(os.environ.get("GAN_PROFILE_RATE", "0")),
+            trace_dir=os.environ.get("GAN_PROFILE_DIR", "profiles"),
+            max_traces=int(os.environ.get("GAN_PROFILE_MAX_TRACES", "20")),
+            max_bytes=int(os.environ.get("GAN_PROFILE_MAX_MB", "256")) << 20,
+        )
+
+
+def main():
+    import argparse
+    import importlib
+
+    ap = argparse.ArgumentParser(description="Per-layer time / FLOPs / activation size for generator variants.")
+    ap.add_argument("--variant", nargs="+", default=["infowavegan"], help="inference/ modules holding a WaveGANGenerator class")
+    ap.add_argument("--ckpt", default=None, help="optional state dict; timing doesn't depend on the weights")
+    ap.add_argument("--slice-len", type=int, default=65536)
+    ap.add_argument("--batch", type=int, nargs="+", default=[1, 8])
+    ap.add_argument("--iters", type=int, default=10)
+    ap.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = ap.parse_args()
+
+    device = torch.device(args.device)
+    report = {}
+    for variant in args.variant:
+        cls = importlib.import_module(variant).WaveGANGenerator
+        if not issubclass(cls, torch.nn.Module):
+            ap.error(f"{variant} is not a torch generator (per-layer hooks need an nn.Module)")
+        G = cls(slice_len=args.slice_len)
+        if args.ckpt:
+            G.load_state_dict(torch.load(args.ckpt, map_location="cpu"))
+        G = G.to(device).eval()
+        report[variant] = {str(b): profile_layers(G, batch=b, iters=args.iters, device=device) for b in args.batch}
+        for b, prof in report[variant].items():
+            top = prof["layers"][prof["dominant"]]
+            print(f"{variant} batch={b}: forward {prof['forward_ms']:.2f} ms, dominant {prof['dominant']} ({top['share'] * 100:.0f}%, {top['ms']:.2f} ms, {top['gflop']:.2f} GFLOP)")
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,59 +1,245 @@
+import asyncio
+import hmac
+import math
 import os
-import time
-import uuid
-from typing import Optional
-
-import numpy as np
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
-from pydantic import BaseModel, conlist
-
-from inference_cached import WaveGANService, load_service_from_env, _write_wav
+import queue
+import threading
+from typing import List, Literal, Optional
+
+from fastapi import Depends, FastAPI, Header, HTTPException
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, conint, conlist
+
+from artifact_store import ArtifactStore
+from executors import BoundedExecutor, QueueFull
+from latents import make_latent
+import metrics
+from startup import Startup
+from streaming import LatentStream, build_trajectory, iter_pcm_bytes
+from transcription import TranscriptionEngine, load_audio, load_engine_from_env
+from wavio import encode_wav, iter_chunks, stream_header
+from worker_pool import PoolUnavailable, is_pool_worker
 
 __author__ = "Riccardo Petrini"
 
 app = FastAPI(title="")
 
-OUTPUT_PATH = "static/output.wav"
-EVOLUTION_DIR = "static/evolution"
-BATCH_DIR = "static/batch"
+# static/batch/req_* and static/evolution/req_*, one directory per request, expired by TTL and byte budget
+_artifacts = ArtifactStore.from_env("static")
+
+# Whisper has its own queue and worker thread (model loaded on first use), so ASR load can't starve generation
+_asr: TranscriptionEngine = load_engine_from_env()
+_asr.on_batch = lambda n, seconds: metrics.STAGE_SECONDS.observe(seconds, "asr")
+
+
+def _build_service():
+    from service_base import load_service_from_env
+
+    return load_service_from_env()
 
-os.makedirs("static", exist_ok=True)
-os.makedirs(EVOLUTION_DIR, exist_ok=True)
-os.makedirs(BATCH_DIR, exist_ok=True)
 
-_service: WaveGANService = load_service_from_env()
-_asr = None
+# torch import, checkpoint load and warm-up forwards run in the background; /health is 503 until they finish
+_startup = Startup.from_env(_build_service, asr=_asr)
+# `python server_fastapi.py` imports this module again through uvicorn, and spawn re-imports it in
+# pool workers; only the import that serves loads the model
+if __name__ != "__main__" and not is_pool_worker():
+    _startup.start()
+
+_gen_pool = BoundedExecutor("gan", int(os.environ.get("GAN_WORKERS", "8")), int(os.environ.get("GAN_QUEUE", "16")))
+# long-lived streams hold a producer thread each, so they get their own cap; their forwards still run as _gen_pool jobs
+_streams = threading.BoundedSemaphore(int(os.environ.get("GAN_MAX_STREAMS", "2")))
+STREAM_MAX_SECONDS = float(os.environ.get("GAN_STREAM_MAX_SECONDS", "600"))
+STREAM_WAIT_S = float(os.environ.get("GAN_STREAM_WAIT_S", "30"))
+INTERP_MAX_FRAMES = int(os.environ.get("GAN_INTERP_MAX_FRAMES", "256"))
+INTERP_BATCH = int(os.environ.get("GAN_INTERP_BATCH", "16"))
+# the whole bundle is built in memory before it's sent
+INTERP_MAX_BYTES = int(os.environ.get("GAN_INTERP_MAX_MB", "256")) << 20
+
+
+class BufferResponse(Response):
+    def render(self, content) -> bytes:
+        # encode_wav / pack_bundle already hand back the finished buffer; skip the str/bytes coercion
+        return content
 
 
 class GenerateBody(BaseModel):
     categorical_code: conlist(int, min_items=16, max_items=16)
+    # numpy's default_rng only takes non-negative seeds
+    seed: Optional[conint(ge=0)] = None
 
 
 class LayerBody(GenerateBody):
     layer: str
 
 
+class BundleBody(GenerateBody):
+    layers: List[str] = ["upconv1", "upconv2", "upconv3", "upconv4", "upconv5"]
+    stretched: bool = True
+    dtype: Literal["float32", "int16"] = "float32"
+
+
+class StreamBody(GenerateBody):
+    keyframes: List[conlist(int, min_items=16, max_items=16)] = []
+    mode: Literal["linear", "slerp", "walk"] = "slerp"
+    seconds: float = 30.0
+    steps_per_segment: int = 8
+    step: float = 0.05
+    overlap: int = 4096
+    batch_size: int = 4
+    format: Literal["wav", "pcm"] = "wav"
+    dtype: Literal["float32", "int16"] = "float32"
+
+
+class InterpolationBody(BaseModel):
+    z_start: Optional[conlist(float, min_items=100, max_items=100)] = None
+    z_end: Optional[conlist(float, min_items=100, max_items=100)] = None
+    keyframes: List[conlist(float, min_items=100, max_items=100)] = []
+    steps: int = 16
+    mode: Literal["linear", "slerp"] = "linear"
+    layers: conlist(str, max_items=8) = []
+    stretched: bool = True
+    dtype: Literal["float32", "int16"] = "float32"
+
+
 class TranscribeBody(BaseModel):
     file: str
     language: Optional[str] = None
 
 
+class GenerateTranscribeBody(GenerateBody):
+    layers: conlist(str, min_items=1, max_items=8) = ["final"]
+    stretched: bool = True
+    language: Optional[str] = None
+    store: bool = True
+
+
+class ProfileBody(BaseModel):
+    rate: Optional[float] = None
+    trace_next: int = 0
+
+
+class LayerProfileBody(BaseModel):
+    batch: int = 1
+    iters: int = 10
+
+
+def _check_admin(x_admin_token: Optional[str] = Header(None)):
+    # admin routes are off unless GAN_ADMIN_TOKEN is set; compare in constant time
+    token = os.environ.get("GAN_ADMIN_TOKEN")
+    if not token:
+        raise HTTPException(status_code=403, detail="admin endpoints are disabled (GAN_ADMIN_TOKEN is not set)")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, token):
+        raise HTTPException(status_code=401, detail="missing or wrong X-Admin-Token")
+
+
 def _check_code(code: list[int]):
     if len(code) != 16 or any(v not in (0, 1) for v in code):
         raise HTTPException(status_code=400, detail="Provide 16 binary values in 'categorical_code'")
 
 
-def _asr_model():
-    global _asr
-    if _asr is None:
-        from faster_whisper import WhisperModel
+def _svc():
+    service = _startup.service
+    if service is None:
+        detail = f"generator is {_startup.state}" + (f": {_startup.error}" if _startup.error else "")
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": "5"})
+    return service
+
+
+async def _run(pool: BoundedExecutor, fn, *args, **kwargs):
+    try:
+        return await pool.run(fn, *args, **kwargs)
+    except QueueFull as exc:
+        raise HTTPException(status_code=429, detail=str(exc), headers={"Retry-After": str(exc.retry_after)})
+
+
+@app.exception_handler(PoolUnavailable)
+async def _pool_unavailable(request, exc: PoolUnavailable):
+    return JSONResponse({"detail": str(exc)}, status_code=503, headers={"Retry-After": str(exc.retry_after)})
+
+
+def _once(fn):
+    """fn wrapped so only the first call runs it, whichever thread gets there first."""
+    lock = threading.Lock()
+    done = []
+
+    def wrapper():
+        with lock:
+            if done:
+                return
+            done.append(True)
+        fn()
+
+    return wrapper
+
+
+def _timing_headers(timing: dict) -> dict:
+    return {"X-Queue-Time-Ms": f"{timing['queue_ms']:.1f}", "X-Compute-Time-Ms": f"{timing['compute_ms']:.1f}"}
+
+
+async def _transcribe(audio, language: Optional[str]):
+    try:
+        fut = _asr.submit(audio, language)
+    except queue.Full:
+        raise HTTPException(status_code=429, detail="asr queue is full", headers={"Retry-After": str(_asr.retry_after())})
+    # coalesced requests share one future; a client going away must not cancel it for the others
+    out, timing = await asyncio.shield(asyncio.wrap_future(fut))
+    if timing["batch_size"]:
+        metrics.STAGE_SECONDS.observe(timing["queue_ms"] / 1000.0, "asr_queue")
+    return out, timing
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+def _profiler():
+    profiler = _svc().profiler
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="request tracing is not available for this backend")
+    return profiler
+
+
+@app.get("/admin/profile", dependencies=[Depends(_check_admin)])
+def admin_profile():
+    profiler = _profiler()
+    return {"sampler": profiler.stats(), "traces": profiler.traces()}
 
-        name = os.environ.get("WHISPER_MODEL", "small")
-        device = os.environ.get("WHISPER_DEVICE", "cpu")
-        compute = os.environ.get("WHISPER_COMPUTE", "int8")
-        _asr = WhisperModel(name, device=device, compute_type=compute)
-    return _asr
+
+@app.post("/admin/profile", dependencies=[Depends(_check_admin)])
+def admin_profile_update(body: ProfileBody):
+    """Change the sampling rate and/or force-trace the next N generator forwards."""
+    profiler = _profiler()
+    if body.rate is not None:
+        if not 0.0 <= body.rate <= 1.0:
+            raise HTTPException(status_code=400, detail="'rate' must be in [0, 1]")
+        profiler.set_rate(body.rate)
+    if body.trace_next < 0:
+        raise HTTPException(status_code=400, detail="'trace_next' must be >= 0")
+    profiler.force_next(body.trace_next)
+    return profiler.stats()
+
+
+@app.get("/admin/profile/traces/{name}", dependencies=[Depends(_check_admin)])
+def admin_profile_trace(name: str):
+    profiler = _profiler()
+    path = os.path.join(profiler.trace_dir, os.path.basename(name))
+    if not name.endswith(".json") or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail=f"no trace '{name}'")
+    return FileResponse(path, media_type="application/json", filename=os.path.basename(name))
+
+
+@app.post("/admin/profile/layers", dependencies=[Depends(_check_admin)])
+async def admin_profile_layers(body: LayerProfileBody):
+    """Per-layer wall time, FLOPs and activation bytes at one batch size; holds the forward lock while it runs."""
+    if not 1 <= body.batch <= 256 or not 1 <= body.iters <= 100:
+        raise HTTPException(status_code=400, detail="'batch' must be in [1, 256] and 'iters' in [1, 100]")
+    try:
+        report, _ = await _run(_gen_pool, _svc().profile_layers, body.batch, body.iters)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return report
 
 
 @app.get("/")
@@ -63,39 +249,79 @@ def root():
 
 @app.get("/health")
 def health():
-    return {"ok": True}
+    # readiness probe: 503 until the generator is loaded and warmed up, so load balancers hold traffic back
+    report = _startup.report()
+    return JSONResponse({"ok": report["ready"], **report}, status_code=200 if report["ready"] else 503)
+
+
+@app.get("/stats")
+def stats():
+    out = {
+        "startup": _startup.report(),
+        "artifacts": _artifacts.stats(),
+        "executors": {"gan": _gen_pool.stats()},
+        "asr": _asr.stats(),
+    }
+    service = _startup.service
+    if service is not None:
+        out.update(
+            batching=service.batching_stats(),
+            cache=service.cache_stats(),
+            store=service.store_stats(),
+            pool=service.pool_stats(),
+            backend=service.backend_stats(),
+            profiling=service.profiler_stats(),
+        )
+    return out
 
 
 @app.post("/generate")
-def generate(body: GenerateBody):
+async def generate(body: GenerateBody, stream: bool = False):
     _check_code(body.categorical_code)
-    z = np.random.uniform(-1, 1, (1, 100)).astype(np.float32)
-    z[0, :16] = np.array(body.categorical_code, dtype=np.float32)
-    audio = _service.generate(z)
-    _write_wav(audio, OUTPUT_PATH)
-    return FileResponse(OUTPUT_PATH, media_type="audio/wav")
+    (data, _), timing = await _run(_gen_pool, _svc().synthesize_wav, body.categorical_code, body.seed)
+    headers = _timing_headers(timing)
+    if stream:
+        headers["Content-Length"] = str(len(data))
+        return StreamingResponse((bytes(c) for c in iter_chunks(data)), media_type="audio/wav", headers=headers)
+    return BufferResponse(data, media_type="audio/wav", headers=headers)
+
+
+def _file_job(code: list[int], seed: Optional[int]):
+    # the namespace lives and dies with the job in the pool thread, even if the request is cancelled meanwhile
+    with _artifacts.namespace("batch") as ns:
+        path, z = _svc().synthesize_and_store(code, ns.path, seed)
+        ns.commit({"code": code, "seed": seed})
+    return path, z
 
 
 @app.post("/generate_file")
-def generate_file(body: GenerateBody):
+async def generate_file(body: GenerateBody, response: Response):
     _check_code(body.categorical_code)
-    path, z = _service.synthesize_and_store(body.categorical_code, BATCH_DIR)
+    (path, z), timing = await _run(_gen_pool, _file_job, body.categorical_code, body.seed)
+    response.headers.update(_timing_headers(timing))
     return {"file": "/" + path.replace("\\", "/"), "z": z.tolist(), "code": body.categorical_code}
 
 
+def _evolution_job(code: list[int], seed: Optional[int]):
+    z = make_latent(code, seed)
+    with _artifacts.namespace("evolution") as ns:
+        out = _svc().generate_layers(z, ns.path)
+        ns.commit({"code": code, "seed": seed})
+    return out
+
+
 @app.post("/generate_evolution")
-def generate_evolution(body: GenerateBody):
+async def generate_evolution(body: GenerateBody, response: Response):
     _check_code(body.categorical_code)
-    z = np.random.uniform(-1, 1, (1, 100)).astype(np.float32)
-    z[0, :16] = np.array(body.categorical_code, dtype=np.float32)
-    layers, final_len = _service.generate_layers(z, EVOLUTION_DIR)
+    (layers, final_len), timing = await _run(_gen_pool, _evolution_job, body.categorical_code, body.seed)
+    response.headers.update(_timing_headers(timing))
     payload = []
     for layer in layers:
         payload.append(
             {
                 "name": layer["name"],
-                "raw_url": "/" + os.path.relpath(layer["raw_path"], start="static").replace("\\", "/"),
-                "stretched_url": "/" + os.path.relpath(layer["stretched_path"], start="static").replace("\\", "/"),
+                "raw_url": _artifacts.url_for(layer["raw_path"]),
+                "stretched_url": _artifacts.url_for(layer["stretched_path"]),
                 "raw_len": layer["raw_len"],
                 "stretched_len": layer["stretched_len"],
             }
@@ -103,58 +329,200 @@ def generate_evolution(body: GenerateBody):
     return {"final_len": final_len, "layers": payload}
 
 
+def _layer_file_job(code: list[int], target: str, seed: Optional[int]) -> str:
+    # layer_names() may trigger the lazy checkpoint load, so validation runs in the pool too
+    if target != "final" and target not in _svc().layer_names():
+        raise HTTPException(status_code=404, detail=f"Layer '{target}' not found")
+
+    data, _ = _svc().synthesize_layer_wav(code, target, seed=seed, stretched=True)
+
+    with _artifacts.namespace("batch") as ns:
+        dst = ns.write(f"layer_{target}.wav", data)
+        ns.commit({"code": code, "seed": seed, "layer": target})
+    return dst
+
+
 @app.post("/generate_layer_file")
-def generate_layer_file(body: LayerBody):
+async def generate_layer_file(body: LayerBody, response: Response):
     _check_code(body.categorical_code)
     target = (body.layer or "").lower()
     if not target:
         raise HTTPException(status_code=400, detail="Provide 'layer'")
 
-    z = np.random.uniform(-1, 1, (1, 100)).astype(np.float32)
-    z[0, :16] = np.array(body.categorical_code, dtype=np.float32)
-    layers, _ = _service.generate_layers(z, os.path.join(EVOLUTION_DIR, f"req_{int(time.time()*1000)}_{uuid.uuid4().hex[:6]}"))
-    hit = next((l for l in layers if (l["name"] or "").lower() == target), None)
-    if not hit:
-        raise HTTPException(status_code=404, detail=f"Layer '{target}' not found")
-
-    fname = f"layer_{target}_{uuid.uuid4().hex[:6]}.wav"
-    dst = os.path.join(BATCH_DIR, fname)
-    os.makedirs(BATCH_DIR, exist_ok=True)
-    with open(hit["stretched_path"], "rb") as src, open(dst, "wb") as out:
-        out.write(src.read())
-
+    dst, timing = await _run(_gen_pool, _layer_file_job, body.categorical_code, target, body.seed)
+    response.headers.update(_timing_headers(timing))
     resp = {"file": "/" + dst.replace("\\", "/"), "categorical_code": body.categorical_code}
     return resp
 
 
+def _bundle_job(body: BundleBody, targets: list[str]):
+    known = set(_svc().layer_names()) | {"final"}
+    missing = [name for name in targets if name not in known]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Layer(s) not found: {missing}")
+    data, _ = _svc().synthesize_bundle(body.categorical_code, targets, seed=body.seed, stretched=body.stretched, dtype=body.dtype)
+    return data
+
+
+@app.post("/generate_layer_bundle")
+async def generate_layer_bundle(body: BundleBody):
+    _check_code(body.categorical_code)
+    targets = [(name or "").lower() for name in body.layers]
+    if not targets:
+        raise HTTPException(status_code=400, detail="Provide at least one entry in 'layers'")
+
+    data, timing = await _run(_gen_pool, _bundle_job, body, targets)
+    return BufferResponse(data, media_type="application/octet-stream", headers=_timing_headers(timing))
+
+
+def _interpolation_job(body: InterpolationBody, keyframes: list, layers: list[str]):
+    known = set(_svc().layer_names()) | {"final"}
+    missing = [name for name in layers if name not in known]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Layer(s) not found: {missing}")
+    return _svc().synthesize_interpolation(
+        keyframes, body.steps, body.mode, layers=layers, stretched=body.stretched, dtype=body.dtype, batch_size=INTERP_BATCH
+    )
+
+
+@app.post("/generate_interpolation")
+async def generate_interpolation(body: InterpolationBody):
+    keyframes = list(body.keyframes)
+    if body.z_start is not None and body.z_end is not None:
+        keyframes = [body.z_start] + keyframes + [body.z_end]
+    if len(keyframes) < 2:
+        raise HTTPException(status_code=400, detail="Provide 'z_start' and 'z_end', or at least two 'keyframes'")
+    if not 2 <= body.steps <= INTERP_MAX_FRAMES:
+        raise HTTPException(status_code=400, detail=f"'steps' must be in [2, {INTERP_MAX_FRAMES}]")
+    # UI vectors are clamped to [-1, 1] client-side; enforce the same range here
+    keyframes = [[min(1.0, max(-1.0, v)) for v in z] for z in keyframes]
+    layers = [(name or "").lower() for name in body.layers]
+    # upper bound: every item at slice_len (unstretched layers are shorter)
+    items = body.steps * (1 + len({name for name in layers if name != "final"}))
+    size = items * _svc().slice_len * (2 if body.dtype == "int16" else 4)
+    if size > INTERP_MAX_BYTES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"{body.steps} frames x {items // body.steps} outputs would be ~{size >> 20} MB; the limit is {INTERP_MAX_BYTES >> 20} MB (fewer steps or layers, or dtype int16)",
+        )
+
+    data, timing = await _run(_gen_pool, _interpolation_job, body, keyframes, layers)
+    return BufferResponse(data, media_type="application/octet-stream", headers=_timing_headers(timing))
+
+
+@app.post("/generate_stream")
+def generate_stream(body: StreamBody):
+    service = _svc()
+    codes = [body.categorical_code] + list(body.keyframes)
+    for code in codes:
+        _check_code(code)
+    if not 0 < body.seconds <= STREAM_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"'seconds' must be in (0, {STREAM_MAX_SECONDS:g}]")
+    if body.steps_per_segment < 1 or not 1 <= body.batch_size <= 32:
+        raise HTTPException(status_code=400, detail="'steps_per_segment' must be >= 1 and 'batch_size' in [1, 32]")
+    if not 0 <= body.overlap < service.slice_len // 2:
+        raise HTTPException(status_code=400, detail=f"'overlap' must be in [0, {service.slice_len // 2})")
+    if not _streams.acquire(blocking=False):
+        raise HTTPException(status_code=429, detail="too many concurrent streams", headers={"Retry-After": "5"})
+
+    def forward(z):
+        # each batch is a _gen_pool job like any other request; a running stream waits for room rather than dropping out
+        return _gen_pool.call(service.generate_batch, z, wait_s=STREAM_WAIT_S)[0]
+
+    try:
+        trajectory = build_trajectory(body.mode, codes, seed=body.seed, steps_per_segment=body.steps_per_segment, step=body.step)
+        clip_len = service.slice_len
+        hop = clip_len - body.overlap
+        stream = LatentStream(
+            forward,
+            trajectory,
+            clip_len,
+            overlap=body.overlap,
+            batch_size=body.batch_size,
+            max_clips=max(1, math.ceil(body.seconds * service.sample_rate / hop)),
+        )
+    except ValueError as exc:
+        _streams.release()
+        raise HTTPException(status_code=400, detail=str(exc))
+    except BaseException:
+        _streams.release()
+        raise
+
+    finish = _once(lambda: (stream.close(), _streams.release()))
+
+    def body_iter():
+        try:
+            if body.format == "wav":
+                yield stream_header(service.sample_rate, body.dtype)
+            yield from iter_pcm_bytes(stream, body.dtype)
+        finally:
+            finish()
+
+    media = "audio/wav" if body.format == "wav" else "application/octet-stream"
+    headers = {"X-Sample-Rate": str(service.sample_rate), "X-Sample-Format": body.dtype, "X-Hop-Samples": str(hop)}
+    # the background task runs after the response even if the client left before body_iter was first pulled
+    return StreamingResponse(body_iter(), media_type=media, headers=headers, background=BackgroundTask(finish))
+
+
 @app.post("/transcribe_file")
-def transcribe_file(body: TranscribeBody):
+async def transcribe_file(body: TranscribeBody, response: Response):
     path = body.file.lstrip("/") if body.file else None
     if not path or not os.path.exists(path):
         raise HTTPException(status_code=404, detail=f"file not found: {body.file}")
 
-    model = _asr_model()
-    segments, info = model.transcribe(path, language=body.language or None, vad_filter=True, beam_size=5, word_timestamps=True)
-
-    out = {"language": info.language, "duration": float(info.duration), "text": "", "segments": [], "words": []}
-    texts = []
-    for seg in segments:
-        entry = {"start": float(seg.start or 0.0), "end": float(seg.end or 0.0), "text": (seg.text or "").strip()}
-        if getattr(seg, "words", None):
-            words = []
-            for w in seg.words:
-                if w.start is None or w.end is None:
-                    continue
-                words.append({"start": float(w.start), "end": float(w.end), "text": getattr(w, "word", getattr(w, "text", "")).strip()})
-            entry["words"] = words
-            out["words"].extend(words)
-        if entry["text"]:
-            texts.append(entry["text"])
-        out["segments"].append(entry)
-    out["text"] = " ".join(texts).strip()
+    try:
+        # file read + decode is blocking I/O; keep it off the event loop
+        audio = await asyncio.to_thread(load_audio, path)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    out, timing = await _transcribe(audio, body.language)
+    response.headers.update(_timing_headers(timing))
     return out
 
 
+def _arrays_job(body: GenerateTranscribeBody, layers: list[str]):
+    known = set(_svc().layer_names()) | {"final"}
+    missing = [name for name in layers if name not in known]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Layer(s) not found: {missing}")
+    return _svc().synthesize_arrays(body.categorical_code, layers, seed=body.seed, stretched=body.stretched)
+
+
+def _store_arrays_job(arrays: dict, meta: dict) -> dict:
+    # arrays are already peak-normalized, so the files hold exactly the samples that were transcribed
+    with _artifacts.namespace("batch") as ns:
+        paths = {name: ns.write(f"{name}.wav", encode_wav(x, _svc().sample_rate, normalize=False)) for name, x in arrays.items()}
+        ns.commit(meta)
+    return paths
+
+
+@app.post("/generate_transcribe")
+async def generate_transcribe(body: GenerateTranscribeBody, response: Response):
+    _check_code(body.categorical_code)
+    layers = list(dict.fromkeys(name.lower() for name in body.layers))
+    (arrays, z), timing = await _run(_gen_pool, _arrays_job, body, layers)
+
+    # every layer goes to the ASR queue as a 16 kHz float32 array at once (one ASR batch);
+    # encoding and writing the WAVs overlaps with transcription instead of preceding it
+    jobs = [_transcribe(arrays[name], body.language) for name in layers]
+    if body.store:
+        meta = {"code": body.categorical_code, "seed": body.seed, "layers": layers, "stretched": body.stretched}
+        jobs.append(_run(_gen_pool, _store_arrays_job, arrays, meta))
+    results = await asyncio.gather(*jobs)
+
+    response.headers.update(_timing_headers(timing))
+    response.headers["X-ASR-Compute-Time-Ms"] = f"{max(t['compute_ms'] for _, t in results[: len(layers)]):.1f}"
+    out = {"z": z.tolist(), "code": body.categorical_code, "transcriptions": {name: results[i][0] for i, name in enumerate(layers)}}
+    if body.store:
+        paths, _ = results[-1]
+        out["files"] = {name: "/" + path.replace("\\", "/") for name, path in paths.items()}
+    return out
+
+
+# added last so the route set is complete; label by route, not raw path, so unknown URLs share one series
+app.add_middleware(metrics.RequestMetrics, routes={route.path for route in app.routes})
+
+
 if __name__ == "__main__":
     import uvicorn
 
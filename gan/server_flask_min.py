@@ -1,26 +1,35 @@
 import os
 import time
-import uuid
-import numpy as np
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, abort, g, make_response, request, jsonify
 from flask_cors import CORS
 
-from inference_cached import WaveGANService, load_service_from_env, _write_wav
+from artifact_store import ArtifactStore
+from latents import make_latent
+import metrics
+from startup import Startup
+from wavio import iter_chunks
+from worker_pool import PoolUnavailable, is_pool_worker
 
 __author__ = "Riccardo Petrini"
 
 app = Flask(__name__)
 CORS(app)
 
-OUTPUT_PATH = "static/output.wav"
-BATCH_DIR = "static/batch"
-EVOLUTION_DIR = "static/evolution"
+artifacts = ArtifactStore.from_env("static")
 
-os.makedirs("static", exist_ok=True)
-os.makedirs(BATCH_DIR, exist_ok=True)
-os.makedirs(EVOLUTION_DIR, exist_ok=True)
 
-service: WaveGANService = load_service_from_env()
+
+def _build_service():
+    from service_base import load_service_from_env
+
+    return load_service_from_env()
+
+
+boot = Startup.from_env(_build_service)
+# with debug=True the reloader's watcher process imports this module too, and spawn re-imports it in
+# pool workers; only the serving process loads the model
+if not is_pool_worker() and (__name__ != "__main__" or os.environ.get("WERKZEUG_RUN_MAIN") == "true"):
+    boot.start()
 
 
 def _code(payload):
@@ -30,21 +39,89 @@ def _code(payload):
     return code
 
 
+def _seed(payload):
+    seed = payload.get("seed") if payload else None
+    if not isinstance(seed, int) or isinstance(seed, bool):
+        return None
+    if seed < 0:
+        # numpy's default_rng only takes non-negative seeds
+        abort(make_response(jsonify({"error": "'seed' must be a non-negative integer"}), 400))
+    return seed
+
+
+def _endpoint():
+    return request.url_rule.rule if request.url_rule is not None else "other"
+
+
+@app.before_request
+def _track_start():
+    g.metrics_start = time.perf_counter()
+    metrics.IN_FLIGHT.inc(_endpoint())
+
+
+@app.before_request
+def _require_service():
+    if request.endpoint in ("generate", "generate_file", "layers") and boot.service is None:
+        detail = f"generator is {boot.state}" + (f": {boot.error}" if boot.error else "")
+        return jsonify({"error": detail}), 503, {"Retry-After": "5"}
+
+
+@app.errorhandler(PoolUnavailable)
+def _pool_unavailable(exc):
+    return jsonify({"error": str(exc)}), 503, {"Retry-After": str(exc.retry_after)}
+
+
+@app.after_request
+def _track_status(response):
+    metrics.REQUESTS.inc(_endpoint(), str(response.status_code))
+    g.metrics_counted = True
+    return response
+
+
+@app.teardown_request
+def _track_end(exc):
+    # unhandled errors normally reach _track_status as Flask's 500 response; count only the ones that did not
+    if exc is not None and "metrics_counted" not in g:
+        metrics.REQUESTS.inc(_endpoint(), "500")
+    if "metrics_start" in g:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.metrics_start, _endpoint())
+        metrics.IN_FLIGHT.dec(_endpoint())
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
+
 @app.route("/", methods=["GET"])
 def root():
     return {"author": __author__, "status": "ready"}
 
 
+@app.route("/health", methods=["GET"])
+def health():
+    report = boot.report()
+    return jsonify({"ok": report["ready"], **report}), 200 if report["ready"] else 503
+
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    out = {"startup": boot.report(), "artifacts": artifacts.stats()}
+    service = boot.service
+    if service is not None:
+        out.update(batching=service.batching_stats(), cache=service.cache_stats(), store=service.store_stats(), pool=service.pool_stats(), backend=service.backend_stats())
+    return jsonify(out)
+
+
 @app.route("/generate", methods=["POST"])
 def generate():
     code = _code(request.json)
     if not code:
         return jsonify({"error": "Provide 16 binary values in 'categorical_code'"}), 400
-    z = np.random.uniform(-1, 1, (1, 100)).astype(np.float32)
-    z[0, :16] = np.array(code, dtype=np.float32)
-    audio = service.generate(z)
-    _write_wav(audio, OUTPUT_PATH)
-    return send_file(OUTPUT_PATH, mimetype="audio/wav")
+    data, _ = boot.service.synthesize_wav(code, _seed(request.json))
+    if request.args.get("stream", "").lower() in ("1", "true", "yes"):
+        return Response((bytes(c) for c in iter_chunks(data)), mimetype="audio/wav", headers={"Content-Length": str(len(data))})
+    return Response(data, mimetype="audio/wav")
 
 
 @app.route("/generate_file", methods=["POST"])
@@ -52,7 +129,10 @@ def generate_file():
     code = _code(request.json)
     if not code:
         return jsonify({"error": "Provide 16 binary values in 'categorical_code'"}), 400
-    path, z = service.synthesize_and_store(code, BATCH_DIR)
+    seed = _seed(request.json)
+    with artifacts.namespace("batch") as ns:
+        path, z = boot.service.synthesize_and_store(code, ns.path, seed)
+        ns.commit({"code": code, "seed": seed})
     return jsonify({"file": "/" + path.replace("\\", "/"), "code": code, "z": z.tolist()})
 
 
@@ -61,17 +141,18 @@ def layers():
     code = _code(request.json)
     if not code:
         return jsonify({"error": "Provide 16 binary values in 'categorical_code'"}), 400
-    z = np.random.uniform(-1, 1, (1, 100)).astype(np.float32)
-    z[0, :16] = np.array(code, dtype=np.float32)
-    req_dir = os.path.join(EVOLUTION_DIR, f"req_{int(time.time()*1000)}_{uuid.uuid4().hex[:6]}")
-    layers, final_len = service.generate_layers(z, req_dir)
+    seed = _seed(request.json)
+    z = make_latent(code, seed)
+    with artifacts.namespace("evolution") as ns:
+        layers, final_len = boot.service.generate_layers(z, ns.path)
+        ns.commit({"code": code, "seed": seed})
     payload = []
     for layer in layers:
         payload.append(
             {
                 "name": layer["name"],
-                "raw": "/" + os.path.relpath(layer["raw_path"], start="static").replace("\\", "/"),
-                "stretched": "/" + os.path.relpath(layer["stretched_path"], start="static").replace("\\", "/"),
+                "raw": artifacts.url_for(layer["raw_path"]),
+                "stretched": artifacts.url_for(layer["stretched_path"]),
                 "raw_len": layer["raw_len"],
                 "stretched_len": layer["stretched_len"],
             }
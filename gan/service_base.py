@@ -0,0 +1,564 @@
+"""WaveGANServiceBase: the half of the service that does not need torch.
+
+Caching, micro-batching, the waveform store, the worker pool and the
+synthesize_* entry points live here. WaveGANService (inference_cached.py,
+torch) and OnnxWaveGANService (onnx_backend.py, onnxruntime) only add the
+model, so GAN_BACKEND=onnxruntime never imports torch.
+"""
+import contextlib
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import numpy as np
+
+from batching import MicroBatcher
+from bundle import pack_bundle
+from checkpoint_io import resolve
+from latents import make_latent
+from layer_postprocess import postprocess_layers
+from metrics import stage
+from wavio import encode_wav, peak_normalize, write_bytes
+
+__author__ = "Riccardo Petrini"
+
+SAMPLE_RATE = 16000
+SLICE_LEN = 65536
+_NO_TRACE = contextlib.nullcontext()
+
+
+def _write_wav(arr: np.ndarray, path: str, normalize: bool = True) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with stage("encode"):
+        data = encode_wav(arr, SAMPLE_RATE, normalize=normalize)
+    with stage("write"):
+        return write_bytes(data, path)
+
+
+def _stretch(arr: np.ndarray, target_len: int) -> np.ndarray:
+    if arr.shape[0] == target_len:
+        return arr.astype(np.float32)
+    return np.interp(
+        np.linspace(0.0, 1.0, num=target_len, endpoint=False),
+        np.linspace(0.0, 1.0, num=arr.shape[0], endpoint=False),
+        arr,
+    ).astype(np.float32)
+
+
+_FINGERPRINTS: dict = {}
+
+
+def checkpoint_fingerprint(ckpt_path: str) -> str:
+    """Content hash of a checkpoint file, so the same weights match wherever they were copied or built.
+
+    The file is hashed once per (path, size, mtime) in this process; a
+    missing file falls back to its path.
+    """
+    try:
+        st = os.stat(ckpt_path)
+    except OSError:
+        return hashlib.sha256(os.path.abspath(ckpt_path).encode("utf-8")).hexdigest()[:16]
+    ident = (os.path.abspath(ckpt_path), st.st_size, st.st_mtime_ns)
+    digest = _FINGERPRINTS.get(ident)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(ckpt_path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                h.update(chunk)
+        digest = _FINGERPRINTS[ident] = h.hexdigest()[:16]
+    return digest
+
+
+class AudioCache:
+    """Two-tier cache of encoded audio keyed by content hash.
+
+    Memory tier: LRU bounded by total bytes. Disk tier (optional): one file per
+    key under a two-level fan-out directory, written temp-then-rename, evicted
+    oldest-first once the directory exceeds its byte budget. Disk hits are
+    promoted to memory. Keys hash (checkpoint fingerprint, slice_len, seed, code,
+    layer/options); hit/miss/eviction counts go to /stats.
+    """
+
+    def __init__(self, memory_bytes: int = 256 << 20, disk_dir: Optional[str] = None, disk_bytes: int = 2 << 30):
+        self.memory_bytes = int(memory_bytes)
+        self.disk_dir = disk_dir
+        self.disk_bytes = int(disk_bytes)
+        self._lock = threading.Lock()
+        self._mem: "OrderedDict[str, bytes]" = OrderedDict()
+        self._mem_used = 0
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_used = 0
+        self._stats = {k: 0 for k in ("memory_hits", "disk_hits", "misses", "memory_evictions", "disk_evictions")}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._scan_disk()
+
+    @staticmethod
+    def key(*parts) -> str:
+        return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], key)
+
+    def _scan_disk(self):
+        found = []
+        for sub in os.listdir(self.disk_dir):
+            sub_dir = os.path.join(self.disk_dir, sub)
+            if not os.path.isdir(sub_dir):
+                continue
+            for name in os.listdir(sub_dir):
+                if name.endswith(".tmp"):
+                    continue
+                st = os.stat(os.path.join(sub_dir, name))
+                found.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(found):
+            self._disk[name] = size
+            self._disk_used += size
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._mem.get(key)
+            if data is not None:
+                self._mem.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return data
+            on_disk = key in self._disk
+        if on_disk:
+            try:
+                with open(self._path(key), "rb") as fh:
+                    data = fh.read()
+            except OSError:
+                data = None
+            with self._lock:
+                if data is None:
+                    self._disk_used -= self._disk.pop(key, 0)
+                else:
+                    self._disk.move_to_end(key)
+                    self._stats["disk_hits"] += 1
+                    self._put_memory(key, data)
+                    return data
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, key: str, data) -> None:
+        data = bytes(data)
+        with self._lock:
+            self._put_memory(key, data)
+            write_disk = self.disk_dir is not None and key not in self._disk
+        if write_disk:
+            self._put_disk(key, data)
+
+    def get_or_create(self, key: str, produce: Callable[[], bytes]):
+        data = self.get(key)
+        if data is None:
+            data = produce()
+            self.put(key, data)
+        return data
+
+    def _put_memory(self, key: str, data: bytes):
+        if len(data) > self.memory_bytes:
+            return
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._mem_used -= len(old)
+        self._mem[key] = data
+        self._mem_used += len(data)
+        while self._mem_used > self.memory_bytes:
+            _, evicted = self._mem.popitem(last=False)
+            self._mem_used -= len(evicted)
+            self._stats["memory_evictions"] += 1
+
+    def _put_disk(self, key: str, data: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+        victims = []
+        with self._lock:
+            self._disk[key] = len(data)
+            self._disk_used += len(data)
+            while self._disk_used > self.disk_bytes and len(self._disk) > 1:
+                old_key, size = self._disk.popitem(last=False)
+                self._disk_used -= size
+                self._stats["disk_evictions"] += 1
+                victims.append(old_key)
+        for old_key in victims:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["memory_hits"] + self._stats["disk_hits"] + self._stats["misses"]
+            hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+            return {
+                **self._stats,
+                "hit_rate": (hits / lookups) if lookups else 0.0,
+                "memory": {"entries": len(self._mem), "bytes": self._mem_used, "budget": self.memory_bytes},
+                "disk": {
+                    "enabled": self.disk_dir is not None,
+                    "entries": len(self._disk),
+                    "bytes": self._disk_used,
+                    "budget": self.disk_bytes,
+                },
+            }
+
+
+class WaveGANServiceBase:
+    """Backend-independent half of the generator service.
+
+    Caching, micro-batching, the waveform store, the worker pool and every
+    synthesize_* entry point live here; subclasses supply the model through
+    _lazy_load, generate_batch, layer_names, generate_layer_batch and
+    _capture_layers. Nothing in this module imports torch, so the onnxruntime
+    backend runs without it.
+    """
+
+    def __init__(
+        self,
+        ckpt_path: str,
+        slice_len: int = SLICE_LEN,
+        sample_rate: int = SAMPLE_RATE,
+        backend: str = "eager",
+        compile_dir: Optional[str] = None,
+    ):
+        self.ckpt_path = ckpt_path
+        self.slice_len = slice_len
+        self.sample_rate = sample_rate
+        self.backend = backend
+        self.compile_dir = compile_dir
+        self._batcher = None
+        self.cache: Optional[AudioCache] = None
+        self.store = None
+        self.pool = None
+        self.profiler = None
+        # used for requests without a seed; set it to the store's seed to serve those from the store too
+        self.default_seed: Optional[int] = None
+        # the file actually loaded: a converted .safetensors (possibly fp16) must not share cache keys with the .pt
+        self._fingerprint = checkpoint_fingerprint(resolve(ckpt_path))
+
+    def _lazy_load(self):
+        raise NotImplementedError
+
+    def backend_stats(self) -> dict:
+        return {"backend": self.backend}
+
+    def generate_batch(self, z: np.ndarray) -> np.ndarray:
+        """One forward over an (N, 100) latent batch; returns (N, slice_len) float32."""
+        raise NotImplementedError
+
+    def layer_names(self) -> list[str]:
+        raise NotImplementedError
+
+    def generate_layer(self, z: np.ndarray, layer: str, stretched: bool = True) -> np.ndarray:
+        """Channel 0 of `layer` for row 0 ("final" = the last upconv), stretched to slice_len if asked."""
+        return self.generate_layer_set(z, [layer], stretched=stretched)[layer]
+
+    def generate_layer_batch(self, z: np.ndarray, layers: list[str]) -> dict[str, np.ndarray]:
+        """{layer: (N, len) float32} from channel 0 of one forward over an (N, 100) batch."""
+        raise NotImplementedError
+
+    def _capture_layers(self, z: np.ndarray):
+        """({layer: channel 0 of row 0}, final waveform of row 0) from one forward."""
+        raise NotImplementedError
+
+    def attach_profiler(self, sampler) -> None:
+        """Trace a sampled share of production forwards with a profiling.TraceSampler."""
+        self.profiler = sampler
+
+    def profiler_stats(self) -> dict:
+        return self.profiler.stats() if self.profiler is not None else {"enabled": False}
+
+    def _trace(self, tag: str, batch: int):
+        if self.profiler is None:
+            return _NO_TRACE
+        return self.profiler.trace(tag, batch=batch, backend=self.backend, slice_len=self.slice_len)
+
+    def enable_batching(self, max_batch: int = 16, max_wait_ms: float = 5.0) -> MicroBatcher:
+        """Route single-latent generate() calls through a micro-batching worker."""
+        if self._batcher is None:
+            self._batcher = MicroBatcher(self.generate_batch, max_batch=max_batch, max_wait_ms=max_wait_ms)
+        return self._batcher
+
+    def batching_stats(self) -> dict:
+        return self._batcher.stats() if self._batcher is not None else {"enabled": False}
+
+    def generate(self, z: np.ndarray) -> np.ndarray:
+        if self._batcher is not None and z.shape[0] == 1:
+            return self._batcher.generate(z[0])
+        return self.generate_batch(z)[0]
+
+    def generate_layer_set(self, z: np.ndarray, layers: list[str], stretched: bool = True) -> dict[str, np.ndarray]:
+        """One truncated forward that returns channel 0 (row 0) of every requested layer, in request order."""
+        out = self.generate_layer_batch(z[:1], layers)
+        if not stretched:
+            return {layer: arr[0] for layer, arr in out.items()}
+        with stage("stretch"):
+            processed = postprocess_layers({layer: arr[0] for layer, arr in out.items()}, self.slice_len, normalize=False)
+        return {layer: processed[layer][1] for layer in out}
+
+    def generate_layers(self, z: np.ndarray, output_dir: str):
+        os.makedirs(output_dir, exist_ok=True)
+        captured, final_np = self._capture_layers(z)
+        final_len = final_np.shape[0]
+
+        order = ["z_project", "upconv0", "upconv1", "upconv2", "upconv3", "upconv4"]
+        if "upconv5" in captured:
+            order.append("upconv5")
+
+        # normalize + stretch every layer in one batch, then only encode/write per file
+        with stage("stretch"):
+            processed = postprocess_layers({name: captured[name] for name in order}, final_len)
+
+        layers = []
+        for name in order:
+            raw, stretched = processed[name]
+            raw_path = os.path.join(output_dir, f"{name}_raw.wav")
+            stretched_path = os.path.join(output_dir, f"{name}_stretched.wav")
+            _write_wav(raw, raw_path, normalize=False)
+            _write_wav(stretched, stretched_path, normalize=False)
+            layers.append(
+                {
+                    "name": name,
+                    "raw_path": raw_path,
+                    "stretched_path": stretched_path,
+                    "raw_len": int(raw.shape[0]),
+                    "stretched_len": int(final_len),
+                }
+            )
+
+        final_raw = os.path.join(output_dir, "final_raw.wav")
+        _write_wav(final_np, final_raw)
+        layers.append(
+            {
+                "name": "final",
+                "raw_path": final_raw,
+                "stretched_path": final_raw,
+                "raw_len": int(final_len),
+                "stretched_len": int(final_len),
+            }
+        )
+        return layers, final_len
+
+    def _cached(self, seed: Optional[int], parts: tuple, produce: Callable[[], bytes]):
+        # only seeded requests are reproducible, so only those are worth caching
+        if seed is None or self.cache is None:
+            return produce()
+        key = AudioCache.key(self._fingerprint, self.slice_len, seed, *parts)
+        return self.cache.get_or_create(key, produce)
+
+    def cache_stats(self) -> dict:
+        return self.cache.stats() if self.cache is not None else {"enabled": False}
+
+    def attach_store(self, store) -> bool:
+        """Serve lookups at the store's seed from a pre-rendered WaveformStore built for this checkpoint."""
+        slice_len = int(store.index.get("slice_len", self.slice_len))
+        if store.fingerprint not in (None, self._fingerprint):
+            reason = f"built for checkpoint {store.fingerprint}, serving {self._fingerprint} ({resolve(self.ckpt_path)})"
+        elif slice_len != self.slice_len:
+            reason = f"built at slice_len {slice_len}, serving {self.slice_len}"
+        else:
+            self.store = store
+            print(f"[store] serving {store.root} (seed {store.seed}, layers {', '.join(store.layers)})", flush=True)
+            return True
+        print(f"[store] not using {store.root}: {reason}", flush=True)
+        return False
+
+    def attach_pool(self, pool) -> None:
+        """Render cache/store misses in a multi-process WorkerPool instead of this process."""
+        self.pool = pool
+
+    def pool_stats(self) -> dict:
+        return self.pool.stats() if self.pool is not None else {"enabled": False}
+
+    def store_stats(self) -> dict:
+        return self.store.stats() if self.store is not None else {"enabled": False}
+
+    def _store_lookup(self, code: list[int], seed: Optional[int], layer: str):
+        if self.store is None or seed is None or seed != self.store.seed:
+            return None
+        # "final" and the last upconv are the same output; the alias comes from the index so a hit never loads the model
+        names = [layer]
+        last = self.store.last_layer
+        if layer == "final" and last is not None:
+            names.append(last)
+        elif last is not None and layer == last:
+            names.append("final")
+        for name in names:
+            if self.store.has(name):
+                return self.store.lookup(code, name)
+        return None
+
+    def synthesize_wav(self, code: list[int], seed: Optional[int] = None):
+        """Generate for a categorical code and return (WAV bytes, z) without touching disk."""
+        seed = self.default_seed if seed is None else seed
+        z = make_latent(code, seed)
+        hit = self._store_lookup(code, seed, "final")
+        if hit is not None:
+            # stored rows are already peak-normalized; int16 rows go out as 16-bit PCM
+            return encode_wav(hit, self.sample_rate, normalize=False), z[0]
+        def produce():
+            if self.pool is not None:
+                return self.pool.run(z, kind="wav")
+            audio = self.generate(z)
+            with stage("encode"):
+                return encode_wav(audio, self.sample_rate)
+
+        data = self._cached(seed, (tuple(code), "final"), produce)
+        return data, z[0]
+
+    def synthesize_arrays(self, code: list[int], layers: list[str], seed: Optional[int] = None, stretched: bool = True):
+        """Peak-normalized float32 waveforms at sample_rate for each requested layer ("final" included), plus z.
+
+        These are the samples encode_wav would write, handed over without encoding,
+        e.g. straight to the ASR engine.
+        """
+        seed = self.default_seed if seed is None else seed
+        z = make_latent(code, seed)
+        if list(layers) == ["final"]:
+            out = {"final": self.generate(z)}
+        else:
+            out = self.generate_layer_set(z, layers, stretched=stretched)
+        return {name: peak_normalize(x) for name, x in out.items()}, z[0]
+
+    def synthesize_layer_wav(self, code: list[int], layer: str, seed: Optional[int] = None, stretched: bool = True):
+        seed = self.default_seed if seed is None else seed
+        z = make_latent(code, seed)
+        hit = self._store_lookup(code, seed, layer)
+        if hit is not None:
+            if stretched and hit.shape[0] != self.slice_len:
+                return encode_wav(_stretch(hit, self.slice_len), self.sample_rate), z[0]
+            return encode_wav(hit, self.sample_rate, normalize=False), z[0]
+        def produce():
+            if self.pool is not None:
+                return self.pool.run(z, kind="wav", layer=layer, stretched=stretched)
+            audio = self.generate_layer(z, layer, stretched=stretched)
+            with stage("encode"):
+                return encode_wav(audio, self.sample_rate)
+
+        data = self._cached(seed, (tuple(code), "layer", layer, stretched), produce)
+        return data, z[0]
+
+    def synthesize_bundle(self, code: list[int], layers: list[str], seed: Optional[int] = None, stretched: bool = True, dtype: str = "float32"):
+        seed = self.default_seed if seed is None else seed
+        z = make_latent(code, seed)
+
+        def produce():
+            out = self.generate_layer_set(z, layers, stretched=stretched)
+            meta = {"categorical_code": list(code), "stretched": stretched, "seed": seed}
+            with stage("encode"):
+                return pack_bundle(list(out.items()), self.sample_rate, dtype=dtype, meta=meta)
+
+        return self._cached(seed, (tuple(code), "bundle", tuple(layers), stretched, dtype), produce), z[0]
+
+    def synthesize_interpolation(
+        self,
+        keyframes: list,
+        steps: int,
+        mode: str = "linear",
+        layers: Optional[list[str]] = None,
+        stretched: bool = True,
+        dtype: str = "float32",
+        batch_size: int = 16,
+    ) -> bytearray:
+        """Render a keyframe sweep in batched forwards and pack every frame into one bundle.
+
+        Items are "frameNNNN" for the output and "frameNNNN/<layer>" for each
+        captured layer. The path is fully determined by the keyframes, so the
+        packed result is cached without needing a seed.
+        """
+        from streaming import interpolation_path
+
+        zs = interpolation_path(keyframes, steps, mode)
+        layers = [name for name in (layers or []) if name != "final"]
+
+        def produce():
+            entries = []
+            for start in range(0, steps, batch_size):
+                zb = zs[start : start + batch_size]
+                if layers:
+                    out = self.generate_layer_batch(zb, ["final"] + layers)
+                else:
+                    out = {"final": self.generate_batch(zb)}
+                for row in range(zb.shape[0]):
+                    frame = f"frame{start + row:04d}"
+                    entries.append((frame, out["final"][row]))
+                    for name in layers:
+                        arr = out[name][row]
+                        entries.append((f"{frame}/{name}", _stretch(arr, self.slice_len) if stretched else arr))
+            meta = {"frames": steps, "mode": mode, "layers": layers, "stretched": stretched}
+            with stage("encode"):
+                return pack_bundle(entries, self.sample_rate, dtype=dtype, meta=meta)
+
+        if self.cache is None:
+            return produce()
+        digest = hashlib.sha256(zs.tobytes()).hexdigest()
+        key = AudioCache.key(self._fingerprint, self.slice_len, "interp", digest, tuple(layers), stretched, dtype)
+        return self.cache.get_or_create(key, produce)
+
+    def synthesize_and_store(self, code: list[int], batch_dir: str, seed: Optional[int] = None):
+        data, z = self.synthesize_wav(code, seed)
+        fname = f"gen_{uuid.uuid4().hex}.wav"
+        path = os.path.join(batch_dir, fname)
+        os.makedirs(batch_dir, exist_ok=True)
+        with stage("write"):
+            write_bytes(data, path)
+        return path, z
+
+
+
+def load_service_from_env() -> WaveGANServiceBase:
+    ckpt = os.environ.get("GAN_CHECKPOINT", "checkpoint/epoch450_step166500_G.pt")
+    backend = os.environ.get("GAN_BACKEND", "eager")
+    if backend == "onnxruntime":
+        from onnx_backend import OnnxWaveGANService
+
+        service = OnnxWaveGANService(os.environ.get("GAN_ONNX_MODEL", os.path.splitext(ckpt)[0] + ".onnx"))
+    else:
+        from inference_cached import WaveGANService
+
+        service = WaveGANService(ckpt, backend=backend, compile_dir=os.environ.get("GAN_COMPILE_DIR", "compiled"))
+    cache_mb = int(os.environ.get("GAN_CACHE_MB", "256"))
+    if cache_mb > 0:
+        service.cache = AudioCache(
+            memory_bytes=cache_mb << 20,
+            disk_dir=os.environ.get("GAN_CACHE_DIR") or None,
+            disk_bytes=int(os.environ.get("GAN_CACHE_DISK_MB", "2048")) << 20,
+        )
+    store_dir = os.environ.get("GAN_STORE_DIR")
+    if store_dir and os.path.exists(os.path.join(store_dir, "index.json")):
+        from waveform_store import WaveformStore
+
+        service.attach_store(WaveformStore(store_dir))
+    elif store_dir:
+        print(f"[store] GAN_STORE_DIR={store_dir} has no {os.path.join(store_dir, 'index.json')}; build it with waveform_store.py", flush=True)
+    if os.environ.get("GAN_DEFAULT_SEED"):
+        service.default_seed = int(os.environ["GAN_DEFAULT_SEED"])
+    processes = int(os.environ.get("GAN_PROCESSES", "0"))
+    if processes > 0:
+        from worker_pool import WorkerPool, is_pool_worker
+
+        # spawn re-imports the main module in pool children; only those skip the pool. Server
+        # processes (uvicorn --workers / --reload children included) each start their own
+        if is_pool_worker():
+            print(f"[pool] pid {os.getpid()} is a pool worker; not starting a nested pool", flush=True)
+        else:
+            timeout_s = float(os.environ.get("GAN_POOL_TIMEOUT_S", "30"))
+            pool = WorkerPool(service.ckpt_path, workers=processes, slice_len=service.slice_len, backend=service.backend, compile_dir=service.compile_dir, timeout_s=timeout_s)
+            service.attach_pool(pool)
+            print(f"[pool] pid {os.getpid()} started {processes} generator worker(s)", flush=True)
+    if backend != "onnxruntime":
+        from profiling import TraceSampler
+
+        service.attach_profiler(TraceSampler.from_env())
+    max_batch = int(os.environ.get("GAN_MAX_BATCH", "16"))
+    if max_batch > 1:
+        service.enable_batching(max_batch=max_batch, max_wait_ms=float(os.environ.get("GAN_MAX_WAIT_MS", "5")))
+    return service
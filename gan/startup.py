@@ -0,0 +1,153 @@
+"""Cold start off the import path.
+
+The servers import only light modules and start a Startup thread, which
+imports the backend (inference_cached and torch, or onnx_backend alone for
+GAN_BACKEND=onnxruntime), builds the service, loads the checkpoint and runs
+zero-latent warm-up forwards at GAN_WARMUP_BATCHES plus one truncated forward
+over every layer (GAN_WARMUP_LAYERS=0 skips it). With ASR_WARMUP=1 it also
+loads Whisper on one second of silence.
+
+The service is published only once the checkpoint has loaded. Until then
+generation routes answer 503 with Retry-After, and they keep answering 503
+with the error if the build or load failed. Each phase (boot, import_backend,
+build_service, load_generator, warmup_b<N>, warmup_layers, asr_load) is
+printed as one "[startup] ready ..." line and exported as
+gan_startup_seconds{phase}.
+"""
+import importlib
+import os
+import threading
+import time
+import traceback
+from typing import Callable, Optional
+
+import numpy as np
+
+from metrics import READY, STARTUP_SECONDS
+
+__author__ = "Riccardo Petrini"
+
+_IMPORTED = time.perf_counter()
+
+
+def _process_age() -> Optional[float]:
+    """Seconds since the process was exec'd (interpreter start + imports up to here); None without procfs."""
+    try:
+        with open("/proc/self/stat") as fh:
+            # field 22 (starttime, clock ticks since boot); split after the ")" since comm may contain spaces
+            start_ticks = int(fh.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as fh:
+            uptime = float(fh.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK") - (time.perf_counter() - _IMPORTED))
+
+
+class Startup:
+    """Builds the service on a background thread and reports readiness for /health.
+
+    The server module only imports light modules. The thread imports the
+    backend (inference_cached and torch, or onnx_backend without torch for
+    GAN_BACKEND=onnxruntime), calls `build` for the service, loads
+    the generator and runs dummy forwards at GAN_WARMUP_BATCHES sizes, plus
+    a truncated forward so layer routes are warm too. With ASR_WARMUP=1 it
+    also loads Whisper. Each phase is timed, exported as gan_startup_seconds
+    and printed as one summary line. `service` is set once the generator has
+    loaded; until then (and for good if building or loading fails) the
+    servers answer 503, after that requests run (just slower) while warm-up
+    finishes.
+    """
+
+    def __init__(self, build: Callable[[], object], warmup_batches=(1,), warm_layers: bool = True, asr=None, backend_module: str = "inference_cached"):
+        self.build = build
+        self.backend_module = backend_module
+        self.warmup_batches = tuple(warmup_batches)
+        self.warm_layers = warm_layers
+        self.asr = asr
+        self.service = None
+        self.state = "starting"
+        self.error: Optional[str] = None
+        self.phases: dict[str, float] = {}
+        self.started = time.perf_counter()
+        self.ready_s: Optional[float] = None
+        self._ready = threading.Event()
+        self._thread = None
+        boot = _process_age()
+        if boot is not None:
+            self._record("boot", boot)
+        self._record("server_import", self.started - _IMPORTED)
+
+    def _record(self, phase: str, seconds: float):
+        self.phases[phase] = seconds
+        STARTUP_SECONDS.set(seconds, phase)
+
+    def _phase(self, phase: str, fn, *args):
+        t0 = time.perf_counter()
+        out = fn(*args)
+        self._record(phase, time.perf_counter() - t0)
+        return out
+
+    def _run(self):
+        try:
+            self._phase("import_backend", importlib.import_module, self.backend_module)
+            service = self._phase("build_service", self.build)
+            self._phase("load_generator", service._lazy_load)
+            # published only once the checkpoint loaded: a failed load leaves the servers answering 503
+            self.service = service
+            self.state = "warming"
+            for n in self.warmup_batches:
+                self._phase(f"warmup_b{n}", service.generate_batch, np.zeros((n, 100), dtype=np.float32))
+            if self.warm_layers:
+                z = np.zeros((1, 100), dtype=np.float32)
+                try:
+                    self._phase("warmup_layers", service.generate_layer_batch, z, service.layer_names())
+                except ValueError:
+                    pass  # ONNX model exported without layer outputs; layer routes 404 anyway
+            if self.asr is not None:
+                self._phase("asr_load", self.asr.transcribe, np.zeros(16000, dtype=np.float32))
+        except BaseException as exc:
+            self.state = "failed"
+            self.error = f"{type(exc).__name__}: {exc}"
+            traceback.print_exc()
+            print(f"[startup] failed after {time.perf_counter() - self.started:.2f}s: {self.error}", flush=True)
+            return
+        self.ready_s = time.perf_counter() - self.started
+        self.state = "ready"
+        READY.set(1)
+        self._ready.set()
+        breakdown = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
+        print(f"[startup] ready {self.ready_s:.2f}s after import: {breakdown}", flush=True)
+
+    def start(self) -> "Startup":
+        if self._thread is None:
+            READY.set(0)
+            self._thread = threading.Thread(target=self._run, name="startup", daemon=True)
+            self._thread.start()
+        return self
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def report(self) -> dict:
+        return {
+            "ready": self.ready,
+            "state": self.state,
+            "error": self.error,
+            "ready_s": self.ready_s,
+            "phases": dict(self.phases),
+        }
+
+    @classmethod
+    def from_env(cls, build: Callable[[], object], asr=None) -> "Startup":
+        batches = [int(b) for b in os.environ.get("GAN_WARMUP_BATCHES", "1,4").split(",") if b.strip()]
+        return cls(
+            build,
+            warmup_batches=batches,
+            warm_layers=os.environ.get("GAN_WARMUP_LAYERS", "1") != "0",
+            asr=asr if os.environ.get("ASR_WARMUP", "0") == "1" else None,
+            backend_module="onnx_backend" if os.environ.get("GAN_BACKEND") == "onnxruntime" else "inference_cached",
+        )
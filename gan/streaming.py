@@ -0,0 +1,240 @@
+"""Continuous long-form audio from a latent trajectory.
+
+A trajectory (linear or slerp between keyframe latents, looping, or a Gaussian
+random walk on the noise slots with the code held fixed) feeds LatentStream.
+It renders batch_size upcoming clips per forward on a producer thread, keeps at
+most `lookahead` batches queued, so memory stays bounded for any duration, and
+joins consecutive clips with an equal-power overlap-add crossfade. Any
+generate_batch(z) -> (N, L) callable works, so every backend can stream.
+
+server_fastapi.py serves it as POST /generate_stream: a WAV header with unknown
+length followed by PCM, in a chunked body. Each batch runs as an ordinary job on
+the generator executor and waits up to GAN_STREAM_WAIT_S for room before the
+stream ends.
+"""
+import math
+import queue
+import threading
+from typing import Callable, Iterator, Optional
+
+import numpy as np
+
+from latents import make_latent
+
+__author__ = "Riccardo Petrini"
+
+MODES = ("linear", "slerp", "walk")
+
+
+def lerp(a: np.ndarray, b: np.ndarray, t: float) -> np.ndarray:
+    return ((1.0 - t) * a + t * b).astype(np.float32)
+
+
+def slerp(a: np.ndarray, b: np.ndarray, t: float) -> np.ndarray:
+    """Spherical interpolation; falls back to lerp when the vectors are (anti)parallel."""
+    na, nb = np.linalg.norm(a), np.linalg.norm(b)
+    if na == 0 or nb == 0:
+        return lerp(a, b, t)
+    cos = float(np.clip(np.dot(a / na, b / nb), -1.0, 1.0))
+    omega = math.acos(cos)
+    if abs(math.sin(omega)) < 1e-6:
+        return lerp(a, b, t)
+    s = math.sin(omega)
+    return ((math.sin((1.0 - t) * omega) / s) * a + (math.sin(t * omega) / s) * b).astype(np.float32)
+
+
+def interpolation_path(keyframes: list[np.ndarray], steps: int, mode: str = "linear") -> np.ndarray:
+    """(steps, D) latents spread evenly over the keyframe polyline, first and last keyframe included."""
+    if mode not in ("linear", "slerp"):
+        raise ValueError("interpolation mode must be 'linear' or 'slerp'")
+    frames = [np.asarray(k, dtype=np.float32).reshape(-1) for k in keyframes]
+    if len(frames) < 2 or steps < 2:
+        raise ValueError("need at least two keyframes and two steps")
+    interp = slerp if mode == "slerp" else lerp
+    segments = len(frames) - 1
+    out = np.empty((steps, frames[0].shape[0]), dtype=np.float32)
+    for i in range(steps):
+        t = i * segments / (steps - 1)
+        seg = min(int(t), segments - 1)
+        out[i] = interp(frames[seg], frames[seg + 1], t - seg)
+    return out
+
+
+def keyframe_trajectory(keyframes: list[np.ndarray], steps_per_segment: int = 8, mode: str = "slerp", loop: bool = True) -> Iterator[np.ndarray]:
+    """Walk keyframe -> keyframe in `steps_per_segment` steps each; wraps back to the first one when loop=True."""
+    if mode not in ("linear", "slerp"):
+        raise ValueError("keyframe mode must be 'linear' or 'slerp'")
+    if not keyframes:
+        raise ValueError("need at least one keyframe")
+    interp = slerp if mode == "slerp" else lerp
+    frames = [np.asarray(k, dtype=np.float32).reshape(-1) for k in keyframes]
+    if len(frames) == 1:
+        while True:
+            yield frames[0]
+    pairs = list(zip(frames, frames[1:] + frames[:1])) if loop else list(zip(frames, frames[1:]))
+    while True:
+        for a, b in pairs:
+            for i in range(steps_per_segment):
+                yield interp(a, b, i / steps_per_segment)
+        if not loop:
+            yield frames[-1]
+            return
+
+
+def random_walk(start: np.ndarray, step: float = 0.05, seed: Optional[int] = None, fixed: int = 16) -> Iterator[np.ndarray]:
+    """Gaussian random walk on the noise part of z, reflected back into [-1, 1]; the first `fixed` slots (code) stay put."""
+    rng = np.random.default_rng(seed)
+    z = np.asarray(start, dtype=np.float32).reshape(-1).copy()
+    while True:
+        yield z.copy()
+        z[fixed:] += rng.normal(0.0, step, z.shape[0] - fixed).astype(np.float32)
+        z = np.where(z > 1.0, 2.0 - z, z)
+        z = np.where(z < -1.0, -2.0 - z, z).astype(np.float32)
+
+
+def build_trajectory(mode: str, codes: list[list[int]], seed: Optional[int] = None, steps_per_segment: int = 8, step: float = 0.05) -> Iterator[np.ndarray]:
+    """Trajectory from request-level inputs: keyframes are categorical codes turned into latents with make_latent."""
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {MODES}")
+    base = 0 if seed is None else seed
+    frames = [make_latent(code, None if seed is None else base + i)[0] for i, code in enumerate(codes)]
+    if mode == "walk":
+        return random_walk(frames[0], step=step, seed=seed)
+    return keyframe_trajectory(frames, steps_per_segment, mode)
+
+
+class LatentStream:
+    """Continuous audio from a latent trajectory, one fixed-length clip per trajectory point.
+
+    A producer thread renders `batch_size` upcoming clips per forward and keeps
+    at most `lookahead` batches queued ahead of the consumer, so memory stays at
+    roughly (lookahead + 2) * batch_size * clip_len floats no matter how long
+    the stream runs. Consecutive clips overlap by `overlap` samples and are
+    joined with an equal-power crossfade; each yielded chunk is clip_len - overlap
+    float32 samples.
+    """
+
+    def __init__(
+        self,
+        generate_batch: Callable[[np.ndarray], np.ndarray],
+        trajectory: Iterator[np.ndarray],
+        clip_len: int,
+        overlap: int = 4096,
+        batch_size: int = 4,
+        lookahead: int = 2,
+        max_clips: Optional[int] = None,
+    ):
+        if not 0 <= overlap < clip_len // 2:
+            raise ValueError("overlap must be in [0, clip_len / 2)")
+        self.generate_batch = generate_batch
+        self.trajectory = trajectory
+        self.clip_len = clip_len
+        self.overlap = overlap
+        self.batch_size = max(1, int(batch_size))
+        self.lookahead = max(1, int(lookahead))
+        self.max_clips = max_clips
+        t = (np.arange(overlap, dtype=np.float32) + 0.5) / max(overlap, 1)
+        self._fade_in = np.sin(0.5 * np.pi * t).astype(np.float32)
+        self._fade_out = np.cos(0.5 * np.pi * t).astype(np.float32)
+        self._queue: "queue.Queue" = queue.Queue(maxsize=self.lookahead)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.clips = 0
+        self.batches = 0
+
+    @property
+    def hop(self) -> int:
+        return self.clip_len - self.overlap
+
+    def max_buffered_bytes(self) -> int:
+        return (self.lookahead + 2) * self.batch_size * self.clip_len * 4
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        produced = 0
+        try:
+            while not self._stop.is_set():
+                n = self.batch_size if self.max_clips is None else min(self.batch_size, self.max_clips - produced)
+                if n <= 0:
+                    break
+                z = []
+                for point in self.trajectory:
+                    z.append(point)
+                    if len(z) == n:
+                        break
+                if not z:
+                    break
+                clips = self.generate_batch(np.stack(z).astype(np.float32))
+                produced += len(z)
+                self.batches += 1
+                if not self._put(clips):
+                    return
+            self._put(None)
+        except Exception as exc:
+            self._put(exc)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._produce, name="latent-stream", daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        """Stop the producer and drop queued clips; safe to call from a client-disconnect handler."""
+        self._stop.set()
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        self.start()
+        tail = None
+        o = self.overlap
+        try:
+            while True:
+                clips = self._queue.get()
+                if clips is None:
+                    break
+                if isinstance(clips, Exception):
+                    raise clips
+                for clip in clips:
+                    clip = np.asarray(clip, dtype=np.float32)
+                    out = clip[: self.hop].copy()
+                    if tail is not None and o:
+                        out[:o] = clip[:o] * self._fade_in + tail * self._fade_out
+                    tail = clip[self.hop :].copy()
+                    self.clips += 1
+                    yield out
+            if tail is not None and o:
+                yield tail * self._fade_out
+        finally:
+            self.close()
+
+    def stats(self) -> dict:
+        return {
+            "clips": self.clips,
+            "batches": self.batches,
+            "queued_batches": self._queue.qsize(),
+            "max_buffered_bytes": self.max_buffered_bytes(),
+        }
+
+
+def iter_pcm_bytes(chunks: Iterator[np.ndarray], dtype: str = "float32", max_bytes: int = 64 * 1024) -> Iterator[bytes]:
+    """Little-endian PCM bytes from float chunks, split to at most max_bytes per piece."""
+    for chunk in chunks:
+        if dtype == "int16":
+            data = np.round(np.clip(chunk, -1.0, 1.0) * 32767.0).astype("<i2").tobytes()
+        else:
+            data = np.asarray(chunk, dtype="<f4").tobytes()
+        for start in range(0, len(data), max_bytes):
+            yield data[start : start + max_bytes]
@@ -0,0 +1,405 @@
+"""TranscriptionEngine: the batched, cached Whisper queue behind the ASR routes.
+
+Requests are 16 kHz float32 arrays; load_audio reads WAVs without ffmpeg. One
+worker thread owns the model, loads it on first use and waits up to
+ASR_MAX_WAIT_MS for up to ASR_MAX_BATCH clips, then sends each language group
+to the backend in one call. faster-whisper batches through
+BatchedInferencePipeline when a language is given and runs clip by clip with
+VAD otherwise; openai-whisper decodes a stacked mel batch and adds word timings
+per clip.
+
+Transcripts are cached by sha256(PCM) + language + model, and identical audio
+already queued shares one future. Past ASR_QUEUE pending clips submit()
+raises queue.Full and the server answers 429. A failing on_batch hook is
+logged instead of stopping the worker.
+
+finneGAN-replicate/transcription.py is generated from this file by
+finneGAN-replicate/vendor.py.
+"""
+import hashlib
+import os
+import queue
+import struct
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, InvalidStateError
+from typing import Callable, Optional
+
+import numpy as np
+
+__author__ = "Riccardo Petrini"
+
+SAMPLE_RATE = 16000
+# both Whisper front ends decode at most 30 s per window
+WINDOW_SAMPLES = 30 * SAMPLE_RATE
+
+
+def load_audio(path: str) -> np.ndarray:
+    """Mono float32 at 16 kHz from a PCM16 / 32-bit float WAV (what wavio and scipy write), without ffmpeg."""
+    with open(path, "rb") as fh:
+        data = fh.read()
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise ValueError(f"{path}: not a WAV file")
+    pos, fmt, audio = 12, None, None
+    while pos + 8 <= len(data):
+        cid, size = struct.unpack_from("<4sI", data, pos)
+        body = data[pos + 8 : pos + 8 + size]
+        if cid == b"fmt ":
+            fmt = struct.unpack_from("<HHIIHH", body)
+        elif cid == b"data":
+            audio = body
+            break
+        pos += 8 + size + (size & 1)
+    if fmt is None or audio is None:
+        raise ValueError(f"{path}: missing fmt or data chunk")
+    tag, channels, rate, _, _, bits = fmt
+    if tag == 3 and bits == 32:
+        x = np.frombuffer(audio[: len(audio) // 4 * 4], dtype="<f4")
+    elif tag == 1 and bits == 16:
+        x = np.frombuffer(audio[: len(audio) // 2 * 2], dtype="<i2").astype(np.float32) / 32768.0
+    else:
+        raise ValueError(f"{path}: unsupported WAV format {tag}/{bits}-bit")
+    x = x.reshape(-1, channels).mean(axis=1) if channels > 1 else x
+    if rate != SAMPLE_RATE:
+        n = int(round(x.shape[0] * SAMPLE_RATE / rate))
+        x = np.interp(np.arange(n) * (rate / SAMPLE_RATE), np.arange(x.shape[0]), x)
+    # copy: frombuffer views are read-only and torch.from_numpy warns on them
+    return np.array(x, dtype=np.float32)
+
+
+def _format(language: Optional[str], duration: float, segments) -> dict:
+    """Common response shape; segments are (start, end, text, [(start, end, word), ...])."""
+    out = {"language": language, "duration": float(duration), "text": "", "segments": [], "words": []}
+    texts = []
+    for start, end, text, words in segments:
+        entry = {"start": float(start or 0.0), "end": float(end or 0.0), "text": (text or "").strip()}
+        items = [{"start": float(ws), "end": float(we), "text": (w or "").strip()} for ws, we, w in words if ws is not None and we is not None]
+        if items:
+            entry["words"] = items
+            out["words"].extend(items)
+        if entry["text"]:
+            texts.append(entry["text"])
+        out["segments"].append(entry)
+    out["text"] = " ".join(texts).strip()
+    return out
+
+
+class FasterWhisperBackend:
+    """faster-whisper (CTranslate2).
+
+    With an explicit language, a batch of clips is concatenated and passed to
+    BatchedInferencePipeline with one clip_timestamps entry per request. That
+    way every clip is encoded and decoded in a single batched call. Without a
+    language (detection runs once per pipeline call), or for clips longer than
+    one window, clips run one by one through WhisperModel.transcribe with VAD.
+    """
+
+    def __init__(self, name: str = "small", device: str = "cpu", compute_type: str = "int8"):
+        from faster_whisper import WhisperModel
+
+        self.model = WhisperModel(name, device=device, compute_type=compute_type)
+        try:
+            from faster_whisper import BatchedInferencePipeline
+
+            self.pipeline = BatchedInferencePipeline(self.model)
+        except ImportError:  # faster-whisper < 1.1
+            self.pipeline = None
+
+    def _one(self, clip: np.ndarray, language: Optional[str]) -> dict:
+        segments, info = self.model.transcribe(clip, language=language, vad_filter=True, beam_size=5, word_timestamps=True)
+        return _format(
+            info.language,
+            info.duration,
+            ((s.start, s.end, s.text, [(w.start, w.end, w.word) for w in (s.words or [])]) for s in segments),
+        )
+
+    def transcribe_batch(self, clips: list[np.ndarray], language: Optional[str]) -> list[dict]:
+        if self.pipeline is None or language is None or len(clips) == 1 or any(c.shape[0] > WINDOW_SAMPLES for c in clips):
+            return [self._one(c, language) for c in clips]
+        bounds = np.cumsum([0] + [c.shape[0] for c in clips]) / SAMPLE_RATE
+        stamps = [{"start": float(bounds[i]), "end": float(bounds[i + 1])} for i in range(len(clips))]
+        segments, _ = self.pipeline.transcribe(
+            np.concatenate(clips), language=language, clip_timestamps=stamps, batch_size=len(clips), beam_size=5, word_timestamps=True
+        )
+        per_clip = [[] for _ in clips]
+        for s in segments:
+            i = min(int(np.searchsorted(bounds, s.start + 1e-3, side="right")) - 1, len(clips) - 1)
+            off = bounds[i]
+            words = [(w.start - off, w.end - off, w.word) for w in (s.words or [])]
+            per_clip[i].append((s.start - off, s.end - off, s.text, words))
+        return [_format(language, c.shape[0] / SAMPLE_RATE, segs) for c, segs in zip(clips, per_clip)]
+
+
+class OpenAIWhisperBackend:
+    """openai-whisper (PyTorch).
+
+    Clips up to one window long become a (N, n_mels, 3000) mel batch. They go
+    through a single whisper.decode call, which also detects each clip's
+    language in the same batch. Segment boundaries come from the timestamp
+    tokens, and word timings from whisper.timing.add_word_timestamps per clip.
+    Longer clips fall back to whisper.transcribe.
+    """
+
+    def __init__(self, name: str = "small", device: Optional[str] = None):
+        import torch
+        import whisper
+
+        self.whisper = whisper
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.model = whisper.load_model(name, device=self.device)
+        if self.device != "cuda":
+            from whisper.timing import dtw_cpu
+
+            # compile the numba DTW kernel behind word timestamps now instead of inside the first request
+            dtw_cpu(np.zeros((2, 2)))
+
+    def _one(self, clip: np.ndarray, language: Optional[str]) -> dict:
+        result = self.whisper.transcribe(self.model, clip, language=language, word_timestamps=True, verbose=None, fp16=self.device == "cuda")
+        segments = [
+            (s.get("start"), s.get("end"), s.get("text"), [(w.get("start"), w.get("end"), w.get("word")) for w in s.get("words", []) or []])
+            for s in result.get("segments", []) or []
+        ]
+        return _format(result.get("language"), clip.shape[0] / SAMPLE_RATE, segments)
+
+    def transcribe_batch(self, clips: list[np.ndarray], language: Optional[str]) -> list[dict]:
+        import torch
+        from whisper.audio import HOP_LENGTH, N_FRAMES
+        from whisper.timing import add_word_timestamps
+        from whisper.tokenizer import get_tokenizer
+
+        if any(c.shape[0] > WINDOW_SAMPLES for c in clips):
+            return [self._one(c, language) for c in clips]
+        fp16 = self.device == "cuda"
+        mels, frames = [], []
+        for clip in clips:
+            mel = self.whisper.log_mel_spectrogram(torch.from_numpy(clip), self.model.dims.n_mels)
+            frames.append(min(mel.shape[-1], N_FRAMES))
+            mels.append(self.whisper.pad_or_trim(mel, N_FRAMES))
+        mel = torch.stack(mels).to(self.model.device).to(torch.float16 if fp16 else torch.float32)
+        options = self.whisper.DecodingOptions(language=language, without_timestamps=False, fp16=fp16)
+        with torch.no_grad():
+            results = self.whisper.decode(self.model, mel, options)
+
+        precision = 2 * HOP_LENGTH / SAMPLE_RATE
+        out = []
+        for i, (clip, res) in enumerate(zip(clips, results)):
+            duration = clip.shape[0] / SAMPLE_RATE
+            tokenizer = get_tokenizer(self.model.is_multilingual, num_languages=self.model.num_languages, language=res.language, task="transcribe")
+            segments, current, start = [], [], 0.0
+            for tok in list(res.tokens) + [tokenizer.timestamp_begin + int(round(duration / precision))]:
+                if tok < tokenizer.timestamp_begin:
+                    current.append(tok)
+                    continue
+                stamp = (tok - tokenizer.timestamp_begin) * precision
+                if current:
+                    segments.append({"seek": 0, "start": start, "end": stamp, "tokens": current, "text": tokenizer.decode(current)})
+                    current = []
+                start = stamp
+            add_word_timestamps(segments=segments, model=self.model, tokenizer=tokenizer, mel=mel[i], num_frames=frames[i], last_speech_timestamp=0.0)
+            out.append(
+                _format(
+                    res.language,
+                    duration,
+                    [(s["start"], s["end"], s["text"], [(w["start"], w["end"], w["word"]) for w in s.get("words", [])]) for s in segments],
+                )
+            )
+        return out
+
+
+class TranscriptionEngine:
+    """Queued ASR over 16 kHz float32 arrays with batching, coalescing and a transcript cache.
+
+    submit() hashes the PCM together with the language and model id. Cached
+    transcripts come back immediately. A request for audio that is already
+    queued attaches to the same future. Everything else goes into a bounded
+    queue; past max_queue, submit() raises queue.Full.
+
+    A single worker thread owns the model and loads it lazily on the first
+    batch. It waits at most max_wait_ms for up to max_batch clips and hands
+    each language group to backend.transcribe_batch in one call. Each future
+    resolves to (transcript, {"queue_ms", "compute_ms", "batch_size"}).
+    `on_batch(n_clips, seconds)`, when set, is called after every backend call
+    (e.g. to feed a metrics histogram).
+    """
+
+    def __init__(
+        self,
+        backend_factory: Callable[[], object],
+        model_id: str,
+        max_batch: int = 8,
+        max_wait_ms: float = 20.0,
+        max_queue: int = 8,
+        cache_entries: int = 1024,
+    ):
+        self.backend_factory = backend_factory
+        self.model_id = model_id
+        self.backend = None
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait_s = max(0.0, float(max_wait_ms)) / 1000.0
+        self.cache_entries = max(0, int(cache_entries))
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._lock = threading.Lock()
+        self._inflight: dict[str, Future] = {}
+        self._cache: "OrderedDict[str, dict]" = OrderedDict()
+        self._batch_hist: dict[int, int] = {}
+        self._requests = 0
+        self._hits = 0
+        self._coalesced = 0
+        self._rejected = 0
+        self._compute_ewma_s = 0.0
+        self._load_s = None
+        self.on_batch: Optional[Callable[[int, float], None]] = None
+        self._worker = threading.Thread(target=self._run, name="asr-engine", daemon=True)
+        self._worker.start()
+
+    def key(self, audio: np.ndarray, language: Optional[str]) -> str:
+        h = hashlib.sha256(audio.tobytes())
+        h.update(f"|{language or 'auto'}|{self.model_id}".encode("utf-8"))
+        return h.hexdigest()
+
+    def submit(self, audio: np.ndarray, language: Optional[str] = None) -> Future:
+        audio = np.ascontiguousarray(audio, dtype=np.float32).reshape(-1)
+        language = language or None
+        key = self.key(audio, language)
+        with self._lock:
+            self._requests += 1
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self._hits += 1
+                fut: Future = Future()
+                fut.set_result((cached, {"queue_ms": 0.0, "compute_ms": 0.0, "batch_size": 0}))
+                return fut
+            pending = self._inflight.get(key)
+            if pending is not None:
+                self._coalesced += 1
+                return pending
+            fut = Future()
+            try:
+                self._queue.put_nowait((key, audio, language, fut, time.perf_counter()))
+            except queue.Full:
+                self._rejected += 1
+                raise
+            self._inflight[key] = fut
+            return fut
+
+    def transcribe(self, audio: np.ndarray, language: Optional[str] = None, timeout: Optional[float] = None) -> dict:
+        return self.submit(audio, language).result(timeout=timeout)[0]
+
+    def transcribe_file(self, path: str, language: Optional[str] = None, timeout: Optional[float] = None) -> dict:
+        return self.transcribe(load_audio(path), language, timeout)
+
+    def retry_after(self) -> int:
+        """Seconds until the queue should have drained, at least 1."""
+        with self._lock:
+            batches = self._queue.qsize() / self.max_batch + 1
+            return max(1, int(np.ceil(batches * self._compute_ewma_s)))
+
+    def _collect(self):
+        items = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_s
+        while len(items) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _resolve(self, items, results=None, exc=None, timing=None):
+        with self._lock:
+            for i, (key, _, _, _, _) in enumerate(items):
+                self._inflight.pop(key, None)
+                if exc is None and self.cache_entries:
+                    self._cache[key] = results[i]
+                    while len(self._cache) > self.cache_entries:
+                        self._cache.popitem(last=False)
+        for i, (_, _, _, fut, submitted) in enumerate(items):
+            # a caller may have cancelled its future meanwhile; the others still get their result
+            try:
+                if exc is not None:
+                    fut.set_exception(exc)
+                else:
+                    queue_ms = (timing["started"] - submitted) * 1000.0
+                    fut.set_result((results[i], {"queue_ms": queue_ms, "compute_ms": timing["compute_ms"], "batch_size": timing["batch_size"]}))
+            except InvalidStateError:
+                pass
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            groups: dict[Optional[str], list] = {}
+            for item in items:
+                groups.setdefault(item[2], []).append(item)
+            for language, group in groups.items():
+                started = time.perf_counter()
+                try:
+                    if self.backend is None:
+                        self.backend = self.backend_factory()
+                        self._load_s = time.perf_counter() - started
+                        started = time.perf_counter()
+                    results = self.backend.transcribe_batch([audio for _, audio, _, _, _ in group], language)
+                except BaseException as exc:  # propagate to every waiting caller
+                    self._resolve(group, exc=exc)
+                    continue
+                compute_s = time.perf_counter() - started
+                if self.on_batch is not None:
+                    # a failing metrics hook must not take the only ASR thread down with it
+                    try:
+                        self.on_batch(len(group), compute_s)
+                    except Exception as exc:
+                        print(f"[asr] on_batch hook failed: {type(exc).__name__}: {exc}", flush=True)
+                with self._lock:
+                    n = len(group)
+                    self._batch_hist[n] = self._batch_hist.get(n, 0) + 1
+                    a = 0.2
+                    self._compute_ewma_s = compute_s if sum(self._batch_hist.values()) == 1 else (1 - a) * self._compute_ewma_s + a * compute_s
+                self._resolve(group, results=results, timing={"started": started, "compute_ms": compute_s * 1000.0, "batch_size": len(group)})
+
+    def stats(self) -> dict:
+        with self._lock:
+            batches = sum(self._batch_hist.values())
+            clips = sum(k * v for k, v in self._batch_hist.items())
+            return {
+                "model": self.model_id,
+                "loaded": self.backend is not None,
+                "load_s": self._load_s,
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait_s * 1000.0,
+                "queued": self._queue.qsize(),
+                "capacity": self._queue.maxsize,
+                "requests": self._requests,
+                "cache_hits": self._hits,
+                "coalesced": self._coalesced,
+                "rejected": self._rejected,
+                "cache_entries": len(self._cache),
+                "batches": batches,
+                "mean_batch_size": (clips / batches) if batches else 0.0,
+                "batch_size_histogram": {str(k): v for k, v in sorted(self._batch_hist.items())},
+                "mean_compute_ms": self._compute_ewma_s * 1000.0,
+            }
+
+
+def load_engine_from_env() -> TranscriptionEngine:
+    kind = os.environ.get("WHISPER_BACKEND", "faster-whisper")
+    name = os.environ.get("WHISPER_MODEL", "small")
+    if kind == "openai-whisper":
+        device = os.environ.get("WHISPER_DEVICE") or None
+        factory = lambda: OpenAIWhisperBackend(name, device)  # noqa: E731
+        model_id = f"{kind}/{name}"
+    else:
+        device = os.environ.get("WHISPER_DEVICE", "cpu")
+        compute = os.environ.get("WHISPER_COMPUTE", "int8")
+        factory = lambda: FasterWhisperBackend(name, device, compute)  # noqa: E731
+        model_id = f"{kind}/{name}/{compute}"
+    return TranscriptionEngine(
+        factory,
+        model_id,
+        max_batch=int(os.environ.get("ASR_MAX_BATCH", "8")),
+        max_wait_ms=float(os.environ.get("ASR_MAX_WAIT_MS", "20")),
+        max_queue=int(os.environ.get("ASR_QUEUE", "8")),
+        cache_entries=int(os.environ.get("ASR_CACHE_ENTRIES", "1024")),
+    )
@@ -0,0 +1,216 @@
+"""Pre-rendered outputs for the whole 16-bit categorical code space.
+
+The build renders every code at one fixed noise seed, one shard at a time
+(resumable), into (shard_size, length) int16/float16 .npy files plus
+index.json. Rows are addressed by the code read MSB-first. The final output is
+kept at slice_len and other layers at native length, stretched on read.
+
+With GAN_STORE_DIR set the service opens the shards with mmap_mode="r" and
+answers requests whose seed equals the store seed from the page cache; any
+other request runs live. Unseeded requests draw fresh noise, so they only hit
+the store when GAN_DEFAULT_SEED is set to its seed. The index records a content
+hash of the checkpoint file and the slice_len; a store that differs in either is
+not used, and the startup log says why.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+from inference_cached import WaveGANService, make_latent
+
+__author__ = "Riccardo Petrini"
+
+N_CODES = 1 << 16
+INDEX_NAME = "index.json"
+_DTYPES = {"int16": np.int16, "float16": np.float16}
+
+
+def code_to_index(code: list[int]) -> int:
+    """16 binary values -> 0..65535, first value is the most significant bit."""
+    idx = 0
+    for bit in code:
+        idx = (idx << 1) | (1 if bit else 0)
+    return idx
+
+
+def index_to_code(idx: int, bits: int = 16) -> list[int]:
+    return [(idx >> (bits - 1 - i)) & 1 for i in range(bits)]
+
+
+def _quantize(x: np.ndarray, dtype: str) -> np.ndarray:
+    """Row-wise peak normalization (same as the WAV writers) then cast to the store dtype."""
+    peak = np.max(np.abs(x), axis=1, keepdims=True)
+    peak[peak == 0] = 1.0
+    x = x / peak
+    if dtype == "int16":
+        return np.round(np.clip(x, -1.0, 1.0) * 32767.0).astype(np.int16)
+    return x.astype(np.float16)
+
+
+class WaveformStore:
+    """Pre-rendered outputs for every 16-bit categorical code at one fixed noise seed.
+
+    Layout under `root`: index.json plus one <layer>_<shard>.npy per (layer, shard),
+    each an (shard_size, length) int16/float16 array of peak-normalized audio.
+    Shards are opened with mmap_mode="r", so lookups return views straight into the
+    page cache. "final" is stored at slice_len; other layers at their native length.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        with open(os.path.join(root, INDEX_NAME), "r", encoding="utf-8") as fh:
+            self.index = json.load(fh)
+        self.seed = int(self.index["seed"])
+        self.dtype = self.index["dtype"]
+        self.shard_size = int(self.index["shard_size"])
+        self.layers = dict(self.index["layers"])
+        self.fingerprint = self.index.get("fingerprint")
+        # the last upconv, the same output as "final"; older indexes only give it away through its length
+        self.last_layer = self.index.get("last_layer") or next(
+            (name for name, length in self.layers.items() if name != "final" and length == self.index.get("slice_len")), None
+        )
+        self._complete = {name: set(shards) for name, shards in self.index.get("complete", {}).items()}
+        self._shards = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _shard(self, layer: str, shard: int):
+        key = (layer, shard)
+        arr = self._shards.get(key)
+        if arr is None:
+            with self._lock:
+                arr = self._shards.get(key)
+                if arr is None:
+                    arr = np.load(os.path.join(self.root, f"{layer}_{shard:03d}.npy"), mmap_mode="r")
+                    self._shards[key] = arr
+        return arr
+
+    def has(self, layer: str, seed: Optional[int] = None) -> bool:
+        return layer in self.layers and (seed is None or seed == self.seed)
+
+    def lookup(self, code: list[int], layer: str = "final") -> Optional[np.ndarray]:
+        """Zero-copy view of one stored row, or None if that code/layer was not rendered."""
+        if layer not in self.layers:
+            self.misses += 1
+            return None
+        idx = code_to_index(code)
+        shard, row = divmod(idx, self.shard_size)
+        if shard not in self._complete.get(layer, ()):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._shard(layer, shard)[row]
+
+    def stats(self) -> dict:
+        return {
+            "root": self.root,
+            "seed": self.seed,
+            "dtype": self.dtype,
+            "layers": self.layers,
+            "hits": self.hits,
+            "misses": self.misses,
+            "complete_shards": {name: len(shards) for name, shards in self._complete.items()},
+            "open_shards": len(self._shards),
+        }
+
+
+def build_store(
+    service: WaveGANService,
+    root: str,
+    seed: int = 0,
+    layers: tuple = ("final",),
+    dtype: str = "int16",
+    shard_size: int = 4096,
+    batch_size: int = 32,
+    log_every: int = 1,
+) -> WaveformStore:
+    """Render every code into sharded .npy files; resumes shards already marked complete."""
+    if dtype not in _DTYPES:
+        raise ValueError(f"dtype must be one of {sorted(_DTYPES)}")
+    if N_CODES % shard_size:
+        raise ValueError("shard_size must divide 65536")
+    os.makedirs(root, exist_ok=True)
+    index_path = os.path.join(root, INDEX_NAME)
+
+    probe = service.generate_layer_batch(make_latent([0] * 16, seed), list(layers))
+    lengths = {name: int(arr.shape[1]) for name, arr in probe.items()}
+    index = {
+        "version": 1,
+        "seed": seed,
+        "dtype": dtype,
+        "shard_size": shard_size,
+        "n_codes": N_CODES,
+        "sample_rate": service.sample_rate,
+        "slice_len": service.slice_len,
+        # the hash of the file the service actually loaded (.safetensors sibling included), which attach_store compares
+        "fingerprint": service._fingerprint,
+        "layers": lengths,
+        "last_layer": service.layer_names()[-1],
+        "complete": {name: [] for name in layers},
+    }
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as fh:
+            old = json.load(fh)
+        same = all(old.get(k) == index[k] for k in ("seed", "dtype", "shard_size", "fingerprint", "layers"))
+        if same:
+            index["complete"] = old.get("complete", index["complete"])
+
+    def save_index():
+        tmp = index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(index, fh)
+        os.replace(tmp, index_path)
+
+    save_index()
+    n_shards = N_CODES // shard_size
+    for shard in range(n_shards):
+        todo = [name for name in layers if shard not in index["complete"][name]]
+        if not todo:
+            continue
+        t0 = time.perf_counter()
+        outs = {
+            name: np.lib.format.open_memmap(
+                os.path.join(root, f"{name}_{shard:03d}.npy"), mode="w+", dtype=_DTYPES[dtype], shape=(shard_size, lengths[name])
+            )
+            for name in todo
+        }
+        for start in range(0, shard_size, batch_size):
+            stop = min(start + batch_size, shard_size)
+            z = np.concatenate([make_latent(index_to_code(shard * shard_size + i), seed) for i in range(start, stop)])
+            rendered = service.generate_layer_batch(z, todo)
+            for name in todo:
+                outs[name][start:stop] = _quantize(rendered[name], dtype)
+        for name in todo:
+            outs[name].flush()
+            index["complete"][name].append(shard)
+        del outs
+        save_index()
+        if log_every and (shard + 1) % log_every == 0:
+            print(f"[store] shard {shard + 1}/{n_shards} ({', '.join(todo)}) in {time.perf_counter() - t0:.1f}s", flush=True)
+    return WaveformStore(root)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Pre-render the 2^16 categorical code space into a memory-mapped store.")
+    ap.add_argument("--ckpt", default=os.environ.get("GAN_CHECKPOINT", "checkpoint/epoch450_step166500_G.pt"))
+    ap.add_argument("--out", default=os.environ.get("GAN_STORE_DIR", "store"))
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--layers", nargs="+", default=["final"])
+    ap.add_argument("--dtype", choices=sorted(_DTYPES), default="int16")
+    ap.add_argument("--shard-size", type=int, default=4096)
+    ap.add_argument("--batch-size", type=int, default=32)
+    args = ap.parse_args()
+
+    service = WaveGANService(args.ckpt)
+    store = build_store(service, args.out, args.seed, tuple(args.layers), args.dtype, args.shard_size, args.batch_size)
+    print(json.dumps(store.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
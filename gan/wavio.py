@@ -0,0 +1,113 @@
+"""In-memory WAV encoding.
+
+encode_wav builds the file (float32 or int16 PCM) in one preallocated buffer
+and normalizes straight into it; iter_chunks slices it for chunked responses.
+/generate returns these bytes directly; only routes that hand out a persistent
+URL (/generate_file, the layer routes) write to static/, via write_bytes.
+"""
+import os
+import struct
+import threading
+from typing import Iterator
+
+import numpy as np
+
+__author__ = "Riccardo Petrini"
+
+_WAVE_FORMAT_PCM = 1
+_WAVE_FORMAT_IEEE_FLOAT = 3
+
+
+_UNKNOWN_SIZE = 0xFFFFFFFF
+
+
+def _header(n_samples: int, sample_rate: int, fmt: int, sampwidth: int, streaming: bool = False) -> bytes:
+    data_bytes = n_samples * sampwidth
+    if streaming:
+        # length not known up front; players treat 0xFFFFFFFF as "read until EOF"
+        n_samples = data_bytes = _UNKNOWN_SIZE
+    block_align = sampwidth  # mono
+    if fmt == _WAVE_FORMAT_IEEE_FLOAT:
+        # same layout scipy.io.wavfile.write emits for float32: 18-byte fmt + fact chunk
+        fmt_chunk = struct.pack("<4sIHHIIHHH", b"fmt ", 18, fmt, 1, sample_rate, sample_rate * block_align, block_align, sampwidth * 8, 0)
+        fmt_chunk += struct.pack("<4sII", b"fact", 4, n_samples)
+    else:
+        fmt_chunk = struct.pack("<4sIHHIIHH", b"fmt ", 16, fmt, 1, sample_rate, sample_rate * block_align, block_align, sampwidth * 8)
+    riff_size = _UNKNOWN_SIZE if streaming else 4 + len(fmt_chunk) + 8 + data_bytes
+    return struct.pack("<4sI4s", b"RIFF", riff_size, b"WAVE") + fmt_chunk + struct.pack("<4sI", b"data", data_bytes)
+
+
+def stream_header(sample_rate: int, dtype=np.float32) -> bytes:
+    """Header for a WAV body of unknown length (chunked/streamed responses)."""
+    if np.dtype(dtype) == np.int16:
+        return _header(0, sample_rate, _WAVE_FORMAT_PCM, 2, streaming=True)
+    return _header(0, sample_rate, _WAVE_FORMAT_IEEE_FLOAT, 4, streaming=True)
+
+
+def wav_size(n_samples: int, dtype=np.float32) -> int:
+    """Total encoded size for n mono samples (float -> 32-bit float, int16 -> PCM16)."""
+    if np.dtype(dtype) == np.int16:
+        return len(_header(n_samples, 1, _WAVE_FORMAT_PCM, 2)) + 2 * n_samples
+    return len(_header(n_samples, 1, _WAVE_FORMAT_IEEE_FLOAT, 4)) + 4 * n_samples
+
+
+def encode_wav_into(buf, arr: np.ndarray, sample_rate: int, normalize: bool = True) -> int:
+    """Encode into a caller-provided writable buffer (e.g. shared memory); returns bytes written.
+
+    float input is written as 32-bit IEEE float (peak-normalized straight into the
+    output buffer when normalize=True); int16 input is written as 16-bit PCM as-is.
+    """
+    x = np.asarray(arr).reshape(-1)
+    if x.dtype == np.int16:
+        head = _header(x.shape[0], sample_rate, _WAVE_FORMAT_PCM, 2)
+        total = len(head) + x.nbytes
+        buf[: len(head)] = head
+        np.frombuffer(buf, dtype="<i2", count=x.shape[0], offset=len(head))[:] = x
+        return total
+
+    head = _header(x.shape[0], sample_rate, _WAVE_FORMAT_IEEE_FLOAT, 4)
+    total = len(head) + x.shape[0] * 4
+    buf[: len(head)] = head
+    body = np.frombuffer(buf, dtype="<f4", count=x.shape[0], offset=len(head))
+    peak = float(np.max(np.abs(x))) if (normalize and x.size) else 0.0
+    if peak > 0:
+        np.divide(x, np.float32(peak), out=body, casting="same_kind")
+    else:
+        body[:] = x
+    return total
+
+
+def peak_normalize(arr: np.ndarray) -> np.ndarray:
+    """The float32 samples encode_wav(normalize=True) writes, as an array (for consumers that skip the WAV)."""
+    x = np.asarray(arr, dtype=np.float32).reshape(-1)
+    peak = float(np.max(np.abs(x))) if x.size else 0.0
+    return x / np.float32(peak) if peak > 0 else x.copy()
+
+
+def encode_wav(arr: np.ndarray, sample_rate: int, normalize: bool = True) -> bytearray:
+    """Encode a mono waveform as WAV bytes in a single preallocated buffer."""
+    x = np.asarray(arr).reshape(-1)
+    buf = bytearray(wav_size(x.shape[0], x.dtype))
+    encode_wav_into(buf, x, sample_rate, normalize=normalize)
+    return buf
+
+
+def iter_chunks(data, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Yield zero-copy memoryview slices of an encoded buffer for chunked responses."""
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield view[start : start + chunk_size]
+
+
+def write_bytes(data, path: str) -> str:
+    """Write to a temp file next to `path` and rename it into place, so readers never see a partial file."""
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return path
@@ -0,0 +1,355 @@
+"""Generator processes behind WaveGANService when GAN_PROCESSES > 0.
+
+Each worker holds its own service, is pinned to one core and gets
+cores // N intra-op threads, so stretching, normalization and WAV encoding run
+outside the server's GIL. Results are written into preallocated shared-memory
+slots and only (task id, slot, size) comes back over the worker's pipe. Store
+and cache lookups stay in the server process; only misses reach the pool.
+
+A worker that dies (crash, OOM kill, failed load) has its pending tasks failed
+and their slots freed, and is respawned; after MAX_FAILED_STARTS deaths before
+it ever reports ready it stays down. Waiting for a slot or a result is bounded
+by GAN_POOL_TIMEOUT_S, after which callers get PoolUnavailable (a 503). Pool
+children never start a pool of their own (is_pool_worker).
+"""
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+from typing import Optional
+
+import numpy as np
+
+from latents import make_latent
+from wavio import encode_wav_into, wav_size
+
+__author__ = "Riccardo Petrini"
+
+SAMPLE_RATE = 16000
+
+
+def _available_cores() -> list[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _worker_main(idx, ckpt_path, slice_len, backend, compile_dir, shm_name, slot_bytes, tasks, results, core, threads):
+    # pin + size the thread pools before torch is imported in this process
+    if core is not None and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, {core})
+        except OSError:
+            pass
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["MKL_NUM_THREADS"] = str(threads)
+
+    # spawn children share the parent's resource tracker, and the parent unlinks the segment in close()
+    shm = shared_memory.SharedMemory(name=shm_name)
+
+    if backend == "onnxruntime":
+        # onnxruntime sizes its own pool from threads; this path never imports torch
+        from onnx_backend import OnnxWaveGANService
+
+        service = OnnxWaveGANService(ckpt_path, slice_len=slice_len, threads=threads)
+    else:
+        import torch
+
+        torch.set_num_threads(threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass
+        from inference_cached import WaveGANService
+
+        service = WaveGANService(ckpt_path, slice_len=slice_len, backend=backend, compile_dir=compile_dir)
+    service._lazy_load()
+    results.send(("ready", idx, 0, None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, slot, kind, z, layer, stretched = task
+        view = shm.buf[slot * slot_bytes : (slot + 1) * slot_bytes]
+        try:
+            if layer == "final":
+                audio = service.generate_batch(z)[0]
+            else:
+                audio = service.generate_layer(z, layer, stretched=stretched)
+            if kind == "wav":
+                n = encode_wav_into(view, audio, service.sample_rate)
+            else:
+                out = np.frombuffer(view, dtype=np.float32, count=audio.shape[0])
+                out[:] = audio
+                del out
+                n = audio.nbytes
+            results.send((task_id, slot, n, None))
+        except Exception as exc:
+            results.send((task_id, slot, 0, f"{type(exc).__name__}: {exc}"))
+        finally:
+            view.release()
+    results.close()
+    shm.close()
+
+
+WORKER_PREFIX = "wavegan-worker-"
+# a worker that dies this many times in a row before reporting ready (bad checkpoint, OOM on load) stays down
+MAX_FAILED_STARTS = 3
+
+
+def is_pool_worker() -> bool:
+    """True inside a WorkerPool child, including while spawn re-imports the parent's __main__ there."""
+    return mp.current_process().name.startswith(WORKER_PREFIX)
+
+
+class PoolUnavailable(RuntimeError):
+    """No slot, no live worker or no result in time; the servers answer 503 with Retry-After."""
+
+    def __init__(self, message: str, retry_after: int = 5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class WorkerPool:
+    """N generator processes, each with its own task queue and result pipe, returning results through shared memory.
+
+    Each process holds its own WaveGANService, is pinned to a core and gets
+    cores // N torch intra-op threads, so pre/post-processing (stretching,
+    normalization, WAV encoding) runs in parallel outside the parent's GIL.
+    Outputs are written into preallocated shared-memory slots; only small
+    (task_id, slot, nbytes) tuples cross the result pipe.
+
+    The collector thread also watches the processes. When one dies (crash,
+    OOM kill, failed checkpoint load) its pipe hits EOF: its pending futures
+    fail, their slots go back to the free list and the worker is respawned,
+    up to MAX_FAILED_STARTS times in a row without reaching ready. Nothing is
+    shared between workers, so a process killed mid-write can't wedge the
+    others. Waiting for a slot or a result is bounded by `timeout_s`; both
+    raise PoolUnavailable.
+    """
+
+    def __init__(
+        self,
+        ckpt_path: str,
+        workers: int = 2,
+        slice_len: int = 65536,
+        slots_per_worker: int = 2,
+        pin: bool = True,
+        backend: str = "eager",
+        compile_dir: Optional[str] = None,
+        timeout_s: float = 30.0,
+    ):
+        self.ckpt_path = ckpt_path
+        self.slice_len = slice_len
+        self.sample_rate = SAMPLE_RATE
+        self.workers = max(1, int(workers))
+        self.backend = backend
+        self.compile_dir = compile_dir
+        self.timeout_s = timeout_s
+        self._cores = _available_cores()
+        self._pin = pin
+        self._threads = max(1, len(self._cores) // self.workers)
+
+        self.slot_bytes = wav_size(slice_len)
+        n_slots = self.workers * max(1, int(slots_per_worker))
+        self._shm = shared_memory.SharedMemory(create=True, size=self.slot_bytes * n_slots)
+        self._free: "queue.Queue[int]" = queue.Queue()
+        for slot in range(n_slots):
+            self._free.put(slot)
+
+        self._ctx = mp.get_context("spawn")
+        # task_id -> (future, kind, worker, slot)
+        self._futures: dict[int, tuple] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._worker_ready = [False] * self.workers
+        self._failed_starts = [0] * self.workers
+        self._pending = [0] * self.workers
+        self.restarts = 0
+        self._closing = False
+
+        self._procs = [None] * self.workers
+        self._tasks = [None] * self.workers
+        self._conns = [None] * self.workers
+        for i in range(self.workers):
+            self._spawn(i)
+
+        self._collector = threading.Thread(target=self._collect, name="wavegan-pool-results", daemon=True)
+        self._collector.start()
+
+    def _spawn(self, idx: int):
+        core = self._cores[idx % len(self._cores)] if self._pin else None
+        # fresh channels per process: tasks left in a dead worker's queue are failed, never replayed
+        tasks = self._ctx.Queue()
+        reader, writer = self._ctx.Pipe(duplex=False)
+        proc = self._ctx.Process(
+            target=_worker_main,
+            args=(idx, self.ckpt_path, self.slice_len, self.backend, self.compile_dir, self._shm.name, self.slot_bytes, tasks, writer, core, self._threads),
+            name=f"{WORKER_PREFIX}{idx}",
+            daemon=True,
+        )
+        proc.start()
+        # only the child may hold the write end, so its exit reads as EOF here
+        writer.close()
+        with self._lock:
+            self._tasks[idx] = tasks
+            self._conns[idx] = reader
+            self._procs[idx] = proc
+
+    def _worker_died(self, idx: int):
+        proc = self._procs[idx]
+        proc.join(timeout=1)
+        self._conns[idx].close()
+        # nobody reads the old queue anymore; don't let its feeder thread block interpreter exit
+        self._tasks[idx].close()
+        self._tasks[idx].cancel_join_thread()
+        with self._lock:
+            lost = [(tid, entry) for tid, entry in self._futures.items() if entry[2] == idx]
+            for tid, _ in lost:
+                del self._futures[tid]
+            self._pending[idx] = 0
+            was_ready = self._worker_ready[idx]
+            self._worker_ready[idx] = False
+            self._ready.clear()
+            self._conns[idx] = None
+            # out of submit()'s rotation until the replacement is spawned
+            self._procs[idx] = None
+        for _, (fut, _, _, slot) in lost:
+            fut.set_exception(PoolUnavailable(f"worker {idx} died (exit code {proc.exitcode})"))
+            self._free.put(slot)
+        if self._closing:
+            return
+        self._failed_starts[idx] = 0 if was_ready else self._failed_starts[idx] + 1
+        if self._failed_starts[idx] >= MAX_FAILED_STARTS:
+            print(f"[pool] worker {idx} failed to start {MAX_FAILED_STARTS} times (exit code {proc.exitcode}); leaving it down", flush=True)
+            with self._lock:
+                self._mark_ready()
+            return
+        print(f"[pool] worker {idx} exited with code {proc.exitcode}; {len(lost)} task(s) failed, respawning", flush=True)
+        self.restarts += 1
+        self._spawn(idx)
+
+    def _mark_ready(self):
+        # caller holds _lock
+        if all(self._worker_ready[i] or self._procs[i] is None for i in range(self.workers)):
+            self._ready.set()
+
+    def _collect(self):
+        while not self._closing:
+            with self._lock:
+                conns = {conn: idx for idx, conn in enumerate(self._conns) if conn is not None}
+            if not conns:
+                break
+            for conn in wait(list(conns), timeout=0.5):
+                idx = conns[conn]
+                try:
+                    msg = conn.recv()
+                except (EOFError, OSError):
+                    self._worker_died(idx)
+                    continue
+                self._handle(idx, msg)
+
+    def _handle(self, idx: int, msg: tuple):
+        task_id, slot, n, err = msg
+        if task_id == "ready":
+            with self._lock:
+                self._worker_ready[idx] = True
+                self._failed_starts[idx] = 0
+                self._mark_ready()
+            return
+        with self._lock:
+            entry = self._futures.pop(task_id, None)
+            if entry is not None:
+                self._pending[idx] -= 1
+        if entry is None:
+            return
+        fut, kind, _, _ = entry
+        try:
+            if err is not None:
+                fut.set_exception(RuntimeError(err))
+            else:
+                start = slot * self.slot_bytes
+                # one memcpy out of the slot so it can be reused right away
+                data = bytes(self._shm.buf[start : start + n])
+                fut.set_result(data if kind == "wav" else np.frombuffer(data, dtype=np.float32))
+        finally:
+            self._free.put(slot)
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def submit(self, z: np.ndarray, kind: str = "wav", layer: str = "final", stretched: bool = True) -> Future:
+        """Queue one (1, 100) latent; resolves to WAV bytes (kind="wav") or float32 samples (kind="pcm")."""
+        try:
+            slot = self._free.get(timeout=self.timeout_s)
+        except queue.Empty:
+            raise PoolUnavailable(f"no free worker slot within {self.timeout_s:g}s")
+        task_id = next(self._ids)
+        fut: Future = Future()
+        with self._lock:
+            alive = [i for i, p in enumerate(self._procs) if p is not None]
+            if not alive:
+                self._free.put(slot)
+                raise PoolUnavailable("no live generator workers", retry_after=30)
+            # least pending work first; a worker still loading just queues the task
+            idx = min(alive, key=lambda i: self._pending[i])
+            self._pending[idx] += 1
+            self._futures[task_id] = (fut, kind, idx, slot)
+            tasks = self._tasks[idx]
+        tasks.put((task_id, slot, kind, np.ascontiguousarray(z, dtype=np.float32), layer, stretched))
+        return fut
+
+    def run(self, z: np.ndarray, kind: str = "wav", layer: str = "final", stretched: bool = True):
+        """submit() and wait at most timeout_s for the result."""
+        fut = self.submit(z, kind=kind, layer=layer, stretched=stretched)
+        try:
+            return fut.result(timeout=self.timeout_s)
+        except FutureTimeout:
+            raise PoolUnavailable(f"no result from the worker pool within {self.timeout_s:g}s")
+
+    def generate(self, z: np.ndarray) -> np.ndarray:
+        return self.run(z, kind="pcm")
+
+    def synthesize_wav(self, code: list[int], seed: Optional[int] = None):
+        z = make_latent(code, seed)
+        return self.run(z, kind="wav"), z[0]
+
+    def synthesize_layer_wav(self, code: list[int], layer: str, seed: Optional[int] = None, stretched: bool = True):
+        z = make_latent(code, seed)
+        return self.run(z, kind="wav", layer=layer, stretched=stretched), z[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._futures)
+            ready = sum(self._worker_ready)
+        return {
+            "workers": self.workers,
+            "alive": sum(p is not None and p.is_alive() for p in self._procs),
+            "ready": self._ready.is_set(),
+            "workers_ready": ready,
+            "restarts": self.restarts,
+            "pending": pending,
+            "free_slots": self._free.qsize(),
+            "slot_bytes": self.slot_bytes,
+            "timeout_s": self.timeout_s,
+        }
+
+    def close(self):
+        self._closing = True
+        procs = [(p, q) for p, q in zip(self._procs, self._tasks) if p is not None]
+        for _, tasks in procs:
+            tasks.put(None)
+        for proc, _ in procs:
+            proc.join(timeout=5)
+        self._collector.join(timeout=5)
+        for conn in self._conns:
+            if conn is not None:
+                conn.close()
+        self._shm.close()
+        self._shm.unlink()
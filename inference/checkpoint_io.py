@@ -0,0 +1,192 @@
+# Autore: Riccardo Petrini
+import argparse
+import json
+import os
+import struct
+
+import numpy as np
+
+# safetensors dtype tags <-> numpy
+_DTYPES = {
+    'F64': np.float64,
+    'F32': np.float32,
+    'F16': np.float16,
+    'I64': np.int64,
+    'I32': np.int32,
+    'I16': np.int16,
+    'I8': np.int8,
+    'U8': np.uint8,
+    'BOOL': np.bool_,
+}
+_TAGS = {np.dtype(v): k for k, v in _DTYPES.items()}
+SUFFIX = '.safetensors'
+
+
+def save_safetensors(state: dict, path: str, fp16: bool = False, metadata: dict = None) -> str:
+    """Write {name: array/tensor} in the safetensors layout (8-byte header length, JSON header, raw data).
+
+    Written with numpy only, so the file also opens with the `safetensors`
+    package. fp16=True stores floating tensors as float16 (half the file and
+    page cache); integer buffers such as num_batches_tracked keep their dtype.
+    Tensors are laid out widest dtype first and the header is padded to 8
+    bytes, so every tensor starts aligned and maps as a view.
+    """
+    arrays = {}
+    for name, value in state.items():
+        arr = value.detach().cpu().numpy() if hasattr(value, 'detach') else np.asarray(value)
+        if fp16 and arr.dtype.kind == 'f':
+            arr = arr.astype(np.float16)
+        if arr.dtype not in _TAGS:
+            raise ValueError(f"unsupported dtype {arr.dtype} for '{name}'")
+        arrays[name] = np.ascontiguousarray(arr)
+
+    order = sorted(arrays, key=lambda k: (-arrays[k].dtype.itemsize, k))
+    header = {}
+    offset = 0
+    for name in order:
+        arr = arrays[name]
+        header[name] = {'dtype': _TAGS[arr.dtype], 'shape': list(arr.shape), 'data_offsets': [offset, offset + arr.nbytes]}
+        offset += arr.nbytes
+    if metadata:
+        header['__metadata__'] = {str(k): str(v) for k, v in metadata.items()}
+    blob = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    blob += b' ' * (-len(blob) % 8)
+
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as fh:
+        fh.write(struct.pack('<Q', len(blob)))
+        fh.write(blob)
+        for name in order:
+            fh.write(arrays[name].tobytes())
+    os.replace(tmp, path)
+    return path
+
+
+def read_header(path: str):
+    """(tensor header, metadata, byte offset of the data section)."""
+    with open(path, 'rb') as fh:
+        (n,) = struct.unpack('<Q', fh.read(8))
+        header = json.loads(fh.read(n))
+    return header, header.pop('__metadata__', {}), 8 + n
+
+
+def load_arrays(path: str) -> dict:
+    """{name: ndarray} viewing one copy-on-write mmap of the file; nothing is read until touched.
+
+    The mapping is MAP_PRIVATE over the page cache, so every process that maps
+    the same file shares the physical pages until it writes to them, which a
+    generator in eval mode never does.
+    """
+    header, _, start = read_header(path)
+    size = os.path.getsize(path) - start
+    if size == 0:
+        return {name: np.zeros(info['shape'], _DTYPES[info['dtype']]) for name, info in header.items()}
+    data = np.memmap(path, dtype=np.uint8, mode='c', offset=start, shape=(size,))
+    out = {}
+    for name, info in header.items():
+        begin, end = info['data_offsets']
+        out[name] = data[begin:end].view(_DTYPES[info['dtype']]).reshape(info['shape'])
+    return out
+
+
+def load_state_dict(path: str, device='cpu') -> dict:
+    """torch state dict over load_arrays(): zero-copy float32 on CPU, upcast (one copy) for fp16 files."""
+    import torch
+
+    state = {}
+    for name, arr in load_arrays(path).items():
+        t = torch.from_numpy(arr)
+        if t.dtype == torch.float16:
+            t = t.float()
+        state[name] = t.to(device)
+    return state
+
+
+def resolve(ckpt_path: str) -> str:
+    """The file to load for ckpt_path: a .safetensors sibling of a .pt is preferred unless it's older."""
+    if os.path.splitext(ckpt_path)[1] not in ('.pt', '.pth'):
+        return ckpt_path
+    sibling = os.path.splitext(ckpt_path)[0] + SUFFIX
+    if os.path.exists(sibling) and (not os.path.exists(ckpt_path) or os.path.getmtime(sibling) >= os.path.getmtime(ckpt_path)):
+        return sibling
+    return ckpt_path
+
+
+def load_into(G, ckpt_path: str, device) -> str:
+    """Load a checkpoint into G in place; returns the file actually read.
+
+    For safetensors on CPU the parameters are assigned as the mmap-backed
+    tensors themselves (load_state_dict(assign=True)), so no weight bytes are
+    copied and worker processes share them. On CUDA or with torch < 2.1 the
+    values are copied into G's own tensors, but still without the pickle
+    round trip. .pt files go through torch.load as before.
+    """
+    import torch
+
+    path = resolve(ckpt_path)
+    if not path.endswith(SUFFIX):
+        G.load_state_dict(torch.load(path, map_location=device))
+        return path
+    state = load_state_dict(path, device)
+    try:
+        G.load_state_dict(state, assign=torch.device(device).type == 'cpu')
+    except TypeError:
+        G.load_state_dict(state)
+    return path
+
+
+def load_generator(generator_cls, ckpt_path: str, device, **kwargs):
+    """(eval-mode generator, file read). With safetensors on CPU the module is built on the meta device.
+
+    Building on meta skips allocating and randomly initializing weights that
+    load_into would replace anyway. If the checkpoint doesn't cover every
+    parameter and buffer, the generator is rebuilt normally.
+    """
+    import torch
+
+    device = torch.device(device)
+    path = resolve(ckpt_path)
+    if path.endswith(SUFFIX) and device.type == 'cpu':
+        with torch.device('meta'):
+            G = generator_cls(**kwargs)
+        try:
+            G.load_state_dict(load_state_dict(path, device), assign=True)
+        except TypeError:  # torch < 2.1: no assign
+            pass
+        else:
+            if not any(t.is_meta for t in list(G.parameters()) + list(G.buffers())):
+                return G.eval(), path
+    G = generator_cls(**kwargs).to(device).eval()
+    return G, load_into(G, ckpt_path, device)
+
+
+def convert_checkpoint(ckpt_path: str, out_path: str = None, fp16: bool = False) -> str:
+    """Torch _G.pt state dict -> .safetensors next to it (or out_path)."""
+    import torch
+
+    state = torch.load(ckpt_path, map_location='cpu')
+    meta = {
+        'source': os.path.basename(ckpt_path),
+        'slice_len': 65536 if 'upconv5.conv.weight' in state else 16384,
+        'fp16': int(fp16),
+    }
+    out_path = out_path or os.path.splitext(ckpt_path)[0] + SUFFIX
+    return save_safetensors(state, out_path, fp16=fp16, metadata=meta)
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Convert generator checkpoints to memory-mappable safetensors.')
+    ap.add_argument('ckpt', nargs='+')
+    ap.add_argument('--fp16', action='store_true', help='store float tensors as float16 (upcast to float32 on load)')
+    ap.add_argument('--out', default=None, help='output path (single checkpoint only)')
+    args = ap.parse_args()
+    if args.out and len(args.ckpt) > 1:
+        ap.error('--out needs exactly one checkpoint')
+
+    for ckpt in args.ckpt:
+        out = convert_checkpoint(ckpt, args.out, fp16=args.fp16)
+        print(f'{ckpt} ({os.path.getsize(ckpt) / 1e6:.1f} MB) -> {out} ({os.path.getsize(out) / 1e6:.1f} MB)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# Autore: Riccardo Petrini
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import torch
+
+from checkpoint_io import load_generator
+
+_LOCK = threading.Lock()
+_ENTRIES = {}
+
+
+def _key(generator_cls, ckpt_path: str, slice_len: int, device: torch.device, kwargs: dict):
+    return (
+        generator_cls.__module__,
+        int(slice_len),
+        os.path.abspath(ckpt_path),
+        str(device),
+        tuple(sorted(kwargs.items())),
+    )
+
+
+def _module_bytes(G: torch.nn.Module) -> int:
+    total = 0
+    for t in list(G.parameters()) + list(G.buffers()):
+        total += t.numel() * t.element_size()
+    return total
+
+
+def get_generator(generator_cls, ckpt_path: str, slice_len: int, device: torch.device, **kwargs):
+    """Return a cached, eval-mode generator for (variant module, slice_len, checkpoint, device).
+
+    Extra kwargs (e.g. seed for the deterministic variant) are forwarded to the
+    constructor and are part of the cache key.
+    """
+    key = _key(generator_cls, ckpt_path, slice_len, device, kwargs)
+    entry = _ENTRIES.get(key)
+    if entry is not None:
+        return entry["G"]
+
+    with _LOCK:
+        entry = _ENTRIES.get(key)
+        if entry is None:
+            t0 = time.perf_counter()
+            G, path = load_generator(generator_cls, ckpt_path, device, slice_len=slice_len, **kwargs)
+            entry = {
+                "G": G,
+                "path": path,
+                "lock": threading.RLock(),
+                "bytes": _module_bytes(G),
+                "load_s": time.perf_counter() - t0,
+            }
+            _ENTRIES[key] = entry
+    return entry["G"]
+
+
+def prewarm(generator_cls, ckpt_path: str, slice_len: int, device: torch.device, batch_size: int = 1, **kwargs):
+    """Load the generator and run one dummy forward so the first request skips allocator warm-up."""
+    G = get_generator(generator_cls, ckpt_path, slice_len, device, **kwargs)
+    z = torch.zeros((batch_size, G.z_project.in_features), dtype=torch.float32, device=device)
+    with torch.no_grad(), generator_lock(G):
+        G(z)
+    return G
+
+
+@contextmanager
+def generator_lock(G: torch.nn.Module):
+    """Serialize hook registration + forward on a shared generator.
+
+    Cached generators are shared across callers, so forward hooks registered by
+    one request would otherwise capture another request's activations.
+    """
+    lock = None
+    for entry in _ENTRIES.values():
+        if entry["G"] is G:
+            lock = entry["lock"]
+            break
+    if lock is None:
+        yield
+        return
+    with lock:
+        yield
+
+
+def memory_footprint() -> dict:
+    """Parameter + buffer bytes per cached generator, plus the total."""
+    with _LOCK:
+        items = list(_ENTRIES.items())
+    entries = []
+    for (module, slice_len, ckpt, device, extra), entry in items:
+        entries.append(
+            {
+                "variant": module,
+                "slice_len": slice_len,
+                "ckpt_path": ckpt,
+                "loaded_from": entry["path"],
+                "device": device,
+                "options": dict(extra),
+                "bytes": entry["bytes"],
+                "load_s": entry["load_s"],
+            }
+        )
+    return {"total_bytes": sum(e["bytes"] for e in entries), "generators": entries}
+
+
+def clear():
+    with _LOCK:
+        _ENTRIES.clear()
@@ -3,14 +3,14 @@ import numpy as np
 import torch
 import scipy.io.wavfile
 from infowavegan import WaveGANGenerator
+from generator_registry import get_generator, generator_lock
 
 SAMPLE_RATE = 16000
 SLICE_LEN = 65536  # your checkpoint is for 65536
 
 def _load_generator(ckpt_path: str, slice_len: int = SLICE_LEN):
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    G = WaveGANGenerator(slice_len=slice_len).to(device).eval()
-    G.load_state_dict(torch.load(ckpt_path, map_location=device))
+    G = get_generator(WaveGANGenerator, ckpt_path, slice_len, device)
     return G, device
 
 def _write_wav(arr: np.ndarray, path: str, normalize: bool = True):
@@ -33,7 +33,8 @@ def generate_final(z: np.ndarray, ckpt_path: str) -> np.ndarray:
     """Return final mono waveform (np.float32) from one forward."""
     G, device = _load_generator(ckpt_path, slice_len=SLICE_LEN)
     z_t = torch.from_numpy(z).to(torch.float32).to(device)
-    y = G(z_t).detach().cpu().numpy()[0, 0, :]
+    with generator_lock(G):
+        y = G(z_t).detach().cpu().numpy()[0, 0, :]
     return y.astype(np.float32)
 
 def generate_evolution_pairs(z: np.ndarray, ckpt_path: str, output_dir: str):
@@ -54,21 +55,22 @@ def generate_evolution_pairs(z: np.ndarray, ckpt_path: str, output_dir: str):
         return _fn
 
     # register hooks on the actual modules used in forward()
-    hs = []
-    try:
-        hs += [G.z_batchnorm.register_forward_hook(hook("z_project"))]
-        hs += [G.upconv0.register_forward_hook(hook("upconv0"))]
-        hs += [G.upconv1.register_forward_hook(hook("upconv1"))]
-        hs += [G.upconv2.register_forward_hook(hook("upconv2"))]
-        hs += [G.upconv3.register_forward_hook(hook("upconv3"))]
-        hs += [G.upconv4.register_forward_hook(hook("upconv4"))]
-        if hasattr(G, "upconv5"):
-            hs += [G.upconv5.register_forward_hook(hook("upconv5"))]
-
-        final_t = G(z_t).detach().cpu()  # (1,1,65536)
-    finally:
-        for h in hs:
-            h.remove()
+    with generator_lock(G):
+        hs = []
+        try:
+            hs += [G.z_batchnorm.register_forward_hook(hook("z_project"))]
+            hs += [G.upconv0.register_forward_hook(hook("upconv0"))]
+            hs += [G.upconv1.register_forward_hook(hook("upconv1"))]
+            hs += [G.upconv2.register_forward_hook(hook("upconv2"))]
+            hs += [G.upconv3.register_forward_hook(hook("upconv3"))]
+            hs += [G.upconv4.register_forward_hook(hook("upconv4"))]
+            if hasattr(G, "upconv5"):
+                hs += [G.upconv5.register_forward_hook(hook("upconv5"))]
+
+            final_t = G(z_t).detach().cpu()  # (1,1,65536)
+        finally:
+            for h in hs:
+                h.remove()
 
     final = final_t.numpy()[0, 0, :].astype(np.float32)
     final_len = final.shape[0]
@@ -4,6 +4,8 @@ import numpy as np
 import torch
 import scipy.io.wavfile
 from infowavegan import WaveGANGenerator
+from generator_registry import get_generator, generator_lock
+from layer_postprocess import postprocess_layers
 
 SAMPLE_RATE = 16000
 SLICE_LEN = 65536
@@ -11,8 +13,7 @@ SLICE_LEN = 65536
 
 def _load_generator(ckpt_path: str, slice_len: int = SLICE_LEN):
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    G = WaveGANGenerator(slice_len=slice_len).to(device).eval()
-    G.load_state_dict(torch.load(ckpt_path, map_location=device))
+    G = get_generator(WaveGANGenerator, ckpt_path, slice_len, device)
     return G, device
 
 
@@ -26,17 +27,9 @@ def _write_wav(arr: np.ndarray, path: str, normalize: bool = True):
     scipy.io.wavfile.write(path, SAMPLE_RATE, x)
 
 
-def _resample_to_len(x: np.ndarray, target_len: int) -> np.ndarray:
-    if x.shape[0] == target_len:
-        return x.astype(np.float32)
-    t_src = np.linspace(0.0, 1.0, num=x.shape[0], endpoint=False)
-    t_dst = np.linspace(0.0, 1.0, num=target_len, endpoint=False)
-    return np.interp(t_dst, t_src, x).astype(np.float32)
-
-
 def generate_final(z: np.ndarray, ckpt_path: str) -> np.ndarray:
     G, device = _load_generator(ckpt_path, slice_len=SLICE_LEN)
-    with torch.no_grad():
+    with torch.no_grad(), generator_lock(G):
         z_t = torch.from_numpy(z).to(torch.float32).to(device)
         y = G(z_t).detach().cpu().numpy()[0, 0, :]
     return y.astype(np.float32)
@@ -54,22 +47,23 @@ def generate_evolution_pairs(z: np.ndarray, ckpt_path: str, output_dir: str):
             captured[name] = out.detach()
         return _fn
 
-    hs = []
-    try:
-        hs += [G.z_batchnorm.register_forward_hook(hook('z_project'))]
-        hs += [G.upconv0.register_forward_hook(hook('upconv0'))]
-        hs += [G.upconv1.register_forward_hook(hook('upconv1'))]
-        hs += [G.upconv2.register_forward_hook(hook('upconv2'))]
-        hs += [G.upconv3.register_forward_hook(hook('upconv3'))]
-        hs += [G.upconv4.register_forward_hook(hook('upconv4'))]
-        if hasattr(G, 'upconv5'):
-            hs += [G.upconv5.register_forward_hook(hook('upconv5'))]
-
-        with torch.no_grad():
-            final_t = G(z_t).detach().cpu()
-    finally:
-        for h in hs:
-            h.remove()
+    with generator_lock(G):
+        hs = []
+        try:
+            hs += [G.z_batchnorm.register_forward_hook(hook('z_project'))]
+            hs += [G.upconv0.register_forward_hook(hook('upconv0'))]
+            hs += [G.upconv1.register_forward_hook(hook('upconv1'))]
+            hs += [G.upconv2.register_forward_hook(hook('upconv2'))]
+            hs += [G.upconv3.register_forward_hook(hook('upconv3'))]
+            hs += [G.upconv4.register_forward_hook(hook('upconv4'))]
+            if hasattr(G, 'upconv5'):
+                hs += [G.upconv5.register_forward_hook(hook('upconv5'))]
+
+            with torch.no_grad():
+                final_t = G(z_t).detach().cpu()
+        finally:
+            for h in hs:
+                h.remove()
 
     final = final_t.numpy()[0, 0, :].astype(np.float32)
     final_len = final.shape[0]
@@ -78,20 +72,23 @@ def generate_evolution_pairs(z: np.ndarray, ckpt_path: str, output_dir: str):
     if 'upconv5' in captured:
         order.append('upconv5')
 
+    # stretch + normalize all layers in one batch on the capture device, one host copy
+    processed = postprocess_layers({name: captured[name][0, 0, :] for name in order}, final_len)
+
     results = []
     for name in order:
-        t = captured[name][0, 0, :].cpu().numpy().astype(np.float32)
+        raw, stretched = processed[name]
         raw_path = os.path.join(output_dir, f"{name}_raw.wav")
         stretched_path = os.path.join(output_dir, f"{name}_stretched.wav")
 
-        _write_wav(t, raw_path, normalize=True)
-        _write_wav(_resample_to_len(t, final_len), stretched_path, normalize=True)
+        _write_wav(raw, raw_path, normalize=False)
+        _write_wav(stretched, stretched_path, normalize=False)
 
         results.append({
             'name': name,
             'raw_path': raw_path,
             'stretched_path': stretched_path,
-            'raw_len': int(t.shape[0]),
+            'raw_len': int(raw.shape[0]),
             'stretched_len': int(final_len),
         })
 
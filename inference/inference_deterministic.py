@@ -3,7 +3,8 @@ import os
 import numpy as np
 import torch
 import scipy.io.wavfile
-from infowavegan_deterministic import WaveGANGenerator
+from infowavegan_deterministic import WaveGANGenerator, _set_deterministic
+from generator_registry import get_generator, generator_lock
 
 SAMPLE_RATE = 16000
 SLICE_LEN = 65536
@@ -21,14 +22,14 @@ def _write_wav(arr: np.ndarray, path: str, normalize: bool = True):
 
 def _load_generator(ckpt_path: str, slice_len: int = SLICE_LEN, seed: int = 42):
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    G = WaveGANGenerator(slice_len=slice_len, seed=seed).to(device).eval()
-    G.load_state_dict(torch.load(ckpt_path, map_location=device))
+    _set_deterministic(seed)
+    G = get_generator(WaveGANGenerator, ckpt_path, slice_len, device, seed=seed)
     return G, device
 
 
 def generate_final(z: np.ndarray, ckpt_path: str, seed: int = 42) -> np.ndarray:
     G, device = _load_generator(ckpt_path, slice_len=SLICE_LEN, seed=seed)
-    with torch.no_grad():
+    with torch.no_grad(), generator_lock(G):
         z_t = torch.from_numpy(z).to(torch.float32).to(device)
         y = G(z_t).detach().cpu().numpy()[0, 0, :]
     return y.astype(np.float32)
@@ -45,22 +46,23 @@ def generate_and_dump(z: np.ndarray, ckpt_path: str, output_dir: str, seed: int
             captured[name] = out.detach().cpu()
         return _fn
 
-    hs = []
-    try:
-        hs += [G.z_batchnorm.register_forward_hook(hook('z_project'))]
-        hs += [G.upconv0.register_forward_hook(hook('upconv0'))]
-        hs += [G.upconv1.register_forward_hook(hook('upconv1'))]
-        hs += [G.upconv2.register_forward_hook(hook('upconv2'))]
-        hs += [G.upconv3.register_forward_hook(hook('upconv3'))]
-        hs += [G.upconv4.register_forward_hook(hook('upconv4'))]
-        if hasattr(G, 'upconv5'):
-            hs += [G.upconv5.register_forward_hook(hook('upconv5'))]
-
-        with torch.no_grad():
-            final_t = G(z_t).detach().cpu()
-    finally:
-        for h in hs:
-            h.remove()
+    with generator_lock(G):
+        hs = []
+        try:
+            hs += [G.z_batchnorm.register_forward_hook(hook('z_project'))]
+            hs += [G.upconv0.register_forward_hook(hook('upconv0'))]
+            hs += [G.upconv1.register_forward_hook(hook('upconv1'))]
+            hs += [G.upconv2.register_forward_hook(hook('upconv2'))]
+            hs += [G.upconv3.register_forward_hook(hook('upconv3'))]
+            hs += [G.upconv4.register_forward_hook(hook('upconv4'))]
+            if hasattr(G, 'upconv5'):
+                hs += [G.upconv5.register_forward_hook(hook('upconv5'))]
+
+            with torch.no_grad():
+                final_t = G(z_t).detach().cpu()
+        finally:
+            for h in hs:
+                h.remove()
 
     final = final_t.numpy()[0, 0, :].astype(np.float32)
     final_len = final.shape[0]
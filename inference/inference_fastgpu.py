@@ -4,6 +4,7 @@ import numpy as np
 import torch
 import scipy.io.wavfile
 from infowavegan_fastgpu import WaveGANGenerator
+from generator_registry import get_generator, generator_lock
 
 SAMPLE_RATE = 16000
 SLICE_LEN = 65536
@@ -11,9 +12,7 @@ SLICE_LEN = 65536
 
 def _load_generator(ckpt_path: str, slice_len: int = SLICE_LEN):
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    G = WaveGANGenerator(slice_len=slice_len).to(device).eval()
-    state = torch.load(ckpt_path, map_location=device)
-    G.load_state_dict(state)
+    G = get_generator(WaveGANGenerator, ckpt_path, slice_len, device)
     return G, device
 
 
@@ -30,7 +29,7 @@ def _write_wav(arr: np.ndarray, path: str, normalize: bool = True):
 def generate_final(z: np.ndarray, ckpt_path: str) -> np.ndarray:
     G, device = _load_generator(ckpt_path, slice_len=SLICE_LEN)
     z_t = torch.from_numpy(z).to(torch.float16 if device.type == 'cuda' else torch.float32).to(device)
-    with torch.no_grad():
+    with torch.no_grad(), generator_lock(G):
         with torch.cuda.amp.autocast(enabled=device.type == 'cuda'):
             y = G(z_t).detach().cpu().numpy()[0, 0, :]
     return y.astype(np.float32)
@@ -46,23 +45,24 @@ def generate_layers(z: np.ndarray, ckpt_path: str):
             captured[name] = out.detach().float()
         return _fn
 
-    hs = []
-    try:
-        hs += [G.z_batchnorm.register_forward_hook(hook('z_project'))]
-        hs += [G.upconv0.register_forward_hook(hook('upconv0'))]
-        hs += [G.upconv1.register_forward_hook(hook('upconv1'))]
-        hs += [G.upconv2.register_forward_hook(hook('upconv2'))]
-        hs += [G.upconv3.register_forward_hook(hook('upconv3'))]
-        hs += [G.upconv4.register_forward_hook(hook('upconv4'))]
-        if hasattr(G, 'upconv5'):
-            hs += [G.upconv5.register_forward_hook(hook('upconv5'))]
-
-        with torch.no_grad():
-            with torch.cuda.amp.autocast(enabled=device.type == 'cuda'):
-                final_t = G(z_t).detach().cpu()
-    finally:
-        for h in hs:
-            h.remove()
+    with generator_lock(G):
+        hs = []
+        try:
+            hs += [G.z_batchnorm.register_forward_hook(hook('z_project'))]
+            hs += [G.upconv0.register_forward_hook(hook('upconv0'))]
+            hs += [G.upconv1.register_forward_hook(hook('upconv1'))]
+            hs += [G.upconv2.register_forward_hook(hook('upconv2'))]
+            hs += [G.upconv3.register_forward_hook(hook('upconv3'))]
+            hs += [G.upconv4.register_forward_hook(hook('upconv4'))]
+            if hasattr(G, 'upconv5'):
+                hs += [G.upconv5.register_forward_hook(hook('upconv5'))]
+
+            with torch.no_grad():
+                with torch.cuda.amp.autocast(enabled=device.type == 'cuda'):
+                    final_t = G(z_t).detach().cpu()
+        finally:
+            for h in hs:
+                h.remove()
 
     final = final_t.numpy()[0, 0, :].astype(np.float32)
     captured['final'] = final_t
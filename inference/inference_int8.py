@@ -0,0 +1,165 @@
+# Autore: Riccardo Petrini
+import argparse
+import io
+import json
+import os
+import time
+import numpy as np
+import torch
+import scipy.io.wavfile
+from infowavegan import WaveGANGenerator as Fp32Generator
+from infowavegan_int8 import WaveGANGenerator, calibration_latents
+from generator_registry import get_generator, generator_lock
+
+SAMPLE_RATE = 16000
+SLICE_LEN = 65536
+
+
+def _load_generator(ckpt_path: str, slice_len: int = SLICE_LEN, mixed: bool = False):
+    device = torch.device('cpu')
+    G = get_generator(WaveGANGenerator, ckpt_path, slice_len, device, mixed=mixed)
+    return G, device
+
+
+def _write_wav(arr: np.ndarray, path: str, normalize: bool = True):
+    x = arr.astype(np.float32)
+    if normalize:
+        m = np.max(np.abs(x))
+        if m > 0:
+            x = x / m
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    scipy.io.wavfile.write(path, SAMPLE_RATE, x)
+
+
+def generate_final(z: np.ndarray, ckpt_path: str, mixed: bool = False) -> np.ndarray:
+    G, device = _load_generator(ckpt_path, slice_len=SLICE_LEN, mixed=mixed)
+    with torch.no_grad(), generator_lock(G):
+        z_t = torch.from_numpy(z).to(torch.float32).to(device)
+        y = G(z_t).detach().cpu().numpy()[0, 0, :]
+    return y.astype(np.float32)
+
+
+def generate_layers(z: np.ndarray, ckpt_path: str, output_dir: str, mixed: bool = False):
+    os.makedirs(output_dir, exist_ok=True)
+    G, device = _load_generator(ckpt_path, slice_len=SLICE_LEN, mixed=mixed)
+    z_t = torch.from_numpy(z).to(torch.float32).to(device)
+
+    with torch.no_grad(), generator_lock(G):
+        captured = G.forward_layers(z_t, G.layer_names())
+    final = captured[G.layer_names()[-1]].cpu().numpy()[0, 0, :].astype(np.float32)
+    final_len = final.shape[0]
+
+    for name in G.layer_names():
+        t = captured[name][0, 0, :].cpu().numpy().astype(np.float32)
+        _write_wav(t, os.path.join(output_dir, f"{name}_raw.wav"))
+        # full-length layers get a _stretched copy too, so every layer has the same pair of files
+        if t.shape[0] != final_len:
+            t = np.interp(np.linspace(0, 1, final_len, endpoint=False), np.linspace(0, 1, t.shape[0], endpoint=False), t)
+        _write_wav(t.astype(np.float32), os.path.join(output_dir, f"{name}_stretched.wav"))
+
+    _write_wav(final, os.path.join(output_dir, 'final_raw.wav'))
+    _write_wav(final, os.path.join(output_dir, 'final_stretched.wav'))
+
+    return final_len
+
+
+def snr_db(ref: np.ndarray, test: np.ndarray) -> np.ndarray:
+    """Per-row SNR of test against ref, in dB."""
+    noise = np.sum((ref - test) ** 2, axis=-1)
+    signal = np.sum(ref ** 2, axis=-1)
+    return 10.0 * np.log10(np.maximum(signal, 1e-20) / np.maximum(noise, 1e-20))
+
+
+def log_spectral_distance(ref: np.ndarray, test: np.ndarray, n_fft: int = 512, hop: int = 128) -> np.ndarray:
+    """Per-row log-spectral distance in dB (RMS over bins, mean over frames)."""
+    window = np.hanning(n_fft).astype(np.float32)
+
+    def power(x):
+        n_frames = 1 + (x.shape[-1] - n_fft) // hop
+        idx = np.arange(n_fft)[None, :] + hop * np.arange(n_frames)[:, None]
+        return np.abs(np.fft.rfft(x[:, idx] * window, axis=-1)) ** 2
+
+    diff = 10.0 * np.log10(power(ref) + 1e-10) - 10.0 * np.log10(power(test) + 1e-10)
+    return np.sqrt(np.mean(diff ** 2, axis=-1)).mean(axis=-1)
+
+
+def _state_bytes(G: torch.nn.Module) -> int:
+    buf = io.BytesIO()
+    torch.save(G.state_dict(), buf)
+    return buf.tell()
+
+
+def _latency_ms(G: torch.nn.Module, z: torch.Tensor, iters: int) -> float:
+    with torch.no_grad():
+        G(z)
+        t0 = time.perf_counter()
+        for _ in range(iters):
+            G(z)
+    return (time.perf_counter() - t0) / iters * 1000.0
+
+
+def quality_report(ckpt_path: str, slice_len: int = SLICE_LEN, mixed: bool = False, n: int = 32, seed: int = 4321,
+                   batch: int = 8, iters: int = 5) -> dict:
+    """Compare the int8 generator with its fp32 source on a fixed latent test set.
+
+    Reports final-output SNR and log-spectral distance (mean/min/max over the
+    set), forward latency at `batch`, and serialized weight size for both.
+    """
+    state = torch.load(ckpt_path, map_location='cpu')
+    fp32 = Fp32Generator(slice_len=slice_len).eval()
+    fp32.load_state_dict(state)
+    int8 = WaveGANGenerator(slice_len=slice_len, mixed=mixed).eval()
+    int8.load_state_dict(state)
+
+    # different seed from calibration so the test set is held out
+    z = calibration_latents(n, seed=seed, latent_dim=fp32.z_project.in_features)
+    with torch.no_grad():
+        ref = fp32(z)[:, 0, :].numpy()
+        out = int8(z)[:, 0, :].numpy()
+    snr = snr_db(ref, out)
+    lsd = log_spectral_distance(ref, out)
+
+    zb = z[:batch]
+    t_fp32 = _latency_ms(fp32, zb, iters)
+    t_int8 = _latency_ms(int8, zb, iters)
+    b_fp32 = _state_bytes(fp32)
+    b_int8 = _state_bytes(int8)
+    return {
+        'checkpoint': os.path.abspath(ckpt_path),
+        'slice_len': slice_len,
+        'mode': 'mixed' if mixed else 'int8',
+        'int8_layers': int8.int8_layers() + ([] if mixed else ['z_project']),
+        'test_set': {'n': n, 'seed': seed},
+        'snr_db': {'mean': float(snr.mean()), 'min': float(snr.min()), 'max': float(snr.max())},
+        'lsd_db': {'mean': float(lsd.mean()), 'min': float(lsd.min()), 'max': float(lsd.max())},
+        'latency_ms': {'batch': int(zb.shape[0]), 'fp32': t_fp32, 'int8': t_int8, 'speedup': t_fp32 / t_int8},
+        'weights_bytes': {'fp32': b_fp32, 'int8': b_int8, 'ratio': b_int8 / b_fp32},
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description='int8 vs fp32 quality/speed report for one checkpoint.')
+    ap.add_argument('ckpt')
+    ap.add_argument('--slice-len', type=int, default=SLICE_LEN)
+    ap.add_argument('--mixed', action='store_true', help='keep z_project and the output layer in fp32')
+    ap.add_argument('--n', type=int, default=32)
+    ap.add_argument('--seed', type=int, default=4321)
+    ap.add_argument('--batch', type=int, default=8)
+    ap.add_argument('--iters', type=int, default=5)
+    ap.add_argument('--min-snr', type=float, default=20.0, help='acceptance threshold on the worst-case SNR (dB)')
+    ap.add_argument('--max-lsd', type=float, default=2.0, help='acceptance threshold on the mean log-spectral distance (dB)')
+    ap.add_argument('--out', default=None, help='also write the report here as JSON')
+    args = ap.parse_args()
+
+    report = quality_report(args.ckpt, args.slice_len, args.mixed, args.n, args.seed, args.batch, args.iters)
+    report['acceptable'] = report['snr_db']['min'] >= args.min_snr and report['lsd_db']['mean'] <= args.max_lsd
+    report['thresholds'] = {'min_snr_db': args.min_snr, 'max_lsd_db': args.max_lsd}
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as fh:
+            fh.write(text)
+
+
+if __name__ == '__main__':
+    main()
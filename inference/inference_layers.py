@@ -2,6 +2,7 @@
 import torch
 import numpy as np
 from infowavegan_layers import WaveGANGenerator
+from generator_registry import get_generator, generator_lock
 
 SAMPLE_RATE = 16000
 SLICE_LEN = 65536
@@ -9,8 +10,7 @@ SLICE_LEN = 65536
 
 def _load_generator(ckpt_path: str, slice_len: int = SLICE_LEN):
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    G = WaveGANGenerator(slice_len=slice_len).to(device).eval()
-    G.load_state_dict(torch.load(ckpt_path, map_location=device))
+    G = get_generator(WaveGANGenerator, ckpt_path, slice_len, device)
     return G, device
 
 
@@ -24,18 +24,19 @@ def run_with_hooks(z: np.ndarray, ckpt_path: str):
             layers[name] = out.detach().cpu()
         return _fn
 
-    hs = []
-    lm = G.layer_map()
-    try:
-        for name, module in lm.items():
-            if module is None:
-                continue
-            hs.append(module.register_forward_hook(hook(name)))
-        with torch.no_grad():
-            final_t = G(z_t).detach().cpu()
-    finally:
-        for h in hs:
-            h.remove()
+    with generator_lock(G):
+        hs = []
+        lm = G.layer_map()
+        try:
+            for name, module in lm.items():
+                if module is None:
+                    continue
+                hs.append(module.register_forward_hook(hook(name)))
+            with torch.no_grad():
+                final_t = G(z_t).detach().cpu()
+        finally:
+            for h in hs:
+                h.remove()
 
     layers['final'] = final_t
     return layers
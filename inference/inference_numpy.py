@@ -0,0 +1,63 @@
+# Autore: Riccardo Petrini
+import os
+import threading
+import numpy as np
+import scipy.io.wavfile
+from infowavegan_numpy import WaveGANGenerator
+
+SAMPLE_RATE = 16000
+
+# generator_registry imports torch, so this variant keeps its own cache
+_LOCK = threading.Lock()
+_ENGINES = {}
+
+
+def _load_generator(npz_path: str):
+    key = os.path.abspath(npz_path)
+    G = _ENGINES.get(key)
+    if G is None:
+        with _LOCK:
+            G = _ENGINES.get(key)
+            if G is None:
+                G = WaveGANGenerator(npz_path)
+                _ENGINES[key] = G
+    return G
+
+
+def _write_wav(arr: np.ndarray, path: str, normalize: bool = True):
+    x = arr.astype(np.float32)
+    if normalize:
+        m = np.max(np.abs(x))
+        if m > 0:
+            x = x / m
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    scipy.io.wavfile.write(path, SAMPLE_RATE, x)
+
+
+def generate_batch(z: np.ndarray, npz_path: str) -> np.ndarray:
+    """(N, 100) latents -> (N, slice_len) float32."""
+    G = _load_generator(npz_path)
+    return G(z)[:, 0, :]
+
+
+def generate_final(z: np.ndarray, npz_path: str) -> np.ndarray:
+    return generate_batch(z, npz_path)[0]
+
+
+def generate_layers(z: np.ndarray, npz_path: str, output_dir: str):
+    os.makedirs(output_dir, exist_ok=True)
+    G = _load_generator(npz_path)
+    captured = G.forward_layers(z, G.layer_names())
+    final = captured[G.layer_names()[-1]][0, 0, :].astype(np.float32)
+    final_len = final.shape[0]
+
+    for name in G.layer_names():
+        t = captured[name][0, 0, :].astype(np.float32)
+        _write_wav(t, os.path.join(output_dir, f"{name}_raw.wav"))
+        if t.shape[0] != final_len:
+            stretch = np.interp(np.linspace(0, 1, final_len, endpoint=False), np.linspace(0, 1, t.shape[0], endpoint=False), t)
+            _write_wav(stretch.astype(np.float32), os.path.join(output_dir, f"{name}_stretched.wav"))
+
+    _write_wav(final, os.path.join(output_dir, 'final.wav'))
+
+    return final_len
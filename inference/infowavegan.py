@@ -179,6 +179,40 @@ class WaveGANGenerator(torch.nn.Module):
             output = self.upconv5(output)
         return (output)
 
+    def layer_names(self):
+        names = ['z_project', 'upconv0', 'upconv1', 'upconv2', 'upconv3', 'upconv4']
+        if self.slice_len == 65536:
+            names.append('upconv5')
+        return names
+
+    def forward_layers(self, z, layers):
+        """Run the stack only as deep as the deepest requested layer.
+
+        Returns {name: output} for each requested name ('z_project', 'upconvN');
+        layers past the deepest one are never computed.
+        """
+        names = self.layer_names()
+        wanted = set(layers)
+        unknown = wanted.difference(names)
+        if unknown:
+            raise ValueError(f"Unknown layer(s): {sorted(unknown)}")
+
+        captured = {}
+        output = self.z_project(z)
+        output = self.z_batchnorm(output.view(-1, self.dim * self.dim_mul, 16))
+        if 'z_project' in wanted:
+            captured['z_project'] = output
+        for name in names[1:]:
+            if len(captured) == len(wanted):
+                break
+            output = getattr(self, name)(output)
+            if name in wanted:
+                captured[name] = output
+        return captured
+
+    def forward_to(self, z, layer):
+        return self.forward_layers(z, [layer])[layer]
+
 
 class WaveGANDiscriminator(torch.nn.Module):
     def __init__(
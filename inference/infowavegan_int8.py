@@ -0,0 +1,100 @@
+# Autore: Riccardo Petrini
+import numpy as np
+import torch
+import torch.ao.quantization as tq
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+from infowavegan import WaveGANGenerator as _BaseWaveGANGenerator
+
+# ConvTranspose has no per-channel weight observer, so weights are per-tensor
+_CONV_QCONFIG = tq.QConfig(
+    activation=tq.HistogramObserver.with_args(reduce_range=True),
+    weight=tq.default_weight_observer,
+)
+
+
+def calibration_latents(n=32, seed=1234, latent_dim=100, n_bits=16):
+    """Fixed latent set: uniform noise with a random binary categorical code in front."""
+    rng = np.random.default_rng(seed)
+    z = rng.uniform(-1, 1, (n, latent_dim)).astype(np.float32)
+    z[:, :n_bits] = rng.integers(0, 2, (n, n_bits)).astype(np.float32)
+    return torch.from_numpy(z)
+
+
+class _QuantizedConv(torch.nn.Module):
+    def __init__(self, conv):
+        super().__init__()
+        self.quant = tq.QuantStub()
+        self.conv = conv
+        self.dequant = tq.DeQuantStub()
+
+    def forward(self, x):
+        return self.dequant(self.conv(self.quant(x)))
+
+
+class WaveGANGenerator(_BaseWaveGANGenerator):
+    """Post-training int8 variant of an fp32 checkpoint (CPU only).
+
+    load_state_dict loads the fp32 weights, folds batchnorm into the transposed
+    convs, then quantizes: z_project with dynamic int8 weights, each UpConv
+    conv statically (int8 weights + activations, calibrated on a fixed latent
+    set). mixed=True keeps z_project and the output layer in fp32.
+    """
+    def __init__(self, *args, mixed=False, calib_size=32, engine='x86', **kwargs):
+        super().__init__(*args, **kwargs)
+        self.mixed = mixed
+        self.calib_size = calib_size
+        self.engine = engine if engine in torch.backends.quantized.supported_engines else 'qnnpack'
+        torch.set_grad_enabled(False)
+
+    def load_state_dict(self, state_dict, strict=True):
+        result = super().load_state_dict(state_dict, strict=strict)
+        self.quantize_()
+        return result
+
+    def int8_layers(self):
+        names = self.layer_names()[1:]
+        if self.mixed:
+            names = names[:-1]
+        return names
+
+    def quantize_(self):
+        torch.backends.quantized.engine = self.engine
+        self.cpu().eval()
+        layers = self.int8_layers()
+
+        for name in self.layer_names()[1:]:
+            up = getattr(self, name)
+            if isinstance(up.batch_norm, torch.nn.BatchNorm1d):
+                up.conv = fuse_conv_bn_eval(up.conv, up.batch_norm, transpose=True)
+                up.batch_norm = torch.nn.Identity()
+
+        # calibrate every conv on the fp32 activations that feed it
+        inputs = {}
+        hooks = [getattr(self, name).conv.register_forward_pre_hook(self._capture(inputs, name)) for name in layers]
+        try:
+            with torch.no_grad():
+                self(calibration_latents(self.calib_size, latent_dim=self.z_project.in_features))
+        finally:
+            for h in hooks:
+                h.remove()
+
+        for name in layers:
+            up = getattr(self, name)
+            wrapped = _QuantizedConv(up.conv).eval()
+            wrapped.qconfig = _CONV_QCONFIG
+            tq.prepare(wrapped, inplace=True)
+            with torch.no_grad():
+                wrapped(inputs[name])
+            up.conv = tq.convert(wrapped)
+
+        if not self.mixed:
+            self.z_project = tq.quantize_dynamic(
+                torch.nn.Sequential(self.z_project), {torch.nn.Linear}, dtype=torch.qint8
+            )[0]
+        return self
+
+    @staticmethod
+    def _capture(store, name):
+        def _fn(module, args):
+            store[name] = args[0].detach()
+        return _fn
@@ -0,0 +1,189 @@
+# Autore: Riccardo Petrini
+import argparse
+import json
+import os
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# fixed by UpConv in infowavegan.py
+KERNEL = 25
+STRIDE = 4
+PADDING = 11
+BN_EPS = 1e-5
+# output sample 4m + r reads inputs x[m - 3 .. m + 3]; WINDOW covers every phase
+HALO = 3
+WINDOW = 2 * HALO + 1
+
+
+def polyphase_weight(w: np.ndarray) -> np.ndarray:
+    """(Cin, Cout, 25) ConvTranspose1d weight -> (Cin * 7, 4 * Cout) matmul weight.
+
+    With stride 4, padding 11, output_padding 1, output 4m + r gets tap
+    k = 4j + (r + 3) % 4 applied to input m + d_r - j (d = 2, 3, 3, 3). Laying the
+    taps out against the 7-wide input window [m - 3, m + 3] puts all four phases
+    in one matrix; the 3 slots of 28 that no tap reaches stay zero.
+    """
+    cin, cout, k = w.shape
+    assert k == KERNEL
+    out = np.zeros((cin, WINDOW, STRIDE, cout), dtype=np.float32)
+    for r in range(STRIDE):
+        c = (r + PADDING) % STRIDE
+        d = (r + PADDING - c) // STRIDE
+        for t in range(WINDOW):
+            j = d + HALO - t
+            tap = STRIDE * j + c
+            if j >= 0 and tap < KERNEL:
+                out[:, t, r, :] = w[:, :, tap]
+    return out.reshape(cin * WINDOW, STRIDE * cout)
+
+
+def _fold_bn(state: dict, prefix: str, n: int):
+    key = f"{prefix}.running_mean"
+    if key not in state:
+        return np.ones(n, np.float32), np.zeros(n, np.float32)
+    scale = state[f"{prefix}.weight"] / np.sqrt(state[f"{prefix}.running_var"] + BN_EPS)
+    shift = state[f"{prefix}.bias"] - state[key] * scale
+    return scale.astype(np.float32), shift.astype(np.float32)
+
+
+class WaveGANGenerator:
+    """NumPy-only WaveGANGenerator forward (eval mode, no torch import).
+
+    Loads the .npz written by convert_checkpoint, or a checkpoint_io
+    .safetensors file (fp32 or fp16). Batchnorm is folded into the
+    preceding weights, and each stride-4 transposed conv runs as a single
+    (N * L, Cin * 7) @ (Cin * 7, 4 * Cout) matmul over a sliding input window,
+    with activations kept channel-last so the phase interleave is a reshape.
+    Outputs match the torch module's (N, C, L) layout.
+    """
+    def __init__(self, path: str):
+        if path.endswith('.safetensors'):
+            from checkpoint_io import load_arrays, read_header
+
+            state = {k: v.astype(np.float32, copy=False) for k, v in load_arrays(path).items() if v.dtype.kind == 'f'}
+            meta = read_header(path)[1]
+        else:
+            with np.load(path, allow_pickle=False) as data:
+                state = {k: data[k].astype(np.float32, copy=False) for k in data.files if k != "__meta__"}
+                meta = json.loads(str(data["__meta__"])) if "__meta__" in data.files else {}
+        self.slice_len = int(meta.get("slice_len", 65536 if "upconv5.conv.weight" in state else 16384))
+        self.names = self._layer_names()
+
+        w = state["z_project.weight"]
+        self.latent_dim = w.shape[1]
+        self.z_channels = w.shape[0] // 16
+        scale, shift = _fold_bn(state, "z_batchnorm", self.z_channels)
+        # fold per-channel BN, and reorder the Linear outputs from (C, 16) to (16, C) for channel-last
+        w = w.reshape(self.z_channels, 16, -1) * scale[:, None, None]
+        b = state["z_project.bias"].reshape(self.z_channels, 16) * scale[:, None] + shift[:, None]
+        self.z_weight = np.ascontiguousarray(w.transpose(1, 0, 2).reshape(-1, self.latent_dim).T)
+        self.z_bias = np.ascontiguousarray(b.T.reshape(-1))
+
+        self.convs = {}
+        for name in self.names[1:]:
+            w = state[f"{name}.conv.weight"]
+            scale, shift = _fold_bn(state, f"{name}.batch_norm", w.shape[1])
+            bias = state[f"{name}.conv.bias"] * scale + shift
+            self.convs[name] = (polyphase_weight(w * scale[None, :, None]), np.tile(bias, STRIDE), w.shape[1])
+
+    def _layer_names(self):
+        names = ['z_project', 'upconv0', 'upconv1', 'upconv2', 'upconv3', 'upconv4']
+        if self.slice_len == 65536:
+            names.append('upconv5')
+        return names
+
+    def layer_names(self):
+        return list(self.names)
+
+    def _upconv(self, x: np.ndarray, name: str) -> np.ndarray:
+        """x: (N, L, Cin) channel-last -> (N, 4L, Cout)."""
+        w, b, cout = self.convs[name]
+        n, length, cin = x.shape
+        xp = np.pad(x, ((0, 0), (HALO, HALO), (0, 0)))
+        cols = sliding_window_view(xp, WINDOW, axis=1).reshape(n * length, cin * WINDOW)
+        y = cols @ w
+        y += b
+        if name == self.names[-1]:
+            np.tanh(y, out=y)
+        else:
+            np.maximum(y, 0.0, out=y)
+        return y.reshape(n, length * STRIDE, cout)
+
+    def forward_layers(self, z, layers):
+        """Same contract as the torch version: {name: (N, C, L)} for each requested layer, stopping at the deepest."""
+        wanted = set(layers)
+        unknown = wanted.difference(self.names)
+        if unknown:
+            raise ValueError(f"Unknown layer(s): {sorted(unknown)}")
+
+        z = np.asarray(z, dtype=np.float32).reshape(-1, self.latent_dim)
+        out = (z @ self.z_weight + self.z_bias).reshape(z.shape[0], 16, self.z_channels)
+        captured = {}
+        if 'z_project' in wanted:
+            captured['z_project'] = out.transpose(0, 2, 1)
+        for name in self.names[1:]:
+            if len(captured) == len(wanted):
+                break
+            out = self._upconv(out, name)
+            if name in wanted:
+                captured[name] = out.transpose(0, 2, 1)
+        return captured
+
+    def forward_to(self, z, layer):
+        return self.forward_layers(z, [layer])[layer]
+
+    def forward(self, z):
+        return self.forward_to(z, self.names[-1])
+
+    __call__ = forward
+
+
+def convert_checkpoint(ckpt_path: str, out_path: str = None) -> str:
+    """Torch _G.pt state dict -> .npz of float32 arrays (the only step that needs torch)."""
+    import torch
+
+    state = torch.load(ckpt_path, map_location='cpu')
+    arrays = {k: v.detach().cpu().numpy().astype(np.float32) for k, v in state.items() if v.dtype.is_floating_point}
+    meta = {
+        'slice_len': 65536 if 'upconv5.conv.weight' in arrays else 16384,
+        'source': os.path.basename(ckpt_path),
+    }
+    out_path = out_path or os.path.splitext(ckpt_path)[0] + '.npz'
+    np.savez(out_path, __meta__=np.array(json.dumps(meta)), **arrays)
+    return out_path
+
+
+def check_against_torch(ckpt_path: str, npz_path: str, variant: str = 'infowavegan', batch: int = 4, seed: int = 0, **kwargs) -> dict:
+    """Max abs difference per layer between this engine and the torch module on random latents."""
+    import importlib
+    import torch
+
+    engine = WaveGANGenerator(npz_path)
+    G = importlib.import_module(variant).WaveGANGenerator(slice_len=engine.slice_len, **kwargs).eval()
+    G.load_state_dict(torch.load(ckpt_path, map_location='cpu'))
+    z = np.random.default_rng(seed).uniform(-1, 1, (batch, engine.latent_dim)).astype(np.float32)
+    names = engine.layer_names()
+    mine = engine.forward_layers(z, names)
+    with torch.no_grad():
+        ref = G.forward_layers(torch.from_numpy(z), names)
+    return {name: float(np.abs(mine[name] - ref[name].numpy()).max()) for name in names}
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Convert a generator checkpoint for the NumPy engine and check it against torch.')
+    ap.add_argument('ckpt')
+    ap.add_argument('--out', default=None)
+    ap.add_argument('--check', action='store_true', help='compare every layer against the torch module')
+    ap.add_argument('--variant', default='infowavegan')
+    ap.add_argument('--batchnorm', action='store_true')
+    args = ap.parse_args()
+
+    out = convert_checkpoint(args.ckpt, args.out)
+    print(out)
+    if args.check:
+        kwargs = {'use_batchnorm': True} if args.batchnorm else {}
+        print(json.dumps(check_against_torch(args.ckpt, out, args.variant, **kwargs), indent=2))
+
+
+if __name__ == '__main__':
+    main()
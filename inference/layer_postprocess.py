@@ -0,0 +1,88 @@
+# Autore: Riccardo Petrini
+import numpy as np
+
+_INDEX_CACHE = {}
+
+
+def _is_tensor(x):
+    return hasattr(x, 'detach') and hasattr(x, 'device')
+
+
+def _stretch_index(lengths, target_len):
+    """Flat gather indices + weights that reproduce np.interp(linspace(dst), linspace(src), x) for every layer at once."""
+    key = (tuple(lengths), target_len)
+    cached = _INDEX_CACHE.get(key)
+    if cached is not None:
+        return cached
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    pos = np.arange(target_len, dtype=np.float64)
+    i0 = np.empty((len(lengths), target_len), dtype=np.int64)
+    i1 = np.empty_like(i0)
+    frac = np.empty((len(lengths), target_len), dtype=np.float32)
+    for row, (n, off) in enumerate(zip(lengths, offsets)):
+        src = pos * n / target_len
+        lo = np.floor(src).astype(np.int64)
+        # past the last source sample np.interp holds the end value
+        lo = np.minimum(lo, n - 1)
+        i0[row] = off + lo
+        i1[row] = off + np.minimum(lo + 1, n - 1)
+        frac[row] = np.clip(src - lo, 0.0, 1.0)
+    cached = (i0, i1, frac, offsets)
+    _INDEX_CACHE[key] = cached
+    return cached
+
+
+def _normalize_rows(x, xp):
+    peak = xp.abs(x).max(axis=-1, keepdims=True) if xp is np else x.abs().amax(dim=-1, keepdim=True)
+    peak[peak == 0] = 1.0
+    return x / peak
+
+
+def postprocess_layers(captured, target_len, normalize=True):
+    """Stretch + peak-normalize every captured layer in one batch.
+
+    `captured` maps layer name -> 1-D activation (channel 0 of one row), as torch
+    tensors on any device or NumPy arrays. All layers are concatenated into one
+    buffer, resampled with a single gather/lerp to (n_layers, target_len) on the
+    tensor's device, normalized per row, and copied to the host in one transfer.
+    Returns {name: (raw, stretched)} float32 NumPy arrays, ready for the WAV encoder.
+    """
+    names = list(captured)
+    if not names:
+        return {}
+    values = [captured[name] for name in names]
+    lengths = [int(v.shape[-1]) for v in values]
+    i0, i1, frac, offsets = _stretch_index(lengths, target_len)
+
+    if _is_tensor(values[0]):
+        import torch
+
+        device = values[0].device
+        flat = torch.cat([v.detach().reshape(-1).to(torch.float32) for v in values])
+        g0 = torch.from_numpy(i0).to(device)
+        g1 = torch.from_numpy(i1).to(device)
+        w = torch.from_numpy(frac).to(device)
+        stretched = flat[g0] * (1.0 - w) + flat[g1] * w
+        raw = flat
+        if normalize:
+            stretched = _normalize_rows(stretched, torch)
+            seg = torch.repeat_interleave(torch.arange(len(lengths), device=device), torch.tensor(lengths, device=device))
+            peak = torch.zeros(len(lengths), device=device).scatter_reduce(0, seg, flat.abs(), reduce='amax')
+            peak[peak == 0] = 1.0
+            raw = flat / peak[seg]
+        raw = raw.cpu().numpy()
+        stretched = stretched.cpu().numpy()
+    else:
+        flat = np.concatenate([np.asarray(v, dtype=np.float32).reshape(-1) for v in values])
+        stretched = flat[i0] * (1.0 - frac) + flat[i1] * frac
+        raw = flat
+        if normalize:
+            stretched = _normalize_rows(stretched, np)
+            peak = np.maximum.reduceat(np.abs(flat), offsets)
+            peak[peak == 0] = 1.0
+            raw = flat / np.repeat(peak, lengths)
+
+    out = {}
+    for row, (name, off, n) in enumerate(zip(names, offsets, lengths)):
+        out[name] = (raw[off:off + n].astype(np.float32, copy=False), stretched[row].astype(np.float32, copy=False))
+    return out